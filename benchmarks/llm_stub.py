@@ -0,0 +1,131 @@
+"""
+Serveur local déterministe compatible avec l'API Responses d'OpenAI (POST /v1/responses).
+
+La réponse ne dépend que du prompt : extraction client -> JSON construit depuis l'en-tête,
+sinon un court rapport texte. `latency` simule le temps de réponse du modèle.
+
+    python -m benchmarks.llm_stub --port 8000
+    OPENAI_BASE_URL=http://127.0.0.1:8000/v1 OPENAI_API_KEY=stub streamlit run streamlit_app.py
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HEADER_RE = re.compile(r"Texte:\s*(.*?)\s*Retourne un JSON", re.S)
+STREAM_CHUNK = 40
+
+
+def client_info_reply(header: str) -> dict:
+    """En-tête -> champs client : premiers mots hors nombres comme nom, premier NPA à 4 chiffres."""
+    words = [w for w in header.split() if not re.fullmatch(r"[\d\W]+", w)]
+    code = re.search(r"\b\d{5}\b", header)
+    zip_city = re.search(r"\b(\d{4})\s+([^\d\s]+)", header)
+    return {
+        "client_code": code.group(0) if code else None,
+        "client_name": " ".join(words[:3]) or None,
+        "contact_name": None,
+        "address": None,
+        "zip": zip_city.group(1) if zip_city else None,
+        "city": zip_city.group(2) if zip_city else None,
+        "country": None,
+    }
+
+
+def reply_text(prompt: str) -> str:
+    header = HEADER_RE.search(prompt)
+    if header:
+        return json.dumps(client_info_reply(header.group(1)), ensure_ascii=False)
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+    return f"Stub report {digest}: {len(prompt)} chars analysed, no anomaly reported."
+
+
+def _usage(prompt: str, text: str) -> dict:
+    # ~4 caractères par token, comme l'estimation de utils.prompt_builder sans tiktoken
+    input_tokens, output_tokens = len(prompt) // 4, len(text) // 4
+    return {"input_tokens": input_tokens, "input_tokens_details": {"cached_tokens": 0},
+            "output_tokens": output_tokens, "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": input_tokens + output_tokens}
+
+
+def _response(body: dict, text: str, status: str = "completed") -> dict:
+    content = [{"type": "output_text", "text": text, "annotations": []}] if text is not None else []
+    return {
+        "id": "resp_stub", "object": "response", "created_at": int(time.time()), "model": body.get("model"),
+        "status": status, "parallel_tool_calls": False, "tool_choice": "auto", "tools": [],
+        "output": [{"type": "message", "id": "msg_stub", "role": "assistant", "status": status,
+                    "content": content}],
+        "usage": _usage(_prompt(body), text or ""),
+    }
+
+
+def _prompt(body: dict) -> str:
+    value = body.get("input", "")
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+
+def make_handler(latency: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.rstrip("/").endswith("/responses"):
+                self.send_error(404)
+                return
+            text = reply_text(_prompt(body))
+            if latency:
+                time.sleep(latency)
+            if body.get("stream"):
+                self._stream(body, text)
+            else:
+                self._send(200, "application/json", json.dumps(_response(body, text)).encode("utf-8"))
+
+        def _send(self, code: int, content_type: str, payload: bytes) -> None:
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _stream(self, body: dict, text: str) -> None:
+            events = [{"type": "response.created", "response": _response(body, None, status="in_progress")}]
+            for i in range(0, len(text), STREAM_CHUNK):
+                events.append({"type": "response.output_text.delta", "item_id": "msg_stub", "output_index": 0,
+                               "content_index": 0, "delta": text[i:i + STREAM_CHUNK], "logprobs": []})
+            events.append({"type": "response.completed", "response": _response(body, text)})
+            payload = b"".join(
+                f"event: {e['type']}\ndata: {json.dumps(dict(e, sequence_number=n))}\n\n".encode("utf-8")
+                for n, e in enumerate(events)
+            )
+            self._send(200, "text/event-stream", payload)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def start_stub(port: int = 0, latency: float = 0.0) -> tuple:
+    """Démarre le serveur dans un thread ; retourne (serveur, base_url pour OPENAI_BASE_URL)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(latency))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="llm-stub", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serveur LLM déterministe pour les tests et benchmarks.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="délai simulé par réponse (secondes)")
+    args = parser.parse_args(argv)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(args.latency))
+    print(f"LLM stub on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
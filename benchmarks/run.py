@@ -0,0 +1,461 @@
+"""
+Benchmarks reproductibles du pipeline sur documents/pdfs et documents/table.
+
+    python -m benchmarks.run --no-ocr                                   # échelle 1, comparé à la référence
+    python -m benchmarks.run --scale 1 10 100 -o results.json
+    python -m benchmarks.run --no-ocr --scale 1 10 100 --save-baseline  # met à jour la référence
+
+Étapes mesurées : extraction des PDF (texte / scannés), parsing xlsx à froid, chargement
+des snapshots, construction des index, audit géographique de clienti, recherche et
+résolution client (et de son groupe), assemblage du rapport (contrôles + prompt) et appel LLM, servi par
+un serveur local déterministe (benchmarks.llm_stub). Chaque échelle tourne dans un
+process neuf, dans un cache temporaire : le pic mémoire est celui de l'échelle, et le
+cache du poste n'est pas touché.
+Code de sortie 1 si une étape régresse au-delà de --tolerance par rapport à la référence :
+le p50 et la meilleure mesure (min) doivent tous deux dépasser la référence, d'un écart
+supérieur au bruit (NOISE_FLOOR_MS, NOISE_MADS fois la dispersion des répétitions, ou
+l'écart entre les passages de la référence), et ce au meilleur de --confirm passages
+supplémentaires des échelles concernées. La référence (--save-baseline) retient les
+valeurs médianes de 1 + --confirm passages.
+Code 2, sans comparaison, si la référence a été mesurée avec un autre réglage OCR ou un
+autre nombre de cœurs.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+PDF_DIR = Path("documents/pdfs")
+BASELINE = Path(__file__).parent / "baselines" / "baseline.json"
+
+# en dessous, un écart relatif est du bruit de mesure
+NOISE_FLOOR_MS = 5.0
+# écart minimal, en écarts absolus médians (MAD) des mesures, pour parler de régression
+NOISE_MADS = 3.0
+
+
+class Samples:
+    """Durées mesurées par étape, avec le volume traité (lignes, requêtes, contrats...)."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def time(self, stage: str, fn, *args, units: int = 1, unit: str = "calls", **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.add(stage, time.perf_counter() - start, units=units, unit=unit)
+        return result
+
+    def add(self, stage: str, seconds: float, units: int = 1, unit: str = "calls") -> None:
+        entry = self.stages.setdefault(stage, {"durations": [], "units": 0, "unit": unit, "errors": 0})
+        entry["durations"].append(seconds)
+        entry["units"] += units
+
+    def error(self, stage: str, unit: str = "calls") -> None:
+        self.stages.setdefault(stage, {"durations": [], "units": 0, "unit": unit, "errors": 0})["errors"] += 1
+
+    def summary(self) -> dict:
+        out = {}
+        for stage, entry in self.stages.items():
+            d = np.array(entry["durations"]) * 1000
+            total_s = d.sum() / 1000
+            out[stage] = {
+                "n": len(d),
+                "p50_ms": round(float(np.percentile(d, 50)), 3) if len(d) else None,
+                "p95_ms": round(float(np.percentile(d, 95)), 3) if len(d) else None,
+                "min_ms": round(float(d.min()), 3) if len(d) else None,
+                "mad_ms": round(float(np.median(np.abs(d - np.median(d)))), 3) if len(d) else None,
+                "total_s": round(float(total_s), 4),
+                "throughput": round(entry["units"] / total_s, 2) if total_s else None,
+                "unit": f"{entry['unit']}/s",
+                "errors": entry["errors"],
+            }
+        return out
+
+
+def _peak_rss_mb():
+    from utils.tracing import peak_rss_bytes
+    peak = peak_rss_bytes()
+    return round(peak / (1024 * 1024), 1) if peak is not None else None
+
+
+def _read_pdfs() -> list:
+    return [(p.name, p.read_bytes()) for p in sorted(PDF_DIR.glob("*.pdf"))]
+
+
+def _is_scanned(data: bytes) -> bool:
+    import fitz
+    from utils.pdf_utils import needs_ocr
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        return any(needs_ocr(page, page.get_text()) for page in doc)
+
+
+def cold_table_loads() -> dict:
+    """Parsing xlsx -> snapshot Parquet de chaque table, dans un cache vide (process dédié)."""
+    from utils.table_store import TABLES, load_table
+
+    samples = Samples()
+    for name in TABLES:
+        start = time.perf_counter()
+        df = load_table(name)
+        samples.add("tables.xlsx_parse", time.perf_counter() - start, units=len(df), unit="rows")
+    return {"stages": samples.summary(), "peak_rss_mb": _peak_rss_mb()}
+
+
+def _extract_pdfs(samples: Samples, pdfs: list, ocr: bool, repeat: int) -> dict:
+    from utils.pdf_utils import extract_pages
+    from utils.price_tables import extract_price_table
+
+    extracted = {}
+    for _ in range(repeat):
+        for name, data in pdfs:
+            stage = "pdf.extract.scanned" if _is_scanned(data) else "pdf.extract.digital"
+            try:
+                pages = samples.time(stage, extract_pages, data, ocr=ocr, use_cache=False, unit="pdfs")
+            except Exception as e:
+                # OCR indisponible (modèles EasyOCR absents) : couche texte seule pour la suite
+                print(f"  {name}: {type(e).__name__}: {e}", file=sys.stderr)
+                samples.error(stage, unit="pdfs")
+                pages = extract_pages(data, ocr=False, use_cache=False)
+            prices = samples.time("pdf.price_table", extract_price_table, pages, unit="pdfs")
+            extracted[name] = ("".join(p["text"] for p in pages), prices)
+    return extracted
+
+
+def _text_only(pdfs: list) -> dict:
+    """Textes des PDF pour les étapes en aval, depuis le cache (hors mesure)."""
+    from utils.pdf_utils import extract_pages
+    from utils.price_tables import extract_price_table
+
+    out = {}
+    for name, data in pdfs:
+        pages = extract_pages(data, ocr=False)
+        out[name] = ("".join(p["text"] for p in pages), extract_price_table(pages))
+    return out
+
+
+def run_scale(scale: int, repeat: int, queries: int, ocr: bool, workdir: str) -> dict:
+    """Toutes les étapes pour des tables agrandies `scale` fois (exécuté dans un process neuf)."""
+    import pandas as pd
+    import pyarrow.parquet as pq
+
+    from benchmarks.llm_stub import start_stub
+    from benchmarks.synthetic import pipeline_columns, sample_names, scale_table
+    from utils.ai_checks import build_analysis_prompt
+    from utils.diff_engine import run_checks
+    from utils.geo import GeoIndex, address_audit, postcode_centroids
+    from utils.groups import GroupIndex
+    from utils.llm_client import complete
+    from utils.name_index import NameIndex
+    from utils.relations import RelationIndex, build_report_data
+    from utils.table_store import TABLES, ensure_snapshot
+
+    server, base_url = start_stub()
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+    samples = Samples()
+    pdfs = _read_pdfs()
+    if scale == 1:
+        from utils.batch import identify
+        from utils.client_info import parse_client_header
+        contracts = _extract_pdfs(samples, pdfs, ocr, repeat)
+        for name, (text, _) in contracts.items():
+            samples.time("customer.header_parse", parse_client_header, text, unit="contracts")
+            samples.time("customer.identify", identify, text, unit="contracts")
+    else:
+        contracts = _text_only(pdfs)
+
+    # tables réduites aux colonnes du pipeline, agrandies puis relues comme un snapshot
+    paths = {}
+    for name in TABLES:
+        snapshot = ensure_snapshot(name)
+        columns = pipeline_columns(name, pq.read_schema(snapshot).names)
+        scaled = scale_table(name, pd.read_parquet(snapshot, columns=columns), scale)
+        paths[name] = Path(workdir) / f"{name}.x{scale}.parquet"
+        scaled.to_parquet(paths[name], index=False)
+        del scaled
+
+    tables = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tables = {name: pd.read_parquet(path) for name, path in paths.items()}
+        samples.add("tables.snapshot_load", time.perf_counter() - start,
+                    units=sum(len(t) for t in tables.values()), unit="rows")
+
+    for _ in range(repeat):
+        names = samples.time("names.index_build", NameIndex, tables["clienti"], units=len(tables["clienti"]),
+                             unit="rows")
+        relations = samples.time("relations.index_build", RelationIndex, tables,
+                                 units=sum(len(t) for t in tables.values()), unit="rows")
+        groups = samples.time("groups.index_build", GroupIndex, tables,
+                              units=sum(len(t) for t in tables.values()), unit="rows")
+        samples.time("geo.index_build", GeoIndex, tables["clienti"], units=len(tables["clienti"]), unit="rows")
+        postcodes = postcode_centroids(tables["clienti"]).set_index("zip")
+        samples.time("geo.address_audit", address_audit, tables["clienti"], postcodes,
+                     units=len(tables["clienti"]), unit="rows")
+
+    bundles = []
+    for query in sample_names(tables["clienti"], queries):
+        candidates = samples.time("customer.search", names.search, query, unit="queries")
+        if candidates:
+            samples.time("customer.resolve_group", groups.resolve_group, candidates[0]["CLI_COD"], unit="customers")
+            bundle = samples.time("customer.resolve", relations.resolve_customer, candidates[0]["CLI_COD"],
+                                  unit="customers")
+            bundles.append(({"client_name": query}, bundle))
+
+    # un contrat du corpus par client résolu, en boucle sur les PDF
+    items = list(contracts.values())
+    for i, (info, bundle) in enumerate(bundles[:max(len(items), 1) * 5]):
+        text, prices = items[i % len(items)]
+        start = time.perf_counter()
+        report_data = build_report_data(info, bundle)
+        findings = run_checks([{"id": i, "report_data": report_data, "text": text, "prices": prices}])
+        prompt = build_analysis_prompt(report_data, text, findings)
+        samples.add("report.assemble", time.perf_counter() - start, unit="contracts")
+        samples.time("report.llm_stub", complete, prompt, use_cache=False, unit="contracts")
+
+    server.shutdown()
+    return {
+        "rows": {name: len(t) for name, t in tables.items()},
+        "stages": samples.summary(),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _set_env(env: dict) -> None:
+    os.environ.update(env)
+
+
+def _in_process(env: dict, fn, *args):
+    """Exécute fn dans un process neuf (spawn) avec `env` : imports, caches et pic mémoire propres."""
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_set_env, initargs=(env,)) as pool:
+        return pool.submit(fn, *args).result()
+
+
+def _meta() -> dict:
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": revision,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def run(scales, repeat: int = 3, queries: int = 200, ocr: bool = True, keep: bool = False,
+        cold: bool = True) -> dict:
+    workdir = tempfile.mkdtemp(prefix="vega-bench-")
+    env = {"VEGA_CACHE_DIR": str(Path(workdir) / "cache"), "VEGA_HISTORY_DB": str(Path(workdir) / "history.sqlite")}
+    results = {"meta": dict(_meta(), repeat=repeat, queries=queries, ocr=ocr), "scales": {}}
+    try:
+        if cold:
+            print("cold xlsx loads...", file=sys.stderr)
+            results["cold"] = _in_process(env, cold_table_loads)
+        for scale in scales:
+            print(f"scale x{scale}...", file=sys.stderr)
+            results["scales"][str(scale)] = _in_process(env, run_scale, scale, repeat, queries, ocr, workdir)
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def incompatible(results: dict, baseline: dict) -> list:
+    """Réglages qui rendent la comparaison sans objet : OCR ou non, nombre de cœurs."""
+    return [
+        f"{key}: {baseline['meta'].get(key)} (baseline) vs {results['meta'].get(key)}"
+        for key in ("ocr", "cpus") if baseline["meta"].get(key) != results["meta"].get(key)
+    ]
+
+
+def _regression(current: float, baseline: float, tolerance: float, noise: float = NOISE_FLOOR_MS) -> bool:
+    if current is None or not baseline:
+        return False
+    return current > baseline * (1 + tolerance) and current - baseline > noise
+
+
+def _noise_ms(stats: dict, ref: dict) -> float:
+    """
+    Écart absolu en dessous duquel une différence est du bruit : plancher fixe, dispersion
+    des répétitions, ou écart des p50 entre les passages de la référence.
+    """
+    spread = max(stats.get("mad_ms") or 0.0, ref.get("mad_ms") or 0.0)
+    return max(NOISE_FLOOR_MS, NOISE_MADS * spread, ref.get("run_spread_ms") or 0.0)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Étapes dont le p50 dépasse la référence de plus de `tolerance` (relatif) et du bruit
+    (_noise_ms), confirmé par la meilleure mesure des répétitions : un p50 gonflé par
+    quelques mesures lentes ne suffit pas. Le p95, trop bruité sur quelques dizaines de
+    mesures, est affiché mais ne fait pas échouer.
+    """
+    regressions = []
+    sections = [("cold", results.get("cold"), baseline.get("cold"))] + [
+        (f"x{scale}", res, baseline.get("scales", {}).get(scale)) for scale, res in results["scales"].items()
+    ]
+    for label, current, base in sections:
+        if not current or not base:
+            continue
+        for stage, stats in current["stages"].items():
+            ref = base["stages"].get(stage)
+            if ref is None:
+                continue
+            noise = _noise_ms(stats, ref)
+            confirmed = "min_ms" not in ref or _regression(stats.get("min_ms"), ref["min_ms"], tolerance, noise)
+            if _regression(stats["p50_ms"], ref["p50_ms"], tolerance, noise) and confirmed:
+                regressions.append((label, stage, "p50_ms", ref["p50_ms"], stats["p50_ms"]))
+    return regressions
+
+
+def _keep_fastest(results: dict, rerun: dict) -> None:
+    """Pour chaque étape repassée, garde le passage au p50 le plus bas (et le meilleur min)."""
+    sections = [(results.get("cold"), rerun.get("cold"))] + [
+        (results["scales"].get(scale), res) for scale, res in rerun["scales"].items()
+    ]
+    for current, again in sections:
+        if not current or not again:
+            continue
+        for stage, stats in again["stages"].items():
+            kept = current["stages"].get(stage)
+            if kept is None:
+                current["stages"][stage] = stats
+                continue
+            best_min = min((v for v in (kept["min_ms"], stats["min_ms"]) if v is not None), default=None)
+            if stats["p50_ms"] is not None and (kept["p50_ms"] is None or stats["p50_ms"] < kept["p50_ms"]):
+                kept = current["stages"][stage] = dict(stats)
+            kept["min_ms"] = best_min
+
+
+def _merge_runs(results: dict, reruns: list) -> None:
+    """
+    Référence sur plusieurs passages : p50 et p95 médians, meilleur min, et l'écart des p50
+    entre passages (run_spread_ms), le bruit d'un passage à l'autre que compare() tolère.
+    """
+    sections = [("cold", results.get("cold"))] + [(scale, res) for scale, res in results["scales"].items()]
+    for name, current in sections:
+        if not current:
+            continue
+        others = [r.get("cold") if name == "cold" else r["scales"].get(name) for r in reruns]
+        for stage, stats in current["stages"].items():
+            runs = [stats] + [o["stages"][stage] for o in others if o and stage in o["stages"]]
+            p50s = [r["p50_ms"] for r in runs if r["p50_ms"] is not None]
+            if not p50s:
+                continue
+            stats.update(
+                p50_ms=round(float(np.median(p50s)), 3),
+                p95_ms=round(float(np.median([r["p95_ms"] for r in runs if r["p95_ms"] is not None])), 3),
+                min_ms=min(r["min_ms"] for r in runs if r["min_ms"] is not None),
+                mad_ms=round(float(np.median([r["mad_ms"] for r in runs if r["mad_ms"] is not None])), 3),
+                run_spread_ms=round(max(p50s) - min(p50s), 3),
+            )
+
+
+def _delta(current, baseline) -> str:
+    if current is None or not baseline:
+        return ""
+    return f"{(current - baseline) / baseline:+.0%}"
+
+
+def print_report(results: dict, baseline: dict = None) -> None:
+    sections = [("cold", results.get("cold"))] + [(f"x{s}", r) for s, r in results["scales"].items()]
+    header = f"{'stage':28} {'n':>5} {'p50 ms':>10} {'p95 ms':>10} {'throughput':>20} {'vs p50':>8} {'vs p95':>8}"
+    for label, res in sections:
+        if not res:
+            continue
+        if label == "cold":
+            base = (baseline or {}).get("cold") or {}
+        else:
+            base = (baseline or {}).get("scales", {}).get(label[1:]) or {}
+        rows = f" — rows {res['rows']}" if "rows" in res else ""
+        print(f"\n[{label}] peak RSS {res['peak_rss_mb']} MB"
+              f"{' (baseline ' + str(base.get('peak_rss_mb')) + ' MB)' if base else ''}{rows}")
+        print(header)
+        for stage, s in res["stages"].items():
+            ref = base.get("stages", {}).get(stage, {})
+            throughput = f"{s['throughput']} {s['unit']}" if s["throughput"] is not None else "-"
+            errors = f"  ({s['errors']} error(s))" if s["errors"] else ""
+            print(f"{stage:28} {s['n']:>5} {s['p50_ms']!s:>10} {s['p95_ms']!s:>10} {throughput:>20} "
+                  f"{_delta(s['p50_ms'], ref.get('p50_ms')):>8} {_delta(s['p95_ms'], ref.get('p95_ms')):>8}{errors}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks du pipeline (LLM remplacé par un serveur local).")
+    parser.add_argument("--scale", type=int, nargs="+", default=[1], help="facteurs d'agrandissement des tables")
+    parser.add_argument("--repeat", type=int, default=3, help="répétitions des extractions, chargements et constructions d'index")
+    parser.add_argument("--queries", type=int, default=200, help="recherches client par échelle")
+    parser.add_argument("--no-ocr", action="store_true", help="n'OCRise pas les PDF scannés (couche texte seule)")
+    parser.add_argument("-o", "--output", default=None, help="écrit les résultats JSON dans ce fichier")
+    parser.add_argument("--baseline", default=str(BASELINE), help="référence à comparer")
+    parser.add_argument("--save-baseline", action="store_true", help="enregistre les résultats comme référence")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="écart relatif toléré sur le p50")
+    parser.add_argument("--confirm", type=int, default=2,
+                        help="passages supplémentaires (process neufs) : des échelles en régression avant "
+                             "de conclure, de toutes les échelles pour --save-baseline (médiane)")
+    parser.add_argument("--keep", action="store_true", help="garde le dossier temporaire (cache, tables agrandies)")
+    args = parser.parse_args(argv)
+
+    results = run(args.scale, repeat=args.repeat, queries=args.queries, ocr=not args.no_ocr, keep=args.keep)
+    if args.save_baseline:
+        # plusieurs passages : la référence porte aussi le bruit d'un passage à l'autre
+        reruns = []
+        for attempt in range(args.confirm):
+            print(f"baseline run {attempt + 2}...", file=sys.stderr)
+            reruns.append(run(args.scale, repeat=args.repeat, queries=args.queries, ocr=not args.no_ocr))
+        _merge_runs(results, reruns)
+    baseline_path = Path(args.baseline)
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() and not args.save_baseline else None
+    if baseline and baseline["meta"].get("machine") != results["meta"]["machine"]:
+        print(f"warning: baseline recorded on {baseline['meta'].get('platform')}", file=sys.stderr)
+    mismatched = incompatible(results, baseline) if baseline else []
+    print_report(results, None if mismatched else baseline)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"\nbaseline saved to {baseline_path}")
+        return 0
+
+    if mismatched:
+        print(f"\nnot compared to {baseline_path}: {'; '.join(mismatched)}", file=sys.stderr)
+        return 2
+    regressions = compare(results, baseline, args.tolerance) if baseline else []
+    # un ralentissement passager du poste touche un passage, pas tous : on repasse avant de conclure
+    for attempt in range(args.confirm):
+        if not regressions:
+            break
+        labels = {label for label, *_ in regressions}
+        print(f"\n{len(regressions)} regression(s) to confirm, run {attempt + 2}...", file=sys.stderr)
+        rerun = run([int(label[1:]) for label in sorted(labels - {"cold"})], repeat=args.repeat,
+                    queries=args.queries, ocr=not args.no_ocr, cold="cold" in labels)
+        _keep_fastest(results, rerun)
+        regressions = compare(results, baseline, args.tolerance)
+    if baseline:
+        print(f"\ncompared to {baseline_path} ({baseline['meta'].get('revision')}, {baseline['meta'].get('date')})")
+    for label, stage, metric, before, after in regressions:
+        print(f"REGRESSION [{label}] {stage} {metric}: {before} -> {after} ms")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
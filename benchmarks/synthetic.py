@@ -0,0 +1,101 @@
+"""
+Agrandissement synthétique des tables Vega (×10, ×100) pour les benchmarks.
+
+Chaque copie décale les clés (CLI_COD, CTB_COD, ...) et leurs références d'un même
+pas, de sorte que les jointures client -> comptes -> contrats -> points de vente ->
+modèles restent cohérentes ; les noms clients reçoivent un suffixe propre à la copie
+pour que l'index de noms ne voie pas les mêmes chaînes répétées, et les holdings
+(CTB_HOLDING) aussi, pour que les groupes ne fusionnent pas d'une copie à l'autre.
+Seules les colonnes lues par le pipeline sont gardées (les tables complètes ×100
+dépasseraient la mémoire d'un poste de travail).
+"""
+import string
+
+import numpy as np
+import pandas as pd
+
+from utils.groups import NO_HOLDING
+from utils.name_index import NAME_COLUMNS
+from utils.relations import (COLUMNS_ACCOUNTS, COLUMNS_CLIENTI, COLUMNS_CONTRACTS, COLUMNS_MODELLI,
+                             COLUMNS_UNOPV, _key)
+
+# pas de décalage des clés numériques entre deux copies
+KEY_STEP = 10 ** 9
+
+# colonnes clés par table (la clé propre et les références vers d'autres tables)
+KEY_COLUMNS = {
+    "clienti": ["CLI_COD"],
+    "ctbcont": ["CTB_COD"],
+    "contratti": ["CNTR_NUMEROCONTRATTO", "CNTR_SEDELEGALE", "CNTR_CLIENTE"],
+    "unopv": ["UPV_COD", "UPV_CLI", "UPV_MOD"],
+    "modelli": ["MOD_COD"],
+}
+
+PIPELINE_COLUMNS = {
+    "clienti": COLUMNS_CLIENTI + NAME_COLUMNS,
+    "ctbcont": COLUMNS_ACCOUNTS + ["CTB_HOLDING"],
+    "contratti": COLUMNS_CONTRACTS,
+    "unopv": COLUMNS_UNOPV,
+    "modelli": COLUMNS_MODELLI,
+}
+
+
+def pipeline_columns(name: str, available) -> list:
+    """Colonnes de `name` utilisées par le pipeline, dans l'ordre, sans doublon."""
+    wanted = dict.fromkeys(KEY_COLUMNS[name] + PIPELINE_COLUMNS[name])
+    return [c for c in wanted if c in set(available)]
+
+
+def copy_suffix(copy: int) -> str:
+    """0 -> '', 1 -> 'xb', 27 -> 'xbb' : suffixe alphabétique (les chiffres sont des jetons à part)."""
+    if copy == 0:
+        return ""
+    letters = []
+    while copy:
+        copy, rest = divmod(copy, 26)
+        letters.append(string.ascii_lowercase[rest])
+    return "x" + "".join(reversed(letters))
+
+
+def _shift_keys(series: pd.Series, copy: int) -> pd.Series:
+    if copy == 0:
+        return series
+    if pd.api.types.is_numeric_dtype(series):
+        return series + copy * KEY_STEP
+    # clés texte : les codes numériques ("123") restent joignables aux colonnes entières
+    numeric = pd.to_numeric(series, errors="coerce")
+    shifted = (numeric + copy * KEY_STEP).map(lambda v: str(_key(v)))
+    text = series.astype(str) + f"~{copy}"
+    return shifted.where(numeric.notna(), text.where(series.notna(), None))
+
+
+def scale_table(name: str, df: pd.DataFrame, factor: int) -> pd.DataFrame:
+    """`factor` copies de `df` aux clés décalées ; factor=1 rend la table inchangée."""
+    if factor <= 1:
+        return df.reset_index(drop=True)
+    copies = []
+    for copy in range(factor):
+        part = df.copy()
+        for col in KEY_COLUMNS[name]:
+            if col in part.columns:
+                part[col] = _shift_keys(part[col], copy)
+        if name == "clienti" and copy:
+            suffix = " " + copy_suffix(copy)
+            for col in NAME_COLUMNS:
+                if col in part.columns:
+                    part[col] = part[col].where(part[col].isna(), part[col].astype(str) + suffix)
+        if name == "ctbcont" and copy and "CTB_HOLDING" in part.columns:
+            # une holding par copie : les groupes gardent la taille de l'original
+            labels = part["CTB_HOLDING"]
+            keep = labels.isna() | labels.astype(str).str.strip().str.upper().isin(NO_HOLDING)
+            part["CTB_HOLDING"] = labels.where(keep, labels.astype(str) + f"~{copy}")
+        copies.append(part)
+    return pd.concat(copies, ignore_index=True)
+
+
+def sample_names(clienti: pd.DataFrame, n: int, seed: int = 0) -> list:
+    """Noms clients tirés au hasard (graine fixe) pour les requêtes de recherche."""
+    names = clienti["CLI_NOME"].dropna().astype(str)
+    names = names[names.str.strip() != ""].drop_duplicates()
+    rng = np.random.default_rng(seed)
+    return names.iloc[rng.choice(len(names), size=min(n, len(names)), replace=False)].tolist()
@@ -1,12 +1,24 @@
 import streamlit as st
-import pandas as pd
 from pathlib import Path
+from utils.table_query import OPERATORS, QUERY_ERRORS, count_rows, query_table, table_schema
 
 DATA_DIR = Path("documents/table")
 
+# colonnes affichées par défaut (les tables Vega ont plusieurs centaines de colonnes)
+DEFAULT_COLUMNS = {
+    "clienti": ["CLI_COD", "CLI_NOME", "CLI_NOME2", "CLI_IND", "CLI_CAP", "CLI_CIT", "CLI_STATOCONTRATTO"],
+    "contratti": ["CNTR_NUMEROCONTRATTO", "CNTR_CLIENTE", "CNTR_SEDELEGALE", "CNTR_TIPO",
+                  "CNTR_DATASTIPULACONTRATTO", "CNTR_DURATACTR", "CNTR_DURATATACITORINNOVO"],
+    "ctbcont": ["CTB_COD", "CTB_DESC", "CTB_IND", "CTB_CAP", "CTB_CIT", "CTB_PIVA"],
+    "modelli": ["MOD_COD", "MOD_DESC", "MOD_DESCITA"],
+    "unopv": ["UPV_COD", "UPV_CLI", "UPV_MOD", "UPV_DES1", "UPV_DES2", "UPV_STATOCONTRATTO"],
+}
+MAX_FILTERS = 5
+
+
 def render():
     st.subheader("Tables de référence Vega")
-    
+
     files = [
         "clienti.xlsx",
         "contratti.xlsx",
@@ -14,15 +26,58 @@ def render():
         "modelli.xlsx",
         "unopv.xlsx"
     ]
-    
+    available = [f for f in files if (DATA_DIR / f).exists()]
     for file in files:
-        path = DATA_DIR / file
-        if path.exists():
-            try:
-                df = pd.read_excel(path)
-                st.write(f"### {file}")
-                st.dataframe(df.head(15))
-            except Exception as e:
-                st.error(f"Erreur lors du chargement de {file}: {e}")
-        else:
+        if file not in available:
             st.warning(f"Fichier non trouvé : {file}")
+    if not available:
+        return
+
+    name = Path(st.selectbox("Table", available)).stem
+    try:
+        schema = table_schema(name)
+    except Exception as e:
+        st.error(f"Erreur lors du chargement de {name}.xlsx: {e}")
+        return
+    all_columns = [c for c in schema.names if c.strip()]
+
+    defaults = [c for c in DEFAULT_COLUMNS.get(name, []) if c in all_columns] or all_columns[:10]
+    columns = st.multiselect("Columns", all_columns, default=defaults, key=f"{name}_columns") or defaults
+
+    filters = []
+    n_filters = st.number_input("Filters", min_value=0, max_value=MAX_FILTERS, value=0, key=f"{name}_n_filters")
+    for i in range(int(n_filters)):
+        col, op, value = st.columns([3, 1, 3])
+        column = col.selectbox("Column", all_columns, key=f"{name}_filter_col_{i}", label_visibility="collapsed")
+        operator = op.selectbox("Operator", OPERATORS, key=f"{name}_filter_op_{i}", label_visibility="collapsed")
+        text = value.text_input("Value", key=f"{name}_filter_value_{i}", label_visibility="collapsed",
+                                placeholder="value (a,b,c for 'in')")
+        if text.strip():
+            filters.append((column, operator, text))
+
+    sort_col, order_col, size_col = st.columns([3, 1, 1])
+    sort = sort_col.selectbox("Sort by", ["(none)"] + all_columns, key=f"{name}_sort")
+    descending = order_col.checkbox("Descending", key=f"{name}_desc")
+    page_size = size_col.selectbox("Rows", [25, 50, 100, 200], index=1, key=f"{name}_page_size")
+
+    # une valeur peut passer le comptage et échouer au scan (tri, conversion) : même message
+    try:
+        total = count_rows(name, filters)
+        pages = max(1, -(-total // page_size))
+        page = st.number_input(f"Page (1 – {pages})", min_value=1, max_value=pages, value=1, key=f"{name}_page")
+
+        df, total = query_table(
+            name,
+            columns=columns,
+            filters=filters,
+            sort=None if sort == "(none)" else sort,
+            descending=descending,
+            page=page - 1,
+            page_size=page_size,
+        )
+    except QUERY_ERRORS as e:
+        st.error(f"Filtre invalide : {e}")
+        return
+    first = (page - 1) * page_size
+    st.caption(f"{name}.xlsx — rows {first + 1 if total else 0}–{first + len(df)} of {total}")
+    st.dataframe(df)
@@ -0,0 +1,19 @@
+import pandas as pd
+
+from utils.diff_engine import extract_facts
+
+
+def _types(*texts):
+    return extract_facts(pd.Series(texts))["types"].tolist()
+
+
+def test_contract_type_labels():
+    assert _types("Contratto OPA", "Vertrag OP B", "Operating A", "Opetating B", "OpeiatingB") == [
+        {"OPA"}, {"OPB"}, {"OPA"}, {"OPB"}, {"OPB"},
+    ]
+
+
+def test_ordinary_words_are_not_contract_types():
+    # "operativa", "oppoituna" (OCR) : mots italiens, pas des libellés Operating
+    text = "Contratto Opetating B : assistenza operativa a sede, se ritenuto oppoituna a"
+    assert _types(text, "la gestione operativa a Lugano") == [{"OPB"}, set()]
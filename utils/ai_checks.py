@@ -1,49 +1,119 @@
-import os
-from openai import OpenAI
-import json
 from dotenv import load_dotenv
-import json
 import pandas as pd
+from utils.diff_engine import LLM_ONLY_CONTROLS, llm_controls
+from utils.llm_client import complete, stream
+from utils.prompt_builder import build_context, count_tokens
+from utils.tracing import count, span
 load_dotenv()
-api_key = os.environ.get("OPENAI_API_KEY")
 
 
 
 
 def make_json_serializable(obj):
+    if obj is pd.NaT:
+        return None
     if isinstance(obj, pd.Timestamp):
         return obj.isoformat()
     raise TypeError(f"Type {type(obj)} not serializable")
 
-def analyze_contract(report_data: dict, contract_text: str) -> str:
+CONTROL_POINTS = {
+    "prices": "Vérification des prix (différences Vega vs DB, par mode de paiement, par emplacement)",
+    "conditions": "Conditions contractuelles (durée, dates, type de contrat)",
+    "client": "Informations clients & facturation (noms, adresses, holdings)",
+    "inventory": "Inventaire des distributeurs (modèles, localisation, association)",
+}
+
+
+def _checks_section(findings) -> str:
+    """Liste des points à faire vérifier au LLM, en excluant ce que les règles ont tranché."""
+    if findings is None:
+        points = [f"    {i}. {label}" for i, label in enumerate(CONTROL_POINTS.values(), 1)]
+        return "\n".join(["    Vérifie les points suivants :"] + points)
+
+    decided = findings[findings["status"] != "unresolved"]
+    open_points = findings[findings["status"] == "unresolved"]
+    lines = ["    Résultats déjà établis par les contrôles automatiques (ne pas réexaminer) :"]
+    lines += [
+        f"    - {r.check} : {r.status} (contrat: {r.contract_value or '-'} / Vega: {r.vega_value or '-'})"
+        for r in decided.itertuples()
+    ]
+    lines.append("    Vérifie uniquement les points suivants :")
+    points = [CONTROL_POINTS[c] for c in llm_controls(findings)]
+    points += [f"{CONTROL_POINTS[r.control]} — {r.check} non déterminé automatiquement" for r in open_points.itertuples()
+               if r.control not in LLM_ONLY_CONTROLS]
+    lines += [f"    {i}. {p}" for i, p in enumerate(points, 1)]
+    return "\n".join(lines)
+
+
+def build_analysis_prompt(report_data: dict, contract_text: str, findings=None) -> str:
     """
-    Appelle OpenAI pour analyser les données d'un contrat.
+    Construit le prompt d'analyse d'un contrat.
     report_data : dictionnaire contenant toutes les données extraites et matches DB.
     contract_text : texte complet du contrat PDF.
-    Retourne un résumé texte des anomalies détectées.
+    findings : constats de utils.diff_engine.run_checks pour ce contrat (optionnel) ;
+    seuls les points non tranchés par les règles sont alors soumis au modèle.
+    Le contrat et les données DB sont réduits au budget de tokens (utils.prompt_builder).
     """
-    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-
+    with span("prompt.build"):
+        sections, db_json = build_context(report_data, contract_text, default=make_json_serializable)
     prompt = f"""
-    Voici le texte complet du contrat :
-    {contract_text}
+    Voici le texte du contrat (sections pertinentes, "[...]" marque les passages omis) :
+    {sections}
 
-    Voici les données extraites et les fichiers associés (DB) :
-    {json.dumps(report_data, ensure_ascii=False, indent=2, default=make_json_serializable)}
+    Voici les données extraites et les fichiers associés (DB, JSON compact) :
+    {db_json}
 
-    Vérifie les points suivants :
-    1. Vérification des prix (différences Vega vs DB, par mode de paiement, par emplacement)
-    2. Conditions contractuelles (durée, dates, type de contrat)
-    3. Informations clients & facturation (noms, adresses, holdings)
-    4. Inventaire des distributeurs (modèles, localisation, association)
+{_checks_section(findings)}
 
     Compare le contrat avec les données extraites et indique toutes incohérences ou points à vérifier.
     Fournis un résumé structuré.
     """
+    count("prompt.tokens", count_tokens(prompt))
+    return prompt
+
+
+def analyze_contract(report_data: dict, contract_text: str, findings=None, timeout: float = None) -> str:
+    """
+    Appelle OpenAI pour analyser les données d'un contrat (voir build_analysis_prompt).
+    Retourne un résumé texte des anomalies détectées.
+    """
+    return complete(build_analysis_prompt(report_data, contract_text, findings), model="gpt-4.1", timeout=timeout)
+
+
+def analyze_contract_stream(report_data: dict, contract_text: str, findings=None, timeout: float = None):
+    """Comme analyze_contract, mais génère le rapport par morceaux au fil de la réponse."""
+    prompt = build_analysis_prompt(report_data, contract_text, findings)
+    yield from stream(prompt, model="gpt-4.1", timeout=timeout)
 
-    response = client.responses.create(
-        model="gpt-4.1",
-        input=prompt
-    )
 
-    return response.output_text
+def controls_to_check(findings=None) -> list:
+    """Points de contrôle à soumettre au LLM : ceux sans règle, plus ceux restés non tranchés."""
+    if findings is None:
+        return list(CONTROL_POINTS)
+    pending = set(llm_controls(findings)) | set(findings.loc[findings["status"] == "unresolved", "control"])
+    return [c for c in CONTROL_POINTS if c in pending]
+
+
+def build_check_prompt(control: str, report_data: dict, contract_text: str, findings=None) -> str:
+    """Prompt d'un seul point de contrôle, avec uniquement les sections du contrat qui le concernent."""
+    with span("prompt.build", control=control):
+        sections, db_json = build_context(report_data, contract_text, default=make_json_serializable, checks=[control])
+    known = ""
+    count("prompt.tokens", count_tokens(sections) + count_tokens(db_json))
+    if findings is not None:
+        rows = findings[findings["control"] == control]
+        if not rows.empty:
+            known = "\n    Résultats des contrôles automatiques pour ce point :\n" + "\n".join(
+                f"    - {r.check} : {r.status} (contrat: {r.contract_value or '-'} / Vega: {r.vega_value or '-'})"
+                for r in rows.itertuples()
+            )
+    return f"""
+    Voici le texte du contrat (sections pertinentes, "[...]" marque les passages omis) :
+    {sections}
+
+    Voici les données extraites et les fichiers associés (DB, JSON compact) :
+    {db_json}
+{known}
+    Vérifie uniquement ce point : {CONTROL_POINTS[control]}.
+    Indique les incohérences ou points à vérifier, de façon concise.
+    """
@@ -0,0 +1,245 @@
+"""
+Vérification en lot d'un dossier de contrats PDF.
+
+    python -m utils.batch documents/pdfs -o results.jsonl
+    python -m utils.batch documents/pdfs -o results.jsonl --changed   # seulement les clients touchés
+
+Extraction/OCR dans un pool de processus, identification client dans des threads,
+contrôles IA par point de contrôle via utils.check_scheduler (limité en requêtes et
+tokens/min), un résultat JSON par contrat écrit au fil de l'eau.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from utils.ai_checks import make_json_serializable
+from utils.check_scheduler import CheckScheduler
+from utils.diff_engine import run_checks
+from utils.client_info import parse_client_info
+from utils.name_index import search_customers
+from utils.ocr_engine import set_threads
+from utils.contract_history import contract_facts, evolution, record_version
+from utils.pdf_utils import extract_document, mapped_pdf, pdf_digest
+from utils.groups import get_group_index
+from utils.relations import build_report_data, get_relation_index
+from utils.tracing import span, start_trace, to_openmetrics
+from utils.vega_changes import commit_baseline, detect_changes
+
+
+def _init_worker(threads: int) -> None:
+    # les cœurs sont partagés entre les workers : pas de sur-souscription torch
+    set_threads(threads)
+
+
+def _extract(path: str) -> tuple:
+    """Exécuté dans un process du pool : lecture + extraction texte/OCR + grille de prix."""
+    start = time.perf_counter()
+    with start_trace("extract") as trace, mapped_pdf(path) as data:
+        # fichier projeté en mémoire : ni lecture complète ni copie avant fitz
+        digest = pdf_digest(data)
+        # pages consommées au fil de l'eau : seuls le texte et la grille de prix restent
+        text, prices = extract_document(data)
+    return path, digest, text, prices, trace.to_dict(), time.perf_counter() - start
+
+
+def identify(text: str, threshold: float = 0.6) -> dict:
+    """Identifie le client d'un contrat et rassemble les données Vega liées."""
+    info = parse_client_info(text)
+    record = {"client_info": info, "candidates": [], "cli_cod": None, "report_data": None}
+    if not info.get("client_name"):
+        return record
+
+    candidates = search_customers(info["client_name"], top_k=5, threshold=threshold)
+    record["candidates"] = candidates
+    if not candidates:
+        return record
+
+    cli_cod = candidates[0]["CLI_COD"]
+    bundle = get_relation_index().resolve_customer(cli_cod)
+    record["cli_cod"] = cli_cod
+    # codes liés (holding / filiales) pour contexte : les contrôles restent sur le client
+    record["group_codes"] = get_group_index().codes(cli_cod)
+    record["report_data"] = build_report_data(info, bundle)
+    return record
+
+
+def _records(df) -> list:
+    """Lignes d'un DataFrame en dicts ; NaN / NaT -> None (NaN n'est pas du JSON valide)."""
+    return df.astype(object).where(df.notna(), None).to_dict(orient="records")
+
+
+def _history(record: dict, text: str, prices) -> dict:
+    """Enregistre la version du contrat et la compare à la précédente du même client."""
+    contract_no, effective, facts = contract_facts(text, record["report_data"], prices)
+    record_version(record["cli_cod"], contract_no, facts, effective, source=record["file"],
+                   pdf_sha256=record.get("pdf_sha256"))
+    return {"contract_no": contract_no, "effective_date": effective,
+            "changes": evolution(record["cli_cod"], contract_no)["changes"]}
+
+
+def _process(record: dict, text: str, prices, extract_trace: dict, scheduler, threshold: float,
+             timeout: float) -> dict:
+    """Exécuté dans un thread : identification client (réseau) puis contrôles IA (si `scheduler`)."""
+    with start_trace("contract") as trace:
+        trace.merge(extract_trace)
+        try:
+            return _process_traced(record, text, prices, scheduler, threshold, timeout)
+        finally:
+            record["trace"] = trace.to_dict()
+
+
+def _process_traced(record: dict, text: str, prices, scheduler, threshold: float, timeout: float) -> dict:
+    start = time.perf_counter()
+    try:
+        with span("identify"):
+            record.update(identify(text, threshold=threshold))
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"identify: {e}"
+        return record
+    record["timings"]["identify_s"] = round(time.perf_counter() - start, 3)
+    if record["report_data"] is None:
+        return record
+
+    try:
+        record["prices"] = _records(prices)
+        findings = run_checks([{"id": record["file"], "report_data": record["report_data"], "text": text,
+                                "prices": prices}])
+        record["checks"] = _records(findings.drop(columns=["contract_id"]))
+        record["history"] = _history(record, text, prices)
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"checks: {e}"
+        return record
+    if scheduler is None:
+        record["status"] = "matched"
+        return record
+
+    start = time.perf_counter()
+    try:
+        merged = scheduler.submit(record["report_data"], text, findings, timeout=timeout).result()
+        record["report"] = merged["report"]
+        record["ai_checks"] = merged["checks"]
+        record["status"] = "checked" if merged["status"] == "ok" else "partial"
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"ai_checks: {e}"
+    record["timings"]["ai_s"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def _read_results(output) -> dict:
+    """Résultats d'un passage précédent, par fichier."""
+    try:
+        with open(output, encoding="utf-8") as f:
+            return {r["file"]: r for r in map(json.loads, f) if r.get("file")}
+    except (OSError, ValueError):
+        return {}
+
+
+def _reusable(record: dict, customers: set) -> bool:
+    """Un résultat reste valable si le contrat a été vérifié et que son client n'a pas changé dans Vega."""
+    return record.get("status") == "checked" and record.get("cli_cod") not in customers
+
+
+def run_batch(folder, output, workers=None, llm_workers=8, with_ai=True, threshold=0.6, timeout=None,
+              rpm=None, tpm=None, only_changed=False, metrics=None) -> int:
+    """
+    Traite tous les PDF de `folder` et écrit un JSONL dans `output`. Retourne le nombre de contrats.
+    Avec `only_changed`, les contrats déjà vérifiés dont le client n'a pas changé depuis la
+    référence Vega (utils.vega_changes) sont repris tels quels de `output`.
+    `metrics` : fichier OpenMetrics agrégeant les traces des contrats traités.
+    """
+    files = sorted(str(p) for p in Path(folder).rglob("*") if p.suffix.lower() == ".pdf")
+    workers = workers or os.cpu_count() or 1
+
+    # tables et index chargés une fois dans le process principal
+    get_relation_index()
+    get_group_index()
+    scheduler = CheckScheduler(rpm=rpm, tpm=tpm) if with_ai else None
+
+    reused = []
+    if only_changed:
+        customers = set(detect_changes()["customers"])
+        previous = _read_results(output)
+        reused = [previous[f] for f in files if f in previous and _reusable(previous[f], customers)]
+        files = [f for f in files if not (f in previous and _reusable(previous[f], customers))]
+        print(f"{len(customers)} client(s) modifié(s) dans Vega, {len(files)} contrat(s) à revérifier",
+              file=sys.stderr)
+
+    count = 0
+    traces = []
+    with open(output, "w", encoding="utf-8") as out, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                initargs=((os.cpu_count() or 1) // workers,)) as cpu_pool, \
+            ThreadPoolExecutor(max_workers=llm_workers) as io_pool:
+
+        def write(record):
+            nonlocal count
+            out.write(json.dumps(record, ensure_ascii=False, default=make_json_serializable) + "\n")
+            out.flush()
+            count += 1
+
+        for record in reused:
+            write(record)
+        extracting = {cpu_pool.submit(_extract, f): f for f in files}
+        processing = set()
+        while extracting or processing:
+            done, _ = wait(set(extracting) | processing, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in processing:
+                    processing.discard(future)
+                    record = future.result()
+                    traces.append(record["trace"])
+                    write(record)
+                    continue
+
+                path = extracting.pop(future)
+                record = {"file": path, "status": "unmatched", "timings": {}}
+                try:
+                    _, record["pdf_sha256"], text, prices, extract_trace, extract_s = future.result()
+                except Exception as e:
+                    record["status"] = "error"
+                    record["error"] = str(e)
+                    write(record)
+                    continue
+                record["timings"]["extract_s"] = round(extract_s, 3)
+                processing.add(io_pool.submit(_process, record, text, prices, extract_trace, scheduler,
+                                              threshold, timeout))
+    if scheduler is not None:
+        scheduler.close()
+        # résultats à jour pour cet export : il devient la référence des prochains --changed
+        commit_baseline()
+    if metrics:
+        Path(metrics).write_text(to_openmetrics(traces), encoding="utf-8")
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Vérification en lot de contrats PDF contre Vega.")
+    parser.add_argument("folder", nargs="?", default="documents/pdfs")
+    parser.add_argument("-o", "--output", default="batch_results.jsonl")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="process d'extraction (défaut : nb de cœurs)")
+    parser.add_argument("--llm-workers", type=int, default=8, help="contrats identifiés simultanément")
+    parser.add_argument("--rpm", type=int, default=None, help="quota de requêtes OpenAI par minute")
+    parser.add_argument("--tpm", type=int, default=None, help="quota de tokens OpenAI par minute")
+    parser.add_argument("--threshold", type=float, default=0.6, help="score minimal de rapprochement client")
+    parser.add_argument("--timeout", type=float, default=180, help="abandonne une tentative de contrôle IA au-delà de N secondes")
+    parser.add_argument("--no-ai", action="store_true", help="s'arrête après le rapprochement Vega")
+    parser.add_argument("--metrics", default=None, help="écrit les métriques agrégées (OpenMetrics) dans ce fichier")
+    parser.add_argument("--changed", action="store_true",
+                        help="ne revérifie que les contrats des clients modifiés dans Vega depuis le dernier passage")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    count = run_batch(args.folder, args.output, workers=args.workers, llm_workers=args.llm_workers,
+                      with_ai=not args.no_ai, threshold=args.threshold, timeout=args.timeout, rpm=args.rpm, tpm=args.tpm, only_changed=args.changed, metrics=args.metrics)
+    print(f"{count} contrat(s) traité(s) en {time.perf_counter() - start:.1f}s -> {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
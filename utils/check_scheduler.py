@@ -0,0 +1,213 @@
+"""
+Contrôles IA par point de contrôle, envoyés en parallèle (asyncio).
+
+Chaque contrat donne une requête par point de contrôle à examiner (prix, conditions,
+client, inventaire) ; les requêtes de tous les contrats partagent un limiteur
+requêtes/min + tokens/min, et sont reprises avec un backoff exponentiel aléatoire
+sur les erreurs transitoires (429, 5xx, timeouts). Le temps d'un contrat est celui
+de son contrôle le plus lent, pas la somme.
+
+Pour tester sans l'API : OPENAI_BASE_URL=http://127.0.0.1:8000/v1 (voir utils.llm_client).
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+
+import openai
+
+from utils.ai_checks import CONTROL_POINTS, build_check_prompt, controls_to_check
+from utils.llm_client import DEFAULT_MODEL, acomplete
+from utils.prompt_builder import count_tokens
+from utils.tracing import count, current, span, use_trace
+
+# quotas du compte OpenAI (à ajuster au tier)
+LLM_RPM = int(os.environ.get("VEGA_LLM_RPM", "500"))
+LLM_TPM = int(os.environ.get("VEGA_LLM_TPM", "200000"))
+LLM_CONCURRENCY = int(os.environ.get("VEGA_LLM_CONCURRENCY", "16"))
+LLM_MAX_RETRIES = int(os.environ.get("VEGA_LLM_MAX_RETRIES", "4"))
+# tokens réservés pour la réponse, comptés dans le quota tokens/min
+OUTPUT_TOKENS_ESTIMATE = 800
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,  # inclut APITimeoutError
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+)
+
+
+class TokenBucket:
+    """Seau à jetons : `rate_per_min` jetons par minute, au plus `capacity` d'avance."""
+
+    def __init__(self, rate_per_min: float, capacity: float = None):
+        self.rate = rate_per_min / 60.0
+        self.capacity = capacity or rate_per_min
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1) -> None:
+        amount = min(amount, self.capacity)
+        # le verrou garde l'ordre d'arrivée : une grosse requête n'est pas doublée indéfiniment
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def drain(self, seconds: float) -> None:
+        """Vide le seau pour `seconds` secondes (après un 429 de l'API)."""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+class RateLimiter:
+    def __init__(self, rpm: int = None, tpm: int = None):
+        self.requests = TokenBucket(rpm or LLM_RPM)
+        self.tokens = TokenBucket(tpm or LLM_TPM)
+
+    async def acquire(self, tokens: int) -> None:
+        await self.requests.acquire(1)
+        await self.tokens.acquire(tokens)
+
+    def pause(self, seconds: float) -> None:
+        self.requests.drain(seconds)
+        self.tokens.drain(seconds)
+
+
+def _retry_after(error: Exception):
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 30.0) -> float:
+    """Backoff exponentiel « full jitter » : aléatoire entre 0 et base·2^attempt."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CheckScheduler:
+    """
+    Ordonnanceur des contrôles IA. Utilisable directement en asyncio (run_contract,
+    run_many) ou depuis du code synchrone / des threads via submit(), qui délègue à
+    une boucle dédiée.
+    """
+
+    def __init__(self, rpm: int = None, tpm: int = None, concurrency: int = None, max_retries: int = None,
+                 model: str = DEFAULT_MODEL, use_cache: bool = True):
+        self.rpm, self.tpm = rpm, tpm
+        self.concurrency = concurrency or LLM_CONCURRENCY
+        self.max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.model = model
+        self.use_cache = use_cache
+        self._limiter = None
+        self._semaphore = None
+        self._loop = None
+        self._thread = None
+
+    def _ensure_primitives(self) -> None:
+        # créés dans la boucle qui les utilise
+        if self._limiter is None:
+            self._limiter = RateLimiter(self.rpm, self.tpm)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def run_check(self, control: str, prompt: str, timeout: float = None) -> dict:
+        """Un point de contrôle : limiteur, appel, reprises. Ne lève pas, l'erreur est dans le résultat."""
+        self._ensure_primitives()
+        cost = count_tokens(prompt) + OUTPUT_TOKENS_ESTIMATE
+        start = time.perf_counter()
+        result = {"control": control, "status": "error", "text": None, "error": None, "attempts": 0}
+        for attempt in range(self.max_retries + 1):
+            result["attempts"] = attempt + 1
+            await self._limiter.acquire(cost)
+            try:
+                async with self._semaphore:
+                    coro = acomplete(prompt, model=self.model, use_cache=self.use_cache, timeout=timeout)
+                    result["text"] = await (asyncio.wait_for(coro, timeout) if timeout else coro)
+                result["status"] = "ok"
+                result["error"] = None
+                break
+            except RETRYABLE_ERRORS as e:
+                count("llm.retries")
+                result["error"] = f"{type(e).__name__}: {e}"
+                if attempt == self.max_retries:
+                    break
+                delay = _retry_after(e)
+                if isinstance(e, openai.RateLimitError):
+                    self._limiter.pause(delay or 1.0)
+                await asyncio.sleep(delay if delay is not None else backoff_delay(attempt))
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+                break
+        result["elapsed_s"] = round(time.perf_counter() - start, 3)
+        return result
+
+    async def run_contract(self, report_data: dict, contract_text: str, findings=None, timeout: float = None) -> dict:
+        """Tous les points de contrôle d'un contrat en parallèle, fusionnés en un rapport."""
+        start = time.perf_counter()
+        controls = controls_to_check(findings)
+        results = await asyncio.gather(*[
+            self.run_check(c, build_check_prompt(c, report_data, contract_text, findings), timeout=timeout)
+            for c in controls
+        ])
+        return merge_results(results, elapsed_s=time.perf_counter() - start)
+
+    async def run_many(self, items: list, timeout: float = None) -> list:
+        """items : [{"report_data", "text", "findings"?}] ; rapports dans le même ordre."""
+        return await asyncio.gather(*[
+            self.run_contract(item["report_data"], item["text"], item.get("findings"), timeout=timeout)
+            for item in items
+        ])
+
+    def submit(self, report_data: dict, contract_text: str, findings=None, timeout: float = None):
+        """Planifie run_contract depuis un thread quelconque ; retourne un concurrent.futures.Future."""
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, name="check-scheduler", daemon=True)
+            self._thread.start()
+        coro = self._traced(current(), self.run_contract(report_data, contract_text, findings, timeout=timeout))
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    @staticmethod
+    async def _traced(trace, coro):
+        # la boucle dédiée n'hérite pas du contexte du thread appelant
+        with use_trace(trace), span("ai.checks"):
+            return await coro
+
+    def close(self) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = self._thread = None
+
+
+def merge_results(results: list, elapsed_s: float = None) -> dict:
+    """Rapport structuré : un résultat par point de contrôle et un résumé texte."""
+    parts = []
+    for r in results:
+        body = r["text"] if r["status"] == "ok" else f"Contrôle non effectué ({r['error']})"
+        parts.append(f"### {CONTROL_POINTS[r['control']]}\n{(body or '').strip()}")
+    return {
+        "status": "ok" if all(r["status"] == "ok" for r in results) else "partial",
+        "checks": {r["control"]: r for r in results},
+        "report": "\n\n".join(parts),
+        "elapsed_s": round(elapsed_s, 3) if elapsed_s is not None else None,
+    }
+
+
+def check_contract(report_data: dict, contract_text: str, findings=None, timeout: float = None, **kwargs) -> dict:
+    """Version synchrone pour un contrat isolé."""
+    return asyncio.run(CheckScheduler(**kwargs).run_contract(report_data, contract_text, findings, timeout=timeout))
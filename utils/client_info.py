@@ -0,0 +1,299 @@
+"""
+Identification du client dans l'en-tête d'un contrat (fr/de/it).
+
+parse_client_header() lit les premières lignes du texte : les blocs d'adresse sont
+repérés par leur ligne NPA + localité, les blocs du fournisseur (SENDER_NAMES et
+SENDER_ADDRESSES, configurables) sont écartés en baissant la confiance, et
+le premier bloc restant donne nom, contact, adresse, NPA/ville et pays ; le code client
+vient des mentions « Client N° », « Kunden-Nr », « codice cliente » ou d'une ligne de
+chiffres seule au-dessus du nom. Le score de confiance pondère les champs trouvés ;
+parse_client_info() n'interroge le LLM qu'en dessous de HEADER_CONFIDENCE.
+"""
+import json
+import logging
+import os
+import re
+from difflib import SequenceMatcher
+
+from utils.llm_client import complete
+from utils.tracing import count
+
+logger = logging.getLogger(__name__)
+
+# score minimal pour se passer du LLM
+HEADER_CONFIDENCE = float(os.environ.get("VEGA_HEADER_CONFIDENCE", "0.6"))
+# l'en-tête client se trouve dans les premières lignes
+HEADER_LINES = 80
+HEADER_CHARS = HEADER_LINES * 80
+MAX_BLOCK_LINES = 6
+
+# identité du fournisseur, expéditeur des contrats : raisons sociales, et adresses « rue, NPA »
+SENDER_NAMES = [n.strip() for n in os.environ.get("VEGA_SENDER_NAMES", "Dallmayr").split(",") if n.strip()]
+SENDER_ADDRESSES = [
+    tuple(part.strip() for part in a.rsplit(",", 1))
+    for a in os.environ.get(
+        "VEGA_SENDER_ADDRESSES",
+        "Neumatt 15, 4626; Via dei Balconi 5, 6917; Chemin de la Cretaux 4, 1196; Seestrasse 108, 9326",
+    ).split(";") if "," in a
+]
+# similarité minimale (lettres) pour reconnaître un nom ou une rue malgré l'OCR
+SENDER_SIMILARITY = 0.8
+# confiance retirée par bloc écarté : le bloc suivant n'est peut-être pas le client
+SKIPPED_BLOCK_PENALTY = 0.15
+
+# poids des champs dans le score de confiance (total 1.0)
+WEIGHTS = {"client_name": 0.35, "legal_form": 0.1, "zip": 0.2, "client_code": 0.2, "address": 0.1, "country": 0.05}
+
+COMPANY_SUFFIX_RE = re.compile(
+    r"(?:^|\s)(?:SA|AG|GmbH|Sagl|Srl|SRL|SAS|SPA|SpA|Inc|SARL|Sàrl|SNC|Ltd|KG|Genossenschaft|Stiftung|"
+    r"Fondation|Fondazione|Association|Verein)\.?(?:$|[\s,)])"
+)
+PERSON_TOKEN_RE = re.compile(r"^[A-ZÀ-ÝÄÖÜÈÉÊËÇÎÏÔÛŸ][a-zà-ÿ'\-]*$")
+TOKEN_SPLIT_RE = re.compile(r"[\s\-]+")
+STREET_RE = re.compile(
+    r"(?:strasse|straße|str\.|gasse|weg\b|allee|platz|ring\b|rain\b|matt\b|"  # de
+    r"\brue\b|\bchemin\b|\bch\.|\bavenue\b|\bav\.|\broute\b|\brte\b|\bboulevard\b|\bbd\b|\bplace\b|\bquai\b|"  # fr
+    r"\bvia\b|\bviale\b|\bpiazza\b|\bcorso\b|\bvicolo\b|\bzona\b)",  # it
+    re.I,
+)
+PO_BOX_RE = re.compile(r"\b(?:postfach|case postale|casella postale|po box|c\.p\.|cp)\b", re.I)
+HOUSE_NUMBER_RE = re.compile(r"\b\d+[a-z]?\b", re.I)
+ZIP_CITY_RE = re.compile(r"^(?:CH[\s\-]?)?(\d{4})\s+([A-Za-zÀ-ÿ][^\d,;]*?(?:\s\d{1,2})?)\s*(?:,.*)?$")
+COUNTRY_RE = re.compile(
+    r"^(Schweiz|Suisse|Svizzera|Switzerland|Liechtenstein|Italia|Italie|France|Deutschland|Allemagne|"
+    r"Österreich|Autriche)$", re.I
+)
+CODE_LINE_RE = re.compile(r"^(\d{4,6})(?:\s+(\D.*))?$")
+CLIENT_CODE_RE = re.compile(
+    r"(?:client|kunden|kunde|cliente)\s*(?:-?\s*n(?:r|o|°|º)?\.?)?\s*(?:n(?:r|o|°|º)\.?)?"
+    r"\s*(?:si[eè]ge)?\s*[:.;]?\s*(\d{4,6})\b",
+    re.I,
+)
+NOISE_RE = re.compile(
+    r"@|\b(?:www\.|https?://)|^(?:t[eéèö]l|tel|fax|mobile?|natel|telefon|telefono|t[ée]l[ée]phone)\b|"
+    r"\b(?:CHE|MWST|MwSt|TVA|IVA|UID)\b|^[0-9\s\-\.]+$|^\d{1,2}\.$",
+    re.I,
+)
+# lignes qui séparent les parties ("entre ... et ...", "zwischen ... und ...", "tra ... e ...")
+SEPARATOR_RE = re.compile(
+    r"^(?:entre|et|und|zwischen|tra|e|and|between)$|^\((?:d[ée]sign[ée]|nachstehend|in s\w*guito|hereinafter)",
+    re.I,
+)
+DATE_LINE_RE = re.compile(r"^[A-ZÀ-Ýa-zà-ÿ\- ]+,\s*(?:le\s+|den\s+|il\s+)?\d{1,2}[\.\s]", re.I)
+
+
+def _looks_like_person(name_line: str) -> bool:
+    tokens = [t for t in TOKEN_SPLIT_RE.split(name_line.strip()) if t]
+    if len(tokens) < 2 or len(tokens) > 4:
+        return False
+    upper_initial = all(PERSON_TOKEN_RE.match(t) for t in tokens)
+    return upper_initial and not COMPANY_SUFFIX_RE.search(name_line)
+
+
+def _looks_like_address(line: str) -> bool:
+    return bool(PO_BOX_RE.search(line) or (HOUSE_NUMBER_RE.search(line) and STREET_RE.search(line)))
+
+
+def _is_noise(line: str) -> bool:
+    line = line.strip()
+    return not line or bool(NOISE_RE.search(line) or DATE_LINE_RE.match(line))
+
+
+def extract_header_text(text: str, max_words: int = 50) -> str:
+    """Extrait les premiers mots du texte pour constituer l'en-tête"""
+    words = text.split()
+    header_words = words[:max_words]
+    return " ".join(header_words)
+
+
+def _header_lines(text: str, max_lines: int = HEADER_LINES) -> list:
+    """Premières lignes non vides ; une ligne « nom, rue, NPA ville, ... » est découpée en segments."""
+    lines = []
+    for raw in text[:HEADER_CHARS].splitlines():
+        line = " ".join(raw.split())
+        if not line:
+            continue
+        parts = line.split(",") if line.count(",") > 1 else ()
+        parts = [p.strip() for p in parts]
+        if parts and any(ZIP_CITY_RE.match(p) for p in parts):
+            lines.extend(p for p in parts if p)
+        else:
+            lines.append(line)
+        if len(lines) >= max_lines:
+            break
+    return lines
+
+
+def _address_blocks(lines: list):
+    """Blocs d'adresse, dans l'ordre : (lignes au-dessus du NPA, index de la ligne NPA, code lu juste au-dessus)."""
+    for i, line in enumerate(lines):
+        if not ZIP_CITY_RE.match(line):
+            continue
+        block, code, j = [], None, i - 1
+        while j >= 0 and len(block) < MAX_BLOCK_LINES:
+            prev = lines[j]
+            if ZIP_CITY_RE.match(prev):
+                break
+            code_line = CODE_LINE_RE.match(prev)
+            if code_line:
+                code = code_line.group(1)
+                if code_line.group(2):
+                    block.insert(0, code_line.group(2).strip())
+                break
+            if SEPARATOR_RE.match(prev) or _is_noise(prev) or prev.endswith(":"):
+                break
+            block.insert(0, prev)
+            j -= 1
+        yield block, i, code
+
+
+def _letters(text: str) -> str:
+    return re.sub(r"[^a-z0-9à-ÿ]", "", text.lower())
+
+
+def _similar(a: str, b: str) -> bool:
+    return bool(a) and bool(b) and SequenceMatcher(None, a, b).ratio() >= SENDER_SIMILARITY
+
+
+def _is_sender(block: list, zip_code: str) -> bool:
+    """Bloc du fournisseur : un mot proche d'une raison sociale, ou sa rue au même NPA."""
+    names = [_letters(n) for n in SENDER_NAMES]
+    for line in block:
+        words = [_letters(w) for w in line.split()]
+        if any(_similar(w, n) for w in words for n in names):
+            return True
+    streets = [_letters(street) for street, zip_ in SENDER_ADDRESSES if zip_ == zip_code]
+    return any(_similar(_letters(line), street) for line in block for street in streets)
+
+
+def _split_block(block: list) -> tuple:
+    """Lignes d'un bloc -> (nom, contact, adresse, adresse repérée comme rue/case postale)."""
+    address = [line for line in block[1:] if _looks_like_address(line)]
+    rest = [line for line in block[1:] if line not in address]
+    street = bool(address)
+    if not address and rest:
+        # ligne sans numéro juste au-dessus du NPA (lieu-dit, centre commercial)
+        address = [rest.pop()]
+
+    name, contact = [block[0]], None
+    for line in rest:
+        continuation = (line.startswith("(") or name[-1].rstrip().endswith(("&", "+", "-"))
+                        or (COMPANY_SUFFIX_RE.search(line) and not COMPANY_SUFFIX_RE.search(" ".join(name))))
+        if continuation and contact is None:
+            name.append(line)
+        elif contact is None and _looks_like_person(line):
+            contact = line
+    return " ".join(name), contact, ", ".join(address) or None, street
+
+
+def confidence(info: dict, street: bool = True) -> float:
+    score = 0.0
+    if info.get("client_name"):
+        score += WEIGHTS["client_name"]
+        if COMPANY_SUFFIX_RE.search(info["client_name"]):
+            score += WEIGHTS["legal_form"]
+    if info.get("zip") and info.get("city"):
+        score += WEIGHTS["zip"]
+    if info.get("client_code"):
+        score += WEIGHTS["client_code"]
+    if info.get("address"):
+        score += WEIGHTS["address"] if street else WEIGHTS["address"] / 2
+    if info.get("country"):
+        score += WEIGHTS["country"]
+    return round(min(score, 1.0), 3)
+
+
+def parse_client_header(text: str) -> tuple:
+    """
+    Champs client lus dans l'en-tête, sans appel réseau : (info, score de confiance 0–1).
+    info : client_code, client_name, contact_name, address, zip, city, country.
+    """
+    lines = _header_lines(text or "")
+    info = dict.fromkeys(["client_code", "client_name", "contact_name", "address", "zip", "city", "country"])
+    street = False
+    skipped = 0
+
+    for block, zip_index, code in _address_blocks(lines):
+        if not block:
+            continue
+        zip_city = ZIP_CITY_RE.match(lines[zip_index])
+        if _is_sender(block, zip_city.group(1)):
+            skipped += 1
+            continue
+        name, contact, address, street = _split_block(block)
+        info.update(client_name=name, contact_name=contact, address=address,
+                    zip=zip_city.group(1), city=zip_city.group(2).strip(), client_code=code)
+        if zip_index + 1 < len(lines) and COUNTRY_RE.match(lines[zip_index + 1]):
+            info["country"] = lines[zip_index + 1]
+        break
+
+    if info["client_code"] is None:
+        labelled = CLIENT_CODE_RE.search("\n".join(lines))
+        if labelled:
+            info["client_code"] = labelled.group(1)
+    return info, round(max(confidence(info, street) - skipped * SKIPPED_BLOCK_PENALTY, 0.0), 3)
+
+
+def parse_client_info_with_openai(header_text: str) -> dict:
+    """Utilise OpenAI pour extraire les informations du client depuis l'en-tête"""
+    try:
+        prompt = f"""
+        Analyse ce texte d'en-tête de contrat et extrait les informations du client au format JSON.
+        
+        Texte: {header_text}
+        
+        Retourne un JSON avec ces champs (null si non trouvé):
+        {{
+            "client_code": "code client (4-6 chiffres)",
+            "client_name": "nom de l'entreprise/client",
+            "contact_name": "nom du contact/personne",
+            "address": "adresse complète",
+            "zip": "code postal",
+            "city": "ville",
+            "country": "pays"
+        }}
+        
+        Exemple pour "27106 Los Mensch + Arbeitswelt Gabriel Wüst Kasinostrasse 25 5001 Aarau 1 Schweiz":
+        {{
+            "client_code": "27106",
+            "client_name": "Los Mensch + Arbeitswelt",
+            "contact_name": "Gabriel Wüst",
+            "address": "Kasinostrasse 25",
+            "zip": "5001",
+            "city": "Aarau 1",
+            "country": "Schweiz"
+        }}
+        """
+        
+        content = complete(prompt, model="gpt-4.1", temperature=0.1)
+        
+        result = json.loads(content)
+        return result
+        
+    except Exception as e:
+        logger.warning("Erreur OpenAI: %s", e)
+        return None
+
+
+def parse_client_info_fallback(text: str) -> dict:
+    return parse_client_header(text)[0]
+
+
+def parse_client_info(text: str, threshold: float = None) -> dict:
+    """
+    Informations client du contrat. L'analyse locale de l'en-tête suffit au-dessus du
+    seuil de confiance ; en dessous, le LLM est interrogé et son résultat retenu s'il aboutit.
+    """
+    threshold = HEADER_CONFIDENCE if threshold is None else threshold
+    info, score = parse_client_header(text)
+    info.update(source="header", confidence=score)
+    header_text = extract_header_text(text, max_words=50)
+    if score >= threshold or not header_text:
+        count("client_info.header")
+        return info
+
+    count("client_info.llm")
+    llm_info = parse_client_info_with_openai(header_text)
+    if not isinstance(llm_info, dict) or not llm_info.get("client_name"):
+        return info
+    return dict(llm_info, source="llm", confidence=score)
@@ -0,0 +1,169 @@
+"""
+Historique des versions de contrat par client (SQLite, en ajout seul).
+
+Chaque analyse enregistre les faits extraits du contrat (type, durée, renouvellement,
+dates, coordonnées client, grille de prix), clés CLI_COD + numéro de contrat + date
+d'effet. L'index (cli_cod, contract_no, effective_date) sert la dernière version et la
+précédente sans relire ni réanalyser les anciens PDF ; diff_facts() compare deux
+versions champ par champ.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from utils.diff_engine import extract_facts
+from utils.relations import _key
+from utils.table_store import CACHE_ROOT
+from utils.tracing import traced
+
+HISTORY_DB = os.environ.get("VEGA_HISTORY_DB", str(CACHE_ROOT / "history.sqlite"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS contract_versions (
+    id INTEGER PRIMARY KEY,
+    cli_cod TEXT NOT NULL,
+    contract_no TEXT NOT NULL,
+    effective_date TEXT,
+    recorded_at REAL NOT NULL,
+    source TEXT,
+    pdf_sha256 TEXT,
+    facts_sha256 TEXT NOT NULL,
+    facts TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_versions_contract
+    ON contract_versions (cli_cod, contract_no, effective_date, id);
+-- une même version (même PDF, mêmes faits) n'est enregistrée qu'une fois
+CREATE UNIQUE INDEX IF NOT EXISTS ux_versions_content
+    ON contract_versions (cli_cod, contract_no, facts_sha256, IFNULL(pdf_sha256, ''));
+"""
+
+_lock = threading.Lock()
+_conn = None
+
+
+def _connect() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        with _lock:
+            if _conn is None:
+                os.makedirs(os.path.dirname(HISTORY_DB) or ".", exist_ok=True)
+                conn = sqlite3.connect(HISTORY_DB, check_same_thread=False)
+                conn.row_factory = sqlite3.Row
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                _conn = conn
+    return _conn
+
+
+def _iso(value):
+    if value is None or value is pd.NaT or (isinstance(value, float) and value != value):
+        return None
+    if hasattr(value, "isoformat"):
+        return value.isoformat()[:10]
+    return str(value)
+
+
+def contract_facts(text: str, report_data: dict, prices: pd.DataFrame = None) -> tuple:
+    """
+    Faits comparables d'un contrat et sa clé : (contract_no, effective_date, facts).
+    Le numéro vient du contrat Vega du même type dont la date de début figure dans le texte,
+    à défaut du premier contrat Vega du même type.
+    """
+    row = extract_facts(pd.Series([text])).iloc[0]
+    dates = sorted(_iso(d) for d in row["dates"])
+    info = report_data.get("client_info") or {}
+
+    candidates = [c for c in report_data.get("contracts_match", []) if c.get("CNTR_TIPO") in row["types"]]
+    dated = [c for c in candidates if _iso(pd.to_datetime(c.get("CNTR_DATASTIPULACONTRATTO"), errors="coerce")) in dates]
+    chosen = (dated or candidates or [{}])[0]
+    contract_no = str(_key(chosen.get("CNTR_NUMEROCONTRATTO")) or "unknown")
+    effective = _iso(pd.to_datetime(chosen.get("CNTR_DATASTIPULACONTRATTO"), errors="coerce")) if dated else None
+
+    facts = {
+        "types": sorted(row["types"]),
+        "durations": sorted(int(v) for v in row["durations"]),
+        "renewals": sorted(int(v) for v in row["renewals"]),
+        "dates": dates,
+        "client_name": info.get("client_name"),
+        "address": info.get("address"),
+        "zip": info.get("zip"),
+        "city": info.get("city"),
+    }
+    if prices is not None and not prices.empty:
+        grid = prices[prices["kind"] == "product"].dropna(subset=["product"])
+        facts["prices"] = {
+            str(p): sorted({float(v) for v in g["price"]}) for p, g in grid.groupby("product", sort=True)
+        }
+    return contract_no, effective or (dates[0] if dates else None), facts
+
+
+@traced("history.record")
+def record_version(cli_cod, contract_no: str, facts: dict, effective_date: str = None, source: str = None,
+                   pdf_sha256: str = None):
+    """Ajoute une version ; retourne son id, ou None si elle était déjà enregistrée."""
+    payload = json.dumps(facts, ensure_ascii=False, sort_keys=True, default=str)
+    facts_sha = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    conn = _connect()
+    with _lock, conn:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO contract_versions "
+            "(cli_cod, contract_no, effective_date, recorded_at, source, pdf_sha256, facts_sha256, facts) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (str(_key(cli_cod)), str(contract_no), effective_date, time.time(), source, pdf_sha256, facts_sha, payload),
+        )
+    return cur.lastrowid if cur.rowcount else None
+
+
+def _row(r: sqlite3.Row) -> dict:
+    return dict(r, facts=json.loads(r["facts"]))
+
+
+def latest_versions(cli_cod, contract_no: str = None, limit: int = 2) -> list:
+    """Versions les plus récentes (date d'effet, puis ordre d'enregistrement), servies par l'index."""
+    query = "SELECT * FROM contract_versions WHERE cli_cod = ?"
+    params = [str(_key(cli_cod))]
+    if contract_no is not None:
+        query += " AND contract_no = ?"
+        params.append(str(contract_no))
+    query += " ORDER BY effective_date DESC, id DESC LIMIT ?"
+    with _lock:
+        rows = _connect().execute(query, params + [limit]).fetchall()
+    return [_row(r) for r in rows]
+
+
+def contract_numbers(cli_cod) -> list:
+    with _lock:
+        rows = _connect().execute(
+            "SELECT DISTINCT contract_no FROM contract_versions WHERE cli_cod = ?", (str(_key(cli_cod)),)
+        ).fetchall()
+    return [r[0] for r in rows]
+
+
+def diff_facts(old: dict, new: dict, prefix: str = "") -> list:
+    """Différences champ par champ : [{field, change (added/removed/changed), old, new}]."""
+    changes = []
+    for field in sorted(set(old) | set(new)):
+        name = f"{prefix}{field}"
+        before, after = old.get(field), new.get(field)
+        if isinstance(before, dict) and isinstance(after, dict):
+            changes += diff_facts(before, after, prefix=f"{name}.")
+        elif before != after:
+            change = "added" if before in (None, [], {}) else "removed" if after in (None, [], {}) else "changed"
+            changes.append({"field": name, "change": change, "old": before, "new": after})
+    return changes
+
+
+def evolution(cli_cod, contract_no: str = None) -> dict:
+    """Dernière version du contrat comparée à la précédente (diff vide s'il n'y a qu'une version)."""
+    versions = latest_versions(cli_cod, contract_no, limit=2)
+    if not versions:
+        return {"latest": None, "previous": None, "changes": []}
+    latest = versions[0]
+    previous = versions[1] if len(versions) > 1 else None
+    changes = diff_facts(previous["facts"], latest["facts"]) if previous else []
+    return {"latest": latest, "previous": previous, "changes": changes}
@@ -0,0 +1,253 @@
+"""
+Contrôles déterministes contrat <-> Vega, exécutés avant tout appel LLM.
+
+run_checks() prend une liste de contrats {"id", "report_data", "text", "prices"?} et retourne
+un DataFrame de constats (un par contrat et par contrôle) :
+    status = "ok" | "mismatch" | "unresolved"
+Seuls les constats "unresolved" (et les contrôles sans règle : prix, inventaire)
+ont besoin d'être examinés par le LLM. La grille de prix extraite du PDF
+(utils.price_tables) est jointe produit par produit, sans trancher : Vega n'a pas de
+prix de référence par produit.
+"""
+import re
+
+import pandas as pd
+
+from utils.geo import get_postcodes, location_check
+from utils.name_index import normalize_names
+from utils.price_tables import price_findings
+from utils.tracing import traced
+
+MONTHS = r"(?:mois|monate?n?|mesi|mese|months?)"
+# "durée de 36 (trente-six) mois", "Vertragsdauer beträgt 48 Monate", "(36 mesi)"
+DURATION_RE = (
+    rf"(?:(?:dur[ée]e|dauer|durata)\D{{0,40}}?(?P<months>\d{{1,3}})\s*(?:[^\d\n]{{0,25}}?\s)?{MONTHS}"
+    rf"|\((?P<paren>\d{{1,3}})\s*{MONTHS}\))"
+)
+# "reconduite d'année en année", "verlängert sich stillschweigend um ein weiteres Jahr",
+# "prolungata tacitamente di 1 (un) altro anno"
+RENEWAL_RE = (
+    r"(?:renouvel|recondu|prolung|verl[äa]nger|stillschweig|rinnov|tacit)[^.]{0,80}?"
+    r"(?:(?P<n>\d{1,2})\s*(?:\([^)]{0,10}\)\s*)?)?(?:\w+\s+)?"
+    r"(?P<unit>ann[ée]es?|anno|anni|jahre?s?|mois|monate?n?|mesi|mese)\b"
+)
+DATE_RE = r"\b(?P<d>\d{1,2})[./](?P<m>\d{1,2})[./](?P<y>\d{4})\b"
+# libellés de type de contrat (CNTR_TIPO) : "OPA", "OP A", "Operating A" et ses erreurs d'OCR
+# ("Opetating B") ; sensibles à la casse, pour ne pas lire "operativa" comme OPA
+OPERATING = r"\b(?:OP|OPERATING|Op[a-z]{5,7}g)\s?"
+TYPE_PATTERNS = {
+    "OPA": OPERATING + r"A\b",
+    "OPB": OPERATING + r"B\b",
+    "OPK": OPERATING + r"K\b",
+    "OPP": OPERATING + r"P\b",
+    "M": r"(?i)\b(?:maintenance|wartung|manutenzione)\b",
+    "NESP": r"(?i)\bnespresso\b",
+}
+
+# contrôles du README sans règle déterministe : toujours confiés au LLM
+LLM_ONLY_CONTROLS = ["prices", "inventory"]
+
+_STREET_ABBREV = [(r"stra(ss|ß)e\b", "str"), (r"\bstr\b\.?", "str"), (r"\bav\b\.?", "avenue"), (r"\bch\b\.?", "chemin")]
+
+
+def _norm_address(series: pd.Series) -> pd.Series:
+    s = normalize_names(series)
+    for pattern, repl in _STREET_ABBREV:
+        s = s.str.replace(pattern, repl, regex=True)
+    return s.str.replace(r"\s+", "", regex=True)
+
+
+def _norm_name(series: pd.Series) -> pd.Series:
+    s = normalize_names(series)
+    return s.str.replace(r"\b(sa|ag|gmbh|sarl|sagl|srl|spa|ltd)\b", " ", regex=True).str.replace(r"\s+", "", regex=True)
+
+
+def _as_sets(values: pd.Series, index) -> pd.Series:
+    """Regroupe des valeurs extractall (index multi-niveau) en un ensemble par contrat."""
+    sets = values.dropna().groupby(level=0).agg(set).reindex(index)
+    return sets.map(lambda v: v if isinstance(v, set) else set())
+
+
+def extract_facts(texts: pd.Series) -> pd.DataFrame:
+    """Faits contractuels extraits du texte : types, durées, renouvellements, dates (en mois / jours)."""
+    texts = texts.fillna("").astype(str)
+    facts = pd.DataFrame(index=texts.index)
+
+    flags = pd.DataFrame({code: texts.str.contains(p, regex=True) for code, p in TYPE_PATTERNS.items()})
+    # "manutenzione"/"Wartung" apparaissent aussi dans les contrats Operating
+    flags["M"] &= ~flags[[c for c in flags.columns if c.startswith("OP")]].any(axis=1)
+    facts["types"] = flags.apply(lambda row: set(row.index[row]), axis=1) if len(texts) else []
+
+    durations = texts.str.extractall(DURATION_RE, flags=re.IGNORECASE)
+    months = pd.to_numeric(durations["months"].fillna(durations["paren"]), errors="coerce")
+    facts["durations"] = _as_sets(months.astype("Int64"), texts.index)
+
+    renewals = texts.str.extractall(RENEWAL_RE, flags=re.IGNORECASE)
+    count = pd.to_numeric(renewals["n"], errors="coerce").fillna(1)
+    per_year = ~renewals["unit"].str.lower().str.match(r"mo|me")
+    facts["renewals"] = _as_sets((count * per_year.map({True: 12, False: 1})).astype("Int64"), texts.index)
+
+    dates = texts.str.extractall(DATE_RE)
+    parsed = pd.to_datetime(
+        dict(year=dates["y"].astype(int), month=dates["m"].astype(int), day=dates["d"].astype(int)),
+        errors="coerce",
+    ) if not dates.empty else pd.Series(dtype="datetime64[ns]")
+    facts["dates"] = _as_sets(parsed, texts.index)
+    return facts
+
+
+def _membership(vega: pd.DataFrame, facts: pd.DataFrame, vega_col: str, fact_col: str) -> pd.DataFrame:
+    """
+    Pour chaque contrat : la valeur Vega figure-t-elle parmi les valeurs du texte ?
+    Un contrat sans valeur Vega (aucun contrat dans Vega, champ vide) garde une ligne, has_vega=False.
+    """
+    rows = vega[["contract_id", vega_col]].dropna()
+    found = facts[fact_col].explode().dropna().rename("value").reset_index()
+    found.columns = ["contract_id", "value"]
+    # les deux côtés de la jointure dans le même type : un texte sans date ou un lot vide
+    # donne une colonne vide de type object (ou float), que pandas refuse de joindre
+    if vega_col.startswith("CNTR_DATA"):
+        rows = rows.assign(**{vega_col: pd.to_datetime(rows[vega_col], errors="coerce").dt.normalize()})
+        found["value"] = pd.to_datetime(found["value"], errors="coerce")
+    elif fact_col != "types":
+        rows = rows.assign(**{vega_col: pd.to_numeric(rows[vega_col], errors="coerce")})
+        found["value"] = pd.to_numeric(found["value"], errors="coerce")
+    else:
+        rows = rows.assign(**{vega_col: rows[vega_col].astype(str)})
+        found["value"] = found["value"].astype(object)
+    rows = rows.assign(contract_id=rows["contract_id"].astype(object))
+    found["contract_id"] = found["contract_id"].astype(object)
+
+    merged = rows.merge(found, how="left", left_on=["contract_id", vega_col], right_on=["contract_id", "value"])
+    grouped = merged.groupby("contract_id").agg(
+        matched=("value", lambda v: v.notna().any()),
+        vega_value=(vega_col, lambda v: ", ".join(sorted({str(x)[:10] for x in v}))),
+    )
+    grouped["has_vega"] = True
+    grouped = grouped.reindex(pd.Index(facts.index, name="contract_id"))
+    grouped["matched"] = grouped["matched"].eq(True)
+    grouped["has_vega"] = grouped["has_vega"].eq(True)
+    # lot sans valeur Vega : l'agrégat vide garde le type de la colonne (dates), fillna n'y suffit pas
+    grouped["vega_value"] = grouped["vega_value"].astype(object).where(grouped["vega_value"].notna(), "")
+    grouped["contract_value"] = facts[fact_col].reindex(grouped.index).map(
+        lambda v: ", ".join(sorted(str(x)[:10] for x in v))
+    )
+    grouped["has_text"] = facts[fact_col].reindex(grouped.index).map(bool)
+    return grouped.reset_index()
+
+
+def _field_check(left: pd.Series, right: pd.DataFrame, normalizer) -> pd.DataFrame:
+    """Égalité normalisée d'un champ extrait contre une ou plusieurs colonnes Vega."""
+    left_norm = normalizer(left)
+    matched = pd.Series(False, index=left.index)
+    for col in right.columns:
+        matched |= (left_norm != "") & (left_norm == normalizer(right[col]))
+    vega_value = right.astype(str).where(right.notna(), "").agg(" | ".join, axis=1).str.strip(" |")
+    return pd.DataFrame({
+        "matched": matched,
+        "has_text": left_norm != "",
+        "contract_value": left.fillna("").astype(str),
+        "vega_value": vega_value,
+    })
+
+
+def _status(frame: pd.DataFrame, mismatch_when_found: bool = True) -> pd.Series:
+    status = pd.Series("unresolved", index=frame.index)
+    status[frame["matched"]] = "ok"
+    if mismatch_when_found:
+        status[~frame["matched"] & frame["has_text"]] = "mismatch"
+    return status
+
+
+@traced("checks.run")
+def run_checks(items: list) -> pd.DataFrame:
+    """Exécute tous les contrôles sur un lot de contrats et retourne les constats."""
+    columns = ["contract_id", "control", "check", "status", "contract_value", "vega_value"]
+    if not items:
+        return pd.DataFrame(columns=columns)
+    ids = [item["id"] for item in items]
+    texts = pd.Series([item["text"] for item in items], index=ids)
+    facts = extract_facts(texts)
+
+    contracts = pd.DataFrame([
+        dict(row, contract_id=item["id"]) for item in items for row in item["report_data"]["contracts_match"]
+    ], columns=["contract_id", "CNTR_TIPO", "CNTR_DURATACTR", "CNTR_DURATATACITORINNOVO", "CNTR_DATASTIPULACONTRATTO"])
+
+    findings = []
+    for check, vega_col, fact_col, strict in [
+        ("contract_type", "CNTR_TIPO", "types", True),
+        ("duration", "CNTR_DURATACTR", "durations", True),
+        ("renewal", "CNTR_DURATATACITORINNOVO", "renewals", True),
+        # une date absente du texte n'est pas une incohérence en soi
+        ("start_date", "CNTR_DATASTIPULACONTRATTO", "dates", False),
+    ]:
+        result = _membership(contracts, facts, vega_col, fact_col)
+        result["status"] = _status(result, mismatch_when_found=strict)
+        # rien à comparer côté Vega : reste ouvert (et part au LLM), jamais "mismatch"
+        result.loc[~result["has_vega"], "status"] = "unresolved"
+        findings.append(result.assign(control="conditions", check=check))
+
+    info = pd.DataFrame([item["report_data"].get("client_info") or {} for item in items], index=ids)
+    clienti = pd.DataFrame([(item["report_data"]["clienti_match"] or [{}])[0] for item in items], index=ids)
+    accounts = pd.DataFrame([(item["report_data"]["accounts_match"] or [{}])[0] for item in items], index=ids)
+    vega = pd.concat([clienti.add_prefix("cli."), accounts.add_prefix("ctb.")], axis=1)
+
+    def column(frame, name):
+        return frame[name] if name in frame.columns else pd.Series(None, index=frame.index, dtype=object)
+
+    client_checks = [
+        ("client_name", column(info, "client_name"), ["cli.CLI_NOME", "cli.CLI_NOME2", "ctb.CTB_DESC"], _norm_name),
+        ("address", column(info, "address"), ["cli.CLI_IND", "ctb.CTB_IND"], _norm_address),
+        ("zip", column(info, "zip"), ["cli.CLI_CAP", "ctb.CTB_CAP"], lambda s: s.fillna("").astype(str).str.strip()),
+    ]
+    for check, left, cols, normalizer in client_checks:
+        right = pd.DataFrame({c: column(vega, c) for c in cols})
+        result = _field_check(left, right, normalizer)
+        result["status"] = _status(result)
+        findings.append(result.rename_axis("contract_id").reset_index().assign(control="client", check=check))
+
+    findings.append(_location_findings(ids, column(info, "zip"), column(clienti, "CLI_LATITWGSDEC"),
+                                       column(clienti, "CLI_LONGITWGSDEC")))
+
+    grids = [(item["id"], item["prices"]) for item in items if item.get("prices") is not None]
+    if grids:
+        findings.append(price_findings(grids))
+
+    return pd.concat(findings, ignore_index=True)[columns].sort_values(["contract_id", "control", "check"], kind="stable")
+
+
+def _location_findings(ids: list, zips: pd.Series, lat: pd.Series, lon: pd.Series) -> pd.DataFrame:
+    """NPA du contrat proche de la position Vega du client (centroïdes NPA, utils.geo) ?"""
+    try:
+        postcodes = get_postcodes()
+    except (OSError, ValueError, KeyError):
+        # centroïdes illisibles (cache, CSV officiel) : rien n'est tranché
+        postcodes = pd.DataFrame(columns=["city", "lat", "lon", "clients", "source"])
+    result = location_check(zips.to_numpy(), lat.to_numpy(), lon.to_numpy(), postcodes=postcodes)
+    coords = pd.DataFrame({"lat": pd.to_numeric(lat, errors="coerce").to_numpy(),
+                           "lon": pd.to_numeric(lon, errors="coerce").to_numpy()})
+    known = coords.notna().all(axis=1)
+    vega_value = (coords["lat"].map("{:.5f}".format).astype(str) + ", "
+                  + coords["lon"].map("{:.5f}".format).astype(str)).where(known, "")
+    distance = result["distance_km"]
+    vega_value = vega_value.where(distance.isna(), vega_value + " (" + distance.astype(str) + " km)")
+    return pd.DataFrame({
+        "contract_id": ids,
+        "control": "client",
+        "check": "location",
+        "status": result["status"].to_numpy(),
+        "contract_value": zips.where(zips.notna(), "").astype(str).to_numpy(),
+        "vega_value": vega_value.to_numpy(),
+    })
+
+
+def llm_controls(findings: pd.DataFrame) -> list:
+    """Contrôles sans règle encore à confier au LLM : ceux sans constat, ou avec un constat non tranché."""
+    return [
+        c for c in LLM_ONLY_CONTROLS
+        if not (findings["control"] == c).any() or (unresolved(findings)["control"] == c).any()
+    ]
+
+
+def unresolved(findings: pd.DataFrame) -> pd.DataFrame:
+    return findings[findings["status"] == "unresolved"]
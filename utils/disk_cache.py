@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from utils.table_store import CACHE_ROOT
+
+
+class DiskCache:
+    """
+    Cache clé -> JSON sur disque, une entrée par fichier.
+    Écritures atomiques (os.replace) : les lecteurs concurrents ne voient jamais
+    d'entrée partielle. L'éviction LRU se base sur le mtime, mis à jour à chaque lecture.
+    `ttl` (secondes) expire les entrées selon leur date d'écriture.
+    """
+
+    def __init__(self, name: str, max_bytes: int = 512 * 1024 * 1024, ttl: float = None):
+        self.root = CACHE_ROOT / name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._size = None  # taille estimée, recalculée à chaque éviction
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        h = hashlib.sha256()
+        for part in parts:
+            h.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if self.ttl is not None and time.time() - entry["created"] > self.ttl:
+            path.unlink(missing_ok=True)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry["value"]
+
+    def set(self, key: str, value) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        payload = json.dumps({"created": time.time(), "value": value}, ensure_ascii=False)
+        tmp.write_text(payload, encoding="utf-8")
+        os.replace(tmp, path)
+        with self._lock:
+            if self._size is not None:
+                self._size += len(payload)
+        if self._size is None or self._size > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        """Supprime les entrées les moins récemment utilisées au-delà de max_bytes."""
+        with self._lock:
+            entries = []
+            total = 0
+            for path in self.root.glob("*/*.json"):
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+            self._size = total
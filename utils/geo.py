@@ -0,0 +1,333 @@
+"""
+Index spatial des clients (coordonnées WGS84 de clienti) et centroïdes des NPA suisses.
+
+Les points sont rangés dans une grille geohash (cellules ~0.6 x 0.8 km en Suisse) :
+une recherche de voisins ne lit que les cellules autour du point, et la recherche de
+doublons joint chaque cellule à ses 8 voisines, sans comparer tous les couples.
+Les centroïdes NPA viennent de VEGA_POSTCODES_CSV (colonnes zip, city, lat, lon, ex.
+répertoire officiel des localités de swisstopo) quand il est fourni, et sont complétés
+par la médiane des coordonnées des clients de chaque NPA ; ils sont persistés par version
+de clienti. address_audit() contrôle tout clienti d'un coup, location_check() la
+cohérence entre les NPA lus dans des contrats et la position des clients dans Vega.
+
+    python -m utils.geo                   # audit NPA/ville <-> coordonnées
+    python -m utils.geo --duplicates 30   # clients distincts à moins de 30 m
+"""
+import argparse
+import functools
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+from utils.name_index import normalize_names
+from utils.table_store import CACHE_DIR, load_table, table_version
+from utils.tracing import span, traced
+
+LAT, LON = "CLI_LATITWGSDEC", "CLI_LONGITWGSDEC"
+POSTCODES_CSV = os.environ.get("VEGA_POSTCODES_CSV")
+# distance au centroïde du NPA au-delà de laquelle l'adresse est incohérente
+MAX_ZIP_KM = float(os.environ.get("VEGA_MAX_ZIP_KM", "15"))
+# nombre minimal de clients pour qu'un centroïde dérivé de clienti soit fiable
+MIN_ZIP_CLIENTS = 3
+
+GEOHASH_PRECISION = 6
+_BASE32 = np.array(list("0123456789bcdefghjkmnpqrstuvwxyz"))
+EARTH_RADIUS_KM = 6371.0088
+# emprise de la Suisse : les coordonnées hors cadre sont des erreurs de saisie
+SWISS_BOUNDS = (45.7, 47.9, 5.8, 10.6)
+
+_lock = threading.Lock()
+_index_cache: dict = {}
+
+
+def _bits(precision: int) -> tuple:
+    total = 5 * precision
+    return total // 2, total - total // 2  # bits latitude, longitude
+
+
+def grid_cells(lat, lon, precision: int = GEOHASH_PRECISION) -> tuple:
+    """Indices de ligne/colonne de la grille geohash (vectorisé)."""
+    lat_bits, lon_bits = _bits(precision)
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    row = np.clip(((lat + 90.0) / 180.0 * (1 << lat_bits)).astype(np.int64), 0, (1 << lat_bits) - 1)
+    col = np.clip(((lon + 180.0) / 360.0 * (1 << lon_bits)).astype(np.int64), 0, (1 << lon_bits) - 1)
+    return row, col
+
+
+def geohash(lat, lon, precision: int = GEOHASH_PRECISION) -> np.ndarray:
+    """Geohash base32 de chaque point (bits longitude/latitude entrelacés, longitude en premier)."""
+    lat_bits, lon_bits = _bits(precision)
+    row, col = grid_cells(lat, lon, precision)
+    code = np.zeros(row.shape, dtype=np.int64)
+    for i in range(lon_bits):
+        code = (code << 1) | ((col >> (lon_bits - 1 - i)) & 1)
+        if i < lat_bits:
+            code = (code << 1) | ((row >> (lat_bits - 1 - i)) & 1)
+    chars = [_BASE32[(code >> (5 * (precision - 1 - k))) & 31] for k in range(precision)]
+    return functools.reduce(np.char.add, chars)
+
+
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def _cell_size_km(precision: int, lat: float = 47.0) -> float:
+    """Plus petit côté d'une cellule à la latitude donnée."""
+    lat_bits, lon_bits = _bits(precision)
+    height = 180.0 / (1 << lat_bits) * 111.32
+    width = 360.0 / (1 << lon_bits) * 111.32 * np.cos(np.radians(lat))
+    return min(height, width)
+
+
+def _coordinates(df: pd.DataFrame) -> pd.DataFrame:
+    lat = pd.to_numeric(df[LAT], errors="coerce")
+    lon = pd.to_numeric(df[LON], errors="coerce")
+    south, north, west, east = SWISS_BOUNDS
+    valid = lat.between(south, north) & lon.between(west, east)
+    return pd.DataFrame({"lat": lat.where(valid), "lon": lon.where(valid)})
+
+
+def _zip_codes(series: pd.Series) -> pd.Series:
+    return series.astype(str).str.extract(r"(\d{4})", expand=False)
+
+
+class GeoIndex:
+    """Grille geohash sur les clients géolocalisés ; cellules triées pour des lookups par searchsorted."""
+
+    def __init__(self, df_clienti: pd.DataFrame, precision: int = GEOHASH_PRECISION):
+        coords = _coordinates(df_clienti)
+        keep = coords["lat"].notna().to_numpy()
+        self.precision = precision
+        self.cli_cod = df_clienti["CLI_COD"].to_numpy()[keep]
+        self.lat = coords["lat"].to_numpy()[keep]
+        self.lon = coords["lon"].to_numpy()[keep]
+
+        self._lon_bits = _bits(precision)[1]
+        row, col = grid_cells(self.lat, self.lon, precision)
+        cells = (row << self._lon_bits) | col
+        self.order = np.argsort(cells, kind="stable")
+        self.cells = cells[self.order]
+        self.geohash = geohash(self.lat, self.lon, precision) if len(self.lat) else np.array([], dtype=str)
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    def _in_cells(self, row: int, col: int, ring: int) -> np.ndarray:
+        """Positions des points dans les cellules à au plus `ring` cellules de (row, col)."""
+        parts = []
+        for r in range(row - ring, row + ring + 1):
+            lo = np.searchsorted(self.cells, (r << self._lon_bits) | (col - ring), side="left")
+            hi = np.searchsorted(self.cells, (r << self._lon_bits) | (col + ring), side="right")
+            parts.append(self.order[lo:hi])
+        return np.concatenate(parts) if parts else np.array([], dtype=np.int64)
+
+    def nearby(self, lat: float, lon: float, radius_km: float = 1.0) -> pd.DataFrame:
+        """Clients à moins de `radius_km` du point, du plus proche au plus lointain."""
+        ring = int(np.ceil(radius_km / _cell_size_km(self.precision, lat)))
+        row, col = grid_cells([lat], [lon], self.precision)
+        pos = self._in_cells(int(row[0]), int(col[0]), ring)
+        dist = haversine_km(lat, lon, self.lat[pos], self.lon[pos])
+        keep = dist <= radius_km
+        out = pd.DataFrame({"CLI_COD": self.cli_cod[pos][keep], "distance_km": dist[keep].round(4)})
+        return out.sort_values("distance_km", kind="stable").reset_index(drop=True)
+
+    def duplicate_sites(self, radius_m: float = 30.0) -> pd.DataFrame:
+        """
+        Couples de clients distincts à moins de `radius_m` l'un de l'autre (même site, fiche
+        en double probable). Chaque cellule n'est jointe qu'à ses voisines.
+        """
+        if radius_m / 1000 > _cell_size_km(self.precision):
+            raise ValueError(f"rayon trop grand pour la précision {self.precision}")
+        points = pd.DataFrame({"i": self.order, "cell": self.cells})
+        pairs = []
+        for dr in (-1, 0, 1):
+            for dc in (-1, 0, 1):
+                shifted = points.assign(cell=points["cell"] + (dr << self._lon_bits) + dc)
+                joined = points.merge(shifted, on="cell", suffixes=("_a", "_b"))
+                pairs.append(joined[joined["i_a"] < joined["i_b"]][["i_a", "i_b"]])
+        pairs = pd.concat(pairs, ignore_index=True)
+        a, b = pairs["i_a"].to_numpy(), pairs["i_b"].to_numpy()
+        dist_m = haversine_km(self.lat[a], self.lon[a], self.lat[b], self.lon[b]) * 1000
+        keep = (dist_m <= radius_m) & (self.cli_cod[a] != self.cli_cod[b])
+        return pd.DataFrame({
+            "CLI_COD_a": self.cli_cod[a][keep],
+            "CLI_COD_b": self.cli_cod[b][keep],
+            "distance_m": dist_m[keep].round(1),
+            "geohash": self.geohash[a][keep],
+        }).sort_values(["distance_m", "CLI_COD_a"], kind="stable").reset_index(drop=True)
+
+
+def _derived_centroids(df_clienti: pd.DataFrame) -> pd.DataFrame:
+    """Centroïde de chaque NPA : médiane des coordonnées de ses clients, localité la plus fréquente."""
+    coords = _coordinates(df_clienti)
+    frame = pd.DataFrame({
+        "zip": _zip_codes(df_clienti["CLI_CAP"]),
+        "city": df_clienti["CLI_CIT"].astype(str).str.strip(),
+        "lat": coords["lat"],
+        "lon": coords["lon"],
+    }).dropna(subset=["zip", "lat"])
+    grouped = frame.groupby("zip")
+    return pd.DataFrame({
+        "city": grouped["city"].agg(lambda s: s.mode().iat[0]),
+        "lat": grouped["lat"].median(),
+        "lon": grouped["lon"].median(),
+        "clients": grouped.size(),
+    }).reset_index().assign(source="clienti")
+
+
+def load_postcodes_csv(path) -> pd.DataFrame:
+    """Table de NPA externe (zip, city, lat, lon) ; séparateur détecté (virgule ou point-virgule)."""
+    df = pd.read_csv(path, sep=None, engine="python", dtype={"zip": str})
+    df.columns = [c.strip().lower() for c in df.columns]
+    df = df.assign(zip=_zip_codes(df["zip"]), lat=pd.to_numeric(df["lat"], errors="coerce"),
+                   lon=pd.to_numeric(df["lon"], errors="coerce")).dropna(subset=["zip", "lat", "lon"])
+    # un NPA couvre parfois plusieurs localités : un centroïde par NPA
+    return df.groupby("zip").agg(city=("city", "first"), lat=("lat", "mean"), lon=("lon", "mean")).reset_index()
+
+
+def postcode_centroids(df_clienti: pd.DataFrame, csv_path=None) -> pd.DataFrame:
+    """Centroïdes NPA : table externe prioritaire, complétée par ceux dérivés de clienti."""
+    derived = _derived_centroids(df_clienti)
+    csv_path = csv_path or POSTCODES_CSV
+    if not csv_path:
+        return derived
+    official = load_postcodes_csv(csv_path).assign(clients=np.nan, source="csv")
+    return pd.concat([official, derived[~derived["zip"].isin(official["zip"])]], ignore_index=True)
+
+
+def get_postcodes() -> pd.DataFrame:
+    """Centroïdes NPA indexés par NPA, persistés dans le cache par version de clienti (et du CSV)."""
+    version = table_version("clienti")
+    key = ("postcodes", version, POSTCODES_CSV)
+    table = _index_cache.get(key)
+    if table is not None:
+        return table
+    with _lock:
+        table = _index_cache.get(key)
+        if table is None:
+            path = CACHE_DIR / f"clienti.postcodes.{version[:16]}.parquet"
+            if path.exists() and not POSTCODES_CSV:
+                table = pd.read_parquet(path)
+            else:
+                with span("geo.postcodes_build"):
+                    table = postcode_centroids(load_table("clienti"))
+                if not POSTCODES_CSV:
+                    for old in CACHE_DIR.glob("clienti.postcodes.*.parquet"):
+                        old.unlink(missing_ok=True)
+                    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+                    table.to_parquet(tmp, index=False)
+                    tmp.replace(path)
+            table = table.set_index("zip")
+            _index_cache[key] = table
+    return table
+
+
+def get_geo_index() -> GeoIndex:
+    """Index partagé par le process, reconstruit quand clienti change."""
+    key = ("grid", table_version("clienti"))
+    index = _index_cache.get(key)
+    if index is None:
+        with _lock:
+            index = _index_cache.get(key)
+            if index is None:
+                with span("geo.index_build"):
+                    index = GeoIndex(load_table("clienti"))
+                _index_cache[key] = index
+    return index
+
+
+def _trusted(ref: pd.DataFrame) -> np.ndarray:
+    """Centroïdes fiables : table officielle, ou dérivés d'au moins MIN_ZIP_CLIENTS clients."""
+    return (ref["source"].to_numpy() == "csv") | (ref["clients"].fillna(0).to_numpy() >= MIN_ZIP_CLIENTS)
+
+
+def _city_key(series: pd.Series) -> pd.Series:
+    # "Aarau 1", "Lugano-Paradiso" -> premier mot normalisé
+    return normalize_names(series).str.split(r"[\s\-]", regex=True).str[0].fillna("")
+
+
+@traced("geo.address_audit")
+def address_audit(df_clienti: pd.DataFrame = None, postcodes: pd.DataFrame = None,
+                  max_km: float = MAX_ZIP_KM) -> pd.DataFrame:
+    """
+    Cohérence NPA/ville <-> coordonnées pour tous les clients, en une passe vectorisée.
+    status : ok | mismatch (trop loin du centroïde du NPA) | no_coordinates | unknown_zip |
+    unverifiable (centroïde tiré de trop peu de clients).
+    """
+    df = load_table("clienti") if df_clienti is None else df_clienti
+    postcodes = get_postcodes() if postcodes is None else postcodes
+    coords = _coordinates(df)
+    zips = _zip_codes(df["CLI_CAP"])
+    ref = postcodes.reindex(zips.to_numpy())
+
+    out = pd.DataFrame({
+        "CLI_COD": df["CLI_COD"].to_numpy(),
+        "CLI_CAP": df["CLI_CAP"].to_numpy(),
+        "CLI_CIT": df["CLI_CIT"].to_numpy(),
+        "lat": coords["lat"].to_numpy(),
+        "lon": coords["lon"].to_numpy(),
+        "zip_city": ref["city"].to_numpy(),
+    })
+    out["distance_km"] = haversine_km(out["lat"], out["lon"], ref["lat"].to_numpy(), ref["lon"].to_numpy()).round(2)
+    out["city_match"] = (_city_key(out["CLI_CIT"]) == _city_key(out["zip_city"])).to_numpy()
+
+    trusted = _trusted(ref)
+    out["status"] = np.select(
+        [out["lat"].isna(), ref["lat"].isna().to_numpy(), ~trusted, out["distance_km"] > max_km],
+        ["no_coordinates", "unknown_zip", "unverifiable", "mismatch"],
+        default="ok",
+    )
+    return out
+
+
+@traced("geo.location_check")
+def location_check(contract_zip, lat, lon, postcodes: pd.DataFrame = None, max_km: float = MAX_ZIP_KM) -> pd.DataFrame:
+    """
+    Les NPA lus dans les contrats sont-ils proches de la position Vega des clients ?
+    Une ligne par contrat (zip, zip_city, distance_km, status) ; status : ok | mismatch |
+    unresolved (NPA ou coordonnées absents, NPA inconnu, centroïde tiré de trop peu de clients).
+    """
+    zips = _zip_codes(pd.Series(contract_zip, dtype=object))
+    coords = _coordinates(pd.DataFrame({LAT: np.asarray(lat, dtype=object), LON: np.asarray(lon, dtype=object)}))
+    postcodes = get_postcodes() if postcodes is None else postcodes
+    ref = postcodes.reindex(zips.to_numpy())
+
+    distance = haversine_km(coords["lat"].to_numpy(), coords["lon"].to_numpy(),
+                            ref["lat"].to_numpy(), ref["lon"].to_numpy()).round(2)
+    unresolved = np.isnan(distance) | ~_trusted(ref)
+    return pd.DataFrame({
+        "zip": zips.to_numpy(),
+        "zip_city": ref["city"].to_numpy(),
+        "distance_km": distance,
+        "status": np.where(unresolved, "unresolved", np.where(distance > max_km, "mismatch", "ok")),
+    })
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Audit géographique des adresses clients Vega.")
+    parser.add_argument("--duplicates", type=float, metavar="METRES", default=None,
+                        help="liste les clients distincts géolocalisés à moins de METRES l'un de l'autre")
+    parser.add_argument("-o", "--output", default=None, help="écrit le détail en CSV")
+    args = parser.parse_args(argv)
+
+    if args.duplicates is not None:
+        result = get_geo_index().duplicate_sites(args.duplicates)
+        summary = {"pairs": len(result), "clients": int(pd.unique(result[["CLI_COD_a", "CLI_COD_b"]].to_numpy().ravel()).size)}
+    else:
+        result = address_audit()
+        summary = {"status": result["status"].value_counts().to_dict(),
+                   "city_mismatch": int((~result["city_match"] & (result["status"] == "ok")).sum())}
+    if args.output:
+        result.to_csv(args.output, index=False)
+    print(json.dumps(summary, ensure_ascii=False, indent=2), file=sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
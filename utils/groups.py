@@ -0,0 +1,282 @@
+"""
+Groupes holding / filiales : composantes connexes du graphe des codes client Vega.
+
+Les codes CLI_COD, CTB_COD, CNTR_SEDELEGALE, CNTR_CLIENTE et UPV_CLI partagent le même
+espace. Un contrat relie son client (CNTR_CLIENTE) à son siège légal (CNTR_SEDELEGALE),
+et les comptes d'une même holding (CTB_HOLDING) sont reliés entre eux. Les composantes
+sont calculées par union-find une fois par snapshot et persistées dans le cache
+(code -> groupe). Un client se résout alors en une recherche vers tout son groupe :
+clients, comptes, contrats et machines.
+
+    python3 -m utils.groups                 # audit de tous les groupes
+    python3 -m utils.groups --code 27106    # groupe d'un client
+"""
+import argparse
+import hashlib
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from utils.relations import _EMPTY, RelationIndex, _build_index, _key
+from utils.table_store import CACHE_DIR, TABLES, load_table, table_version
+from utils.tracing import span, traced
+
+# valeurs de CTB_HOLDING qui ne désignent pas une holding
+NO_HOLDING = {"", "KEINE", "NONE", "-"}
+
+# colonnes de codes client par table
+CODE_COLUMNS = {
+    "clienti": ["CLI_COD"],
+    "ctbcont": ["CTB_COD"],
+    "contratti": ["CNTR_SEDELEGALE", "CNTR_CLIENTE"],
+    "unopv": ["UPV_CLI"],
+}
+
+_lock = threading.Lock()
+_index_cache: dict = {}
+
+
+def _codes(series: pd.Series) -> pd.Series:
+    """Codes client en texte canonique ('27106' pour 27106, 27106.0 ou '27106'), None si vide."""
+    numeric = pd.to_numeric(series, errors="coerce")
+    whole = (numeric.notna() & (numeric % 1 == 0)).to_numpy()
+    out = np.full(len(series), None, dtype=object)
+    out[whole] = numeric[whole].astype("int64").astype(str).to_numpy()
+    rest = series.notna().to_numpy() & ~whole
+    if rest.any():
+        text = series[rest].astype(str).str.strip()
+        out[rest] = text.where(text != "", None).to_numpy()
+    return pd.Series(out, index=series.index)
+
+
+def components(n: int, left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """Union-find sur n nœuds et les arêtes (left[i], right[i]) ; retourne le groupe (0..k-1) de chaque nœud."""
+    parent = list(range(n))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in zip(left.tolist(), right.tolist()):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            # la plus petite racine l'emporte : numérotation stable d'un snapshot à l'autre
+            parent[max(ra, rb)] = min(ra, rb)
+    roots = np.fromiter((find(x) for x in range(n)), dtype=np.int64, count=n)
+    return np.unique(roots, return_inverse=True)[1]
+
+
+def _holding_labels(ctbcont: pd.DataFrame) -> pd.Series:
+    if "CTB_HOLDING" not in ctbcont.columns:
+        return pd.Series(None, index=ctbcont.index, dtype=object)
+    labels = ctbcont["CTB_HOLDING"].astype("string").str.strip().str.upper()
+    return labels.where(labels.notna() & ~labels.isin(NO_HOLDING), None).astype(object)
+
+
+def build_groups(tables: dict) -> pd.DataFrame:
+    """Table code -> groupe (un code par ligne) pour tous les codes client des tables."""
+    codes = {(name, col): _codes(tables[name][col])
+             for name, cols in CODE_COLUMNS.items() for col in cols if col in tables[name].columns}
+    all_codes = pd.concat(list(codes.values()), ignore_index=True).dropna()
+    uniques = pd.Index(all_codes.unique())
+
+    edges = []
+    contract_cols = [codes.get(("contratti", c)) for c in CODE_COLUMNS["contratti"]]
+    if all(c is not None for c in contract_cols):
+        pairs = pd.DataFrame({"a": contract_cols[0], "b": contract_cols[1]}).dropna()
+        edges.append((uniques.get_indexer(pairs["a"]), uniques.get_indexer(pairs["b"])))
+
+    # comptes d'une même holding : chacun relié au premier compte du libellé
+    holdings = pd.DataFrame({"label": _holding_labels(tables["ctbcont"]),
+                             "code": codes[("ctbcont", "CTB_COD")]}).dropna()
+    if not holdings.empty:
+        first = holdings.groupby("label")["code"].transform("first")
+        edges.append((uniques.get_indexer(holdings["code"]), uniques.get_indexer(first)))
+
+    left = np.concatenate([e[0] for e in edges]) if edges else _EMPTY
+    right = np.concatenate([e[1] for e in edges]) if edges else _EMPTY
+    return pd.DataFrame({"code": uniques.astype(str), "group": components(len(uniques), left, right)})
+
+
+def _split_positions(labels: np.ndarray) -> dict:
+    """Groupe -> positions des lignes (tri stable), sans les lignes hors groupe (NaN)."""
+    positions = np.flatnonzero(~np.isnan(labels))
+    positions = positions[np.argsort(labels[positions], kind="stable")]
+    sorted_labels = labels[positions].astype(np.int64)
+    starts = np.flatnonzero(np.diff(sorted_labels, prepend=-1))
+    ends = np.append(starts[1:], len(positions))
+    # vues sur un seul tableau trié (np.split copie chaque morceau)
+    return {g: positions[a:b] for g, a, b in zip(sorted_labels[starts].tolist(), starts.tolist(), ends.tolist())}
+
+
+class GroupIndex:
+    """
+    Groupes holding / filiales d'un snapshot de tables, avec les lignes de chaque table par groupe.
+    La table code -> groupe (`groups`) peut venir du cache ; les positions sont recalculées.
+    """
+
+    def __init__(self, tables: dict, groups: pd.DataFrame = None):
+        self.tables = tables
+        self.groups = build_groups(tables) if groups is None else groups
+        self.group_of = pd.Series(self.groups["group"].to_numpy(), index=pd.Index(self.groups["code"]))
+        self.codes_by_group = _split_positions(self.groups["group"].to_numpy(dtype=float))
+
+        self.row_codes = {name: _codes(tables[name][cols[0]]).to_numpy() for name, cols in CODE_COLUMNS.items()}
+        self.by_group = {name: self._positions(name, cols[0]) for name, cols in CODE_COLUMNS.items()}
+        self.by_mod_cod = _build_index(tables["modelli"]["MOD_COD"])
+        self.holdings = _holding_labels(tables["ctbcont"])
+
+    def _labels(self, name: str, col: str) -> pd.Series:
+        codes = self.row_codes[name] if col == CODE_COLUMNS[name][0] else _codes(self.tables[name][col])
+        return pd.Series(codes, index=self.tables[name].index).map(self.group_of)
+
+    def _positions(self, name: str, col: str) -> dict:
+        labels = self._labels(name, col)
+        if name == "contratti":
+            # siège légal absent : groupe du client du contrat
+            labels = labels.fillna(self._labels(name, "CNTR_CLIENTE"))
+        return _split_positions(labels.to_numpy(dtype=float))
+
+    def group(self, cli_cod):
+        """Numéro de groupe d'un code client, None si le code est inconnu."""
+        code = _key(cli_cod)
+        group = self.group_of.get(str(code)) if code is not None else None
+        return None if group is None else int(group)
+
+    def codes(self, cli_cod) -> list:
+        """
+        Codes client liés au groupe de `cli_cod` (lui compris), sans lire les tables ;
+        entiers comme CLI_COD (texte seulement pour les codes non numériques).
+        """
+        group = self.group(cli_cod)
+        return [_key(c) for c in self.groups["code"].to_numpy()[self.codes_by_group.get(group, _EMPTY)]]
+
+    def _rows(self, name: str, group, first=None) -> pd.DataFrame:
+        """Lignes de `name` du groupe ; celles du code `first` en tête, ordre d'origine ensuite."""
+        positions = self.by_group[name].get(group, _EMPTY)
+        if first is not None:
+            own = self.row_codes[name][positions] == first
+            positions = np.concatenate([positions[own], positions[~own]])
+        return self.tables[name].iloc[positions]
+
+    def resolve_group(self, cli_cod) -> dict:
+        """
+        Toutes les lignes du groupe d'un client, au format de RelationIndex.resolve_customer.
+        Les lignes clienti / ctbcont du client demandé viennent en premier.
+        """
+        group = self.group(cli_cod)
+        code = str(_key(cli_cod))
+        clienti = self._rows("clienti", group, first=code)
+        accounts = self._rows("ctbcont", group, first=code)
+        unopv = self._rows("unopv", group)
+        mod_codes = pd.to_numeric(unopv["UPV_MOD"], errors="coerce").dropna().astype(int).unique()
+        return {
+            "cli_cod": cli_cod,
+            "group": group,
+            "codes": self.codes(cli_cod),
+            "holdings": sorted(set(self.holdings.loc[accounts.index].dropna())),
+            "clienti": clienti,
+            "accounts": accounts,
+            "contracts": self._rows("contratti", group),
+            "unopv": unopv,
+            "mod_codes": mod_codes,
+            "modelli": self.tables["modelli"].iloc[RelationIndex._lookup(self.by_mod_cod, mod_codes)],
+        }
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Une ligne par groupe : tailles, holdings et incohérences (contrats dont le siège légal
+        n'a pas de compte, machines dont le client n'est pas dans clienti, plusieurs holdings).
+        """
+        out = self.groups.groupby("group").agg(codes=("code", "size"), first_code=("code", "first"))
+        for name in CODE_COLUMNS:
+            out[name] = pd.Series({g: len(p) for g, p in self.by_group[name].items()}, dtype="int64")
+        out = out.fillna(0).astype({name: "int64" for name in CODE_COLUMNS})
+
+        holdings = pd.DataFrame({"label": self.holdings, "group": self._labels("ctbcont", "CTB_COD")}).dropna()
+        labels = holdings.groupby("group")["label"].agg(lambda s: ", ".join(sorted(set(s))))
+        out["holdings"] = labels.reindex(out.index)
+
+        accounts = set(self.row_codes["ctbcont"]) - {None}
+        clients = set(self.row_codes["clienti"]) - {None}
+        out["contracts_without_account"] = self._missing("contratti", "CNTR_SEDELEGALE", accounts, out.index)
+        out["unopv_without_client"] = self._missing("unopv", "UPV_CLI", clients, out.index)
+        out["multiple_holdings"] = out["holdings"].fillna("").str.contains(",")
+        return out.reset_index()
+
+    def _missing(self, name: str, col: str, known: set, index) -> pd.Series:
+        codes = pd.Series(self.row_codes[name], index=self.tables[name].index)
+        missing = codes.notna() & ~codes.isin(known)
+        return missing.groupby(self._labels(name, col)).sum().reindex(index, fill_value=0).astype("int64")
+
+
+def get_group_index() -> GroupIndex:
+    """Index partagé par le process ; la table code -> groupe est persistée par version des tables."""
+    tables = {name: load_table(name) for name in TABLES}
+    version = hashlib.sha256("".join(table_version(name) for name in CODE_COLUMNS).encode()).hexdigest()
+    index = _index_cache.get(version)
+    if index is not None:
+        return index
+
+    with _lock:
+        index = _index_cache.get(version)
+        if index is not None:
+            return index
+        path = CACHE_DIR / f"groups.{version[:16]}.parquet"
+        with span("groups.index_build"):
+            if path.exists():
+                index = GroupIndex(tables, pd.read_parquet(path))
+            else:
+                index = GroupIndex(tables)
+                for old in CACHE_DIR.glob("groups.*.parquet"):
+                    old.unlink(missing_ok=True)
+                tmp = path.with_suffix(f".{os.getpid()}.tmp")
+                index.groups.to_parquet(tmp, index=False)
+                tmp.replace(path)
+        _index_cache.clear()
+        _index_cache[version] = index
+    return index
+
+
+@traced("groups.resolve")
+def resolve_group(cli_cod) -> dict:
+    return get_group_index().resolve_group(cli_cod)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Groupes holding / filiales des clients Vega.")
+    parser.add_argument("--code", help="affiche le groupe de ce code client")
+    parser.add_argument("--min-size", type=int, default=2, help="taille minimale des groupes listés")
+    parser.add_argument("-o", "--output", help="écrit l'audit complet en CSV")
+    args = parser.parse_args(argv)
+
+    index = get_group_index()
+    if args.code:
+        bundle = index.resolve_group(args.code)
+        if bundle["group"] is None:
+            print(f"Unknown customer code {args.code}")
+            return
+        print(f"Group {bundle['group']}: {len(bundle['codes'])} code(s), {len(bundle['clienti'])} customer(s), "
+              f"{len(bundle['accounts'])} account(s), {len(bundle['contracts'])} contract(s), "
+              f"{len(bundle['unopv'])} machine(s); holdings: {', '.join(bundle['holdings']) or '-'}")
+        if not bundle["clienti"].empty:
+            print(bundle["clienti"][[c for c in ("CLI_COD", "CLI_NOME", "CLI_CIT") if c in bundle["clienti"]]]
+                  .to_string(index=False))
+        return
+
+    summary = index.summary()
+    if args.output:
+        summary.to_csv(args.output, index=False)
+    groups = summary[summary["codes"] >= args.min_size].sort_values("codes", ascending=False)
+    print(f"{len(summary)} group(s), {len(groups)} with at least {args.min_size} codes; "
+          f"{int((summary['contracts_without_account'] > 0).sum())} with contracts lacking an account, "
+          f"{int(summary['multiple_holdings'].sum())} spanning several holdings")
+    print(groups.head(20).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+Client OpenAI partagé avec cache de réponses persistant.
+
+Le client suit OPENAI_API_KEY et OPENAI_BASE_URL : pointer OPENAI_BASE_URL vers
+un serveur local (ex. http://127.0.0.1:8000/v1) permet de tester sans l'API.
+"""
+import os
+import asyncio
+import threading
+import time
+import weakref
+from concurrent.futures import CancelledError, Future
+
+import httpx
+from dotenv import load_dotenv
+from openai import APIConnectionError, APITimeoutError, AsyncOpenAI, OpenAI
+
+from utils.disk_cache import DiskCache
+from utils.tracing import count, current, span
+
+load_dotenv()
+
+DEFAULT_MODEL = "gpt-4.1"
+
+_cache = DiskCache(
+    "llm",
+    max_bytes=int(os.environ.get("VEGA_LLM_CACHE_MB", "256")) * 1024 * 1024,
+    ttl=float(os.environ.get("VEGA_LLM_CACHE_TTL", str(7 * 24 * 3600))),
+)
+
+_lock = threading.Lock()
+_client = None
+_async_clients = weakref.WeakKeyDictionary()
+_inflight: dict = {}
+_stats = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+
+
+def get_client() -> OpenAI:
+    """Client unique par process : son pool de connexions HTTP est réutilisé."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    return _client
+
+
+def get_async_client() -> AsyncOpenAI:
+    """
+    Client asynchrone de la boucle courante (ses connexions sont liées à la boucle),
+    sans retry interne : les reprises sont gérées par utils.check_scheduler.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"), max_retries=0)
+        _async_clients[loop] = client
+    return client
+
+
+def _count(name: str) -> None:
+    with _lock:
+        _stats[name] += 1
+    count(f"llm.{name}")
+
+
+def _count_usage(usage) -> None:
+    """Tokens facturés d'une réponse (absents des serveurs de test qui ne les renvoient pas)."""
+    if usage is not None:
+        count("llm.prompt_tokens", getattr(usage, "input_tokens", 0) or 0)
+        count("llm.response_tokens", getattr(usage, "output_tokens", 0) or 0)
+
+
+def _create(params: dict):
+    with span("llm.call", model=params["model"]):
+        response = get_client().responses.create(**params)
+    _count_usage(response.usage)
+    return response.output_text
+
+
+def cache_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"] + stats["coalesced"]
+    stats["hit_rate"] = round((stats["hits"] + stats["coalesced"]) / lookups, 3) if lookups else 0.0
+    return stats
+
+
+def _params(prompt: str, model: str, temperature: float, timeout: float) -> dict:
+    params = {"model": model, "input": prompt}
+    if temperature is not None:
+        params["temperature"] = temperature
+    if timeout is not None:
+        params["timeout"] = timeout
+    return params
+
+
+def complete(prompt: str, model: str = DEFAULT_MODEL, temperature: float = None, use_cache: bool = True,
+             timeout: float = None) -> str:
+    """
+    Texte de réponse du modèle pour `prompt`. Les prompts identiques sont servis
+    depuis le cache ; les appels identiques simultanés partagent une seule requête.
+    `timeout` (secondes) interrompt une requête trop lente.
+    """
+    params = _params(prompt, model, temperature, timeout)
+    if not use_cache:
+        _count("misses")
+        return _create(params)
+
+    key = DiskCache.make_key(model, temperature, prompt)
+    cached = _cache.get(key)
+    if cached is not None:
+        _count("hits")
+        return cached
+
+    with _lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _inflight[key] = future
+    if not owner:
+        _count("coalesced")
+        try:
+            return future.result()
+        except CancelledError:
+            # requête partagée abandonnée par une tâche asynchrone : on la refait
+            return complete(prompt, model, temperature, use_cache, timeout)
+
+    _count("misses")
+    try:
+        text = _create(params)
+        _cache.set(key, text)
+        future.set_result(text)
+        return text
+    except Exception as e:
+        _count("errors")
+        future.set_exception(e)
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+
+
+def stream(prompt: str, model: str = DEFAULT_MODEL, temperature: float = None, use_cache: bool = True,
+           timeout: float = None):
+    """
+    Générateur des morceaux de texte au fil de la génération. Lève TimeoutError au-delà de
+    `timeout` secondes au total, ou sans nouvel événement pendant `timeout` secondes (délai
+    de lecture du SDK). Fermer le générateur (abandon par l'appelant) ferme la connexion.
+    La réponse complète est mise en cache, une réponse déjà en cache est renvoyée d'un bloc.
+    """
+    key = DiskCache.make_key(model, temperature, prompt)
+    if use_cache:
+        cached = _cache.get(key)
+        if cached is not None:
+            _count("hits")
+            yield cached
+            return
+    _count("misses")
+
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    parts = []
+    started = time.perf_counter()
+    message = f"Réponse LLM non terminée après {timeout}s"
+    try:
+        response = get_client().responses.create(stream=True, **_params(prompt, model, temperature, timeout))
+    except APITimeoutError as e:
+        _count("errors")
+        raise TimeoutError(message) from e
+    try:
+        for event in response:
+            if deadline is not None and time.monotonic() > deadline:
+                _count("errors")
+                raise TimeoutError(message)
+            if event.type == "response.output_text.delta":
+                parts.append(event.delta)
+                yield event.delta
+            elif event.type == "response.completed":
+                _count_usage(event.response.usage)
+            elif event.type in ("response.failed", "error"):
+                _count("errors")
+                raise RuntimeError(f"Génération interrompue : {event.type}")
+    except httpx.TimeoutException as e:
+        # flux bloqué sans événement : le délai de lecture du SDK expire avant la vérification ci-dessus
+        _count("errors")
+        raise TimeoutError(message) from e
+    except httpx.TransportError as e:
+        # coupure en cours de flux : le SDK ne l'enveloppe pas, les appelants attendent une APIError
+        _count("errors")
+        raise APIConnectionError(request=response.response.request) from e
+    finally:
+        # fermeture explicite : libère la connexion si l'appelant abandonne le flux
+        response.close()
+        trace = current()
+        if trace is not None:
+            trace.add_span("llm.stream", started, time.perf_counter() - started, model=model)
+
+    if use_cache and parts:
+        _cache.set(key, "".join(parts))
+
+
+async def acomplete(prompt: str, model: str = DEFAULT_MODEL, temperature: float = None, use_cache: bool = True,
+                    timeout: float = None) -> str:
+    """
+    Équivalent asynchrone de complete(), partageant le même cache disque et les mêmes
+    requêtes en cours : un prompt déjà demandé (par complete() ou acomplete(), d'un thread
+    ou d'une boucle quelconque) est attendu au lieu d'être renvoyé à l'API.
+    """
+    params = _params(prompt, model, temperature, timeout)
+    if not use_cache:
+        _count("misses")
+        return await _acreate(params)
+
+    key = DiskCache.make_key(model, temperature, prompt)
+    cached = _cache.get(key)
+    if cached is not None:
+        _count("hits")
+        return cached
+
+    with _lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _inflight[key] = future
+    if not owner:
+        _count("coalesced")
+        try:
+            # shield : l'annulation d'un appelant n'annule pas la requête partagée
+            return await asyncio.shield(asyncio.wrap_future(future))
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                raise
+        # requête partagée abandonnée par sa tâche : on la refait
+        return await acomplete(prompt, model, temperature, use_cache, timeout)
+
+    _count("misses")
+    try:
+        text = await _acreate(params)
+        _cache.set(key, text)
+        future.set_result(text)
+        return text
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    except BaseException:
+        # tâche annulée (délai du scheduler) : les appels en attente sont annulés aussi
+        future.cancel()
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+
+
+async def _acreate(params: dict) -> str:
+    try:
+        with span("llm.call", model=params["model"]):
+            response = await get_async_client().responses.create(**params)
+    except Exception:
+        _count("errors")
+        raise
+    _count_usage(response.usage)
+    return response.output_text
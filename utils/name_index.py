@@ -0,0 +1,185 @@
+import os
+import pickle
+import re
+import threading
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from utils.table_store import CACHE_DIR, load_table, table_version
+from utils.tracing import span, traced
+
+NAME_COLUMNS = ["CLI_NOME", "CLI_NOME2"]
+
+# formes juridiques ignorées pour le rapprochement ("Frieden SA" == "Frieden")
+LEGAL_SUFFIXES = {
+    "sa", "ag", "gmbh", "sarl", "sagl", "srl", "spa", "sas", "snc", "ltd", "inc",
+    "co", "kg", "plc", "cie", "eg", "ug", "succ", "liq",
+}
+
+# un trigramme présent dans plus de MAX_DF * n entrées n'est pas discriminant
+MAX_DF = 0.05
+
+_lock = threading.Lock()
+_index_cache: dict = {}
+
+
+def normalize_name(text_value) -> str:
+    if not isinstance(text_value, str):
+        text_value = str(text_value)
+    text_value = text_value.replace("&", " ").replace("+", " ")
+    text_value = unicodedata.normalize("NFKD", text_value).encode("ascii", "ignore").decode("ascii")
+    text_value = re.sub(r"[^a-z0-9\-\s]", " ", text_value.lower())
+    return re.sub(r"\s+", " ", text_value).strip()
+
+
+def normalize_names(series: pd.Series) -> pd.Series:
+    """Version vectorisée de normalize_name sur une colonne entière."""
+    s = series.fillna("").astype(str).str.replace(r"[&+]", " ", regex=True)
+    s = s.str.normalize("NFKD").str.encode("ascii", "ignore").str.decode("ascii")
+    s = s.str.lower().str.replace(r"[^a-z0-9\-\s]", " ", regex=True)
+    return s.str.replace(r"\s+", " ", regex=True).str.strip()
+
+
+def _tokens(norm: str) -> list:
+    return [t for t in norm.replace("-", " ").split() if t not in LEGAL_SUFFIXES]
+
+
+def _trigrams(core: str) -> set:
+    padded = f"  {core} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _postings(pairs_keys: list, pairs_ids: list) -> dict:
+    if not pairs_keys:
+        return {}
+    grouped = pd.Series(pairs_ids, dtype=np.int64).groupby(pd.Series(pairs_keys), sort=False)
+    return {key: idx.to_numpy() for key, idx in grouped}
+
+
+class NameIndex:
+    """
+    Index de noms clients construit une fois par snapshot de clienti.
+    Blocage par jetons et trigrammes, puis score flou (Dice trigrammes + Jaccard jetons).
+    """
+
+    def __init__(self, df_clienti: pd.DataFrame):
+        cols = [c for c in NAME_COLUMNS if c in df_clienti.columns]
+        if not cols:
+            raise KeyError("Aucune colonne CLI_NOME ou CLI_NOME2 dans clienti.")
+
+        frames = []
+        for col in cols:
+            raw = df_clienti[col]
+            frames.append(pd.DataFrame({
+                "CLI_COD": df_clienti["CLI_COD"].to_numpy(),
+                "name": raw.fillna("").astype(str).to_numpy(),
+                "norm": normalize_names(raw).to_numpy(),
+            }))
+        entries = pd.concat(frames, ignore_index=True)
+        entries = entries[entries["norm"] != ""].reset_index(drop=True)
+
+        self.cli_cod = entries["CLI_COD"].to_numpy()
+        self.names = entries["name"].to_numpy()
+        self.norm = entries["norm"].to_numpy()
+
+        token_lists = [_tokens(n) for n in self.norm]
+        core = [" ".join(toks) for toks in token_lists]
+        gram_sets = [_trigrams(c) for c in core]
+        self.n_tokens = np.array([len(set(t)) for t in token_lists], dtype=np.int32)
+        self.n_grams = np.array([len(g) for g in gram_sets], dtype=np.int32)
+
+        tok_keys, tok_ids, gram_keys, gram_ids = [], [], [], []
+        for i, (toks, grams) in enumerate(zip(token_lists, gram_sets)):
+            for t in set(toks):
+                tok_keys.append(t)
+                tok_ids.append(i)
+            for g in grams:
+                gram_keys.append(g)
+                gram_ids.append(i)
+        self.token_postings = _postings(tok_keys, tok_ids)
+        self.gram_postings = _postings(gram_keys, gram_ids)
+        self.max_df = max(50, int(MAX_DF * len(self.norm)))
+
+    def __len__(self) -> int:
+        return len(self.norm)
+
+    def _count(self, postings: dict, keys, skip_frequent: bool) -> np.ndarray:
+        lists = [postings[k] for k in keys if k in postings]
+        if skip_frequent:
+            rare = [p for p in lists if len(p) <= self.max_df]
+            lists = rare or lists
+        if not lists:
+            return np.zeros(len(self.norm), dtype=np.int32)
+        return np.bincount(np.concatenate(lists), minlength=len(self.norm))
+
+    def search(self, name: str, top_k: int = 5, threshold: float = 0.6) -> list:
+        """Retourne jusqu'à top_k candidats [{CLI_COD, name, score}] triés par score."""
+        norm = normalize_name(name)
+        q_token_list = _tokens(norm)
+        q_tokens = set(q_token_list)
+        q_grams = _trigrams(" ".join(q_token_list))
+        if not q_tokens or not len(self.norm):
+            return []
+
+        shared_grams = self._count(self.gram_postings, q_grams, skip_frequent=True)
+        candidates = np.flatnonzero(shared_grams)
+        if candidates.size == 0:
+            return []
+
+        shared_tokens = self._count(self.token_postings, q_tokens, skip_frequent=False)[candidates]
+        dice = 2 * shared_grams[candidates] / (len(q_grams) + self.n_grams[candidates])
+        jaccard = shared_tokens / (len(q_tokens) + self.n_tokens[candidates] - shared_tokens)
+        score = 0.7 * dice + 0.3 * jaccard
+        score[self.norm[candidates] == norm] = 1.0
+
+        keep = score >= threshold
+        candidates, score = candidates[keep], score[keep]
+        order = np.argsort(-score, kind="stable")
+
+        results, seen = [], set()
+        for pos in order:
+            i = candidates[pos]
+            cod = self.cli_cod[i].item()
+            if cod in seen:
+                continue
+            seen.add(cod)
+            results.append({"CLI_COD": cod, "name": self.names[i], "score": round(float(score[pos]), 3)})
+            if len(results) == top_k:
+                break
+        return results
+
+
+def get_name_index() -> NameIndex:
+    """Index partagé par le process et persisté dans le cache par version de clienti."""
+    version = table_version("clienti")
+    index = _index_cache.get(version)
+    if index is not None:
+        return index
+
+    with _lock:
+        index = _index_cache.get(version)
+        if index is not None:
+            return index
+        path = CACHE_DIR / f"clienti.names.{version[:16]}.pkl"
+        try:
+            with open(path, "rb") as f:
+                index = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            with span("names.index_build"):
+                index = NameIndex(load_table("clienti"))
+            for old in CACHE_DIR.glob("clienti.names.*.pkl"):
+                old.unlink(missing_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "wb") as f:
+                pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp.replace(path)
+        _index_cache.clear()
+        _index_cache[version] = index
+    return index
+
+
+@traced("names.search")
+def search_customers(name: str, top_k: int = 5, threshold: float = 0.6) -> list:
+    return get_name_index().search(name, top_k=top_k, threshold=threshold)
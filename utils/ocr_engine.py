@@ -0,0 +1,83 @@
+import os
+import threading
+
+import numpy as np
+
+# langues du corpus : contrats français, allemands et italiens
+OCR_LANGS = tuple(l.strip() for l in os.environ.get("VEGA_OCR_LANGS", "fr,de,it").split(",") if l.strip())
+
+# threads torch par process ; en lot, à réduire à cœurs / nb de workers
+OCR_THREADS = int(os.environ.get("VEGA_OCR_THREADS", "0")) or (os.cpu_count() or 1)
+
+OCR_BATCH_SIZE = int(os.environ.get("VEGA_OCR_BATCH_SIZE", "4"))
+
+_lock = threading.Lock()
+_engines: dict = {}
+
+
+class OcrEngine:
+    """Lecteur EasyOCR chargé une fois, appelé par lots de pages."""
+
+    def __init__(self, langs=OCR_LANGS, threads: int = None):
+        import easyocr
+        import torch
+
+        torch.set_num_threads(threads or OCR_THREADS)
+        self.langs = tuple(langs)
+        self.reader = easyocr.Reader(list(self.langs), gpu=False)
+        self._infer_lock = threading.Lock()
+
+    def read(self, images: list) -> list:
+        """
+        OCR de plusieurs pages. Retourne, pour chaque image, une liste de
+        (bbox, texte, confiance) comme readtext(detail=1).
+        """
+        results = [None] * len(images)
+        by_shape: dict = {}
+        for i, img in enumerate(images):
+            by_shape.setdefault(img.shape, []).append(i)
+
+        # readtext_batched exige des images de même taille : un lot par format de page
+        with self._infer_lock:
+            for shape, positions in by_shape.items():
+                batch = [images[i] for i in positions]
+                if len(batch) == 1:
+                    out = [self.reader.readtext(batch[0], detail=1)]
+                else:
+                    out = self.reader.readtext_batched(batch, n_width=shape[1], n_height=shape[0],
+                                                       batch_size=OCR_BATCH_SIZE, detail=1)
+                for i, res in zip(positions, out):
+                    results[i] = res
+        return results
+
+
+def set_threads(threads: int) -> None:
+    """Fixe le nombre de threads torch des moteurs créés ensuite dans ce process."""
+    global OCR_THREADS
+    OCR_THREADS = max(1, int(threads))
+
+
+def get_engine(langs=None) -> OcrEngine:
+    """Moteur partagé par le process, créé au premier appel pour ces langues."""
+    langs = tuple(langs or OCR_LANGS)
+    engine = _engines.get(langs)
+    if engine is None:
+        with _lock:
+            engine = _engines.get(langs)
+            if engine is None:
+                engine = OcrEngine(langs)
+                _engines[langs] = engine
+    return engine
+
+
+def warm_up(langs=None, background: bool = True):
+    """Précharge les modèles (ex. au démarrage d'un worker) sans bloquer l'appelant."""
+    def _load():
+        get_engine(langs).read([np.full((64, 64, 3), 255, dtype=np.uint8)])
+
+    if not background:
+        _load()
+        return None
+    thread = threading.Thread(target=_load, daemon=True)
+    thread.start()
+    return thread
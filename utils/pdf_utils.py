@@ -1,13 +1,192 @@
+import hashlib
+import mmap
+import os
+from contextlib import contextmanager
+
 import fitz
-from pathlib import Path
+import numpy as np
+import pandas as pd
 
+from utils.disk_cache import DiskCache
+from utils.ocr_engine import OCR_BATCH_SIZE, OCR_LANGS, get_engine
+from utils.price_tables import COLUMNS as PRICE_COLUMNS, extract_price_table
+from utils.tracing import count, span
 
-def extract_text(uploaded_pdf):
-    pdf_path = Path("temp_uploaded.pdf")
-    with open(pdf_path, "wb") as f:
-        f.write(uploaded_pdf.getbuffer())
-    full_text = ""
-    with fitz.open(pdf_path) as doc:
+# à incrémenter quand le format ou la logique d'extraction change (invalide le cache)
+EXTRACTOR_VERSION = "3"
+
+# en dessous de ce nombre de caractères, une page est considérée comme scannée
+MIN_PAGE_TEXT_CHARS = 20
+
+# résolution de rendu des pages envoyées à l'OCR
+OCR_DPI = int(os.environ.get("VEGA_OCR_DPI", "200"))
+
+# pages retenues au plus en attendant l'OCR d'un lot, pour les rendre dans l'ordre
+PAGE_WINDOW = max(int(os.environ.get("VEGA_PAGE_WINDOW", "16")), OCR_BATCH_SIZE)
+
+_text_cache = DiskCache("text", max_bytes=int(os.environ.get("VEGA_TEXT_CACHE_MB", "1024")) * 1024 * 1024)
+
+
+def needs_ocr(page: fitz.Page, text: str) -> bool:
+    """Page sans couche texte exploitable mais contenant une image (scan)."""
+    return len(text.strip()) < MIN_PAGE_TEXT_CHARS and bool(page.get_images(full=False))
+
+
+def render_page(page: fitz.Page, dpi: int = None) -> np.ndarray:
+    """Rend une page en tableau RGB (h, w, 3) directement depuis le pixmap fitz."""
+    pix = page.get_pixmap(dpi=dpi or OCR_DPI, colorspace=fitz.csRGB, alpha=False)
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+
+
+def _page_words(page: fitz.Page) -> list:
+    """Mots de la couche texte avec leur boîte (points PDF), comme pour l'OCR."""
+    return [
+        {"text": w[4], "conf": 1.0, "bbox": [round(w[0], 2), round(w[1], 2), round(w[2], 2), round(w[3], 2)]}
+        for w in page.get_text("words")
+    ]
+
+
+def _ocr_words(result: list, dpi: int) -> dict:
+    """Convertit un résultat EasyOCR : texte, et par mot la confiance et la boîte en points PDF."""
+    scale = 72 / dpi
+    words = []
+    for bbox, text, conf in result:
+        xs = [float(x) * scale for x, _ in bbox]
+        ys = [float(y) * scale for _, y in bbox]
+        words.append({"text": text, "conf": round(float(conf), 4), "bbox": [min(xs), min(ys), max(xs), max(ys)]})
+    return {"text": "\n".join(w["text"] for w in words) + "\n", "words": words}
+
+
+def _ocr_pages(doc: fitz.Document, entries: list, dpi: int) -> None:
+    """OCR des pages scannées par lots de OCR_BATCH_SIZE pages rendues à la fois."""
+    engine = get_engine()
+    count("ocr.pages", len(entries))
+    with span("ocr", pages=len(entries)):
+        for start in range(0, len(entries), OCR_BATCH_SIZE):
+            window = entries[start:start + OCR_BATCH_SIZE]
+            images = [render_page(doc[e["page"]], dpi) for e in window]
+            for entry, result in zip(window, engine.read(images)):
+                entry.update(_ocr_words(result, dpi), ocr=True)
+            del images
+            # images des scans décodées et gardées par MuPDF (jusqu'à 256 Mo) : vidées à chaque lot
+            fitz.TOOLS.store_shrink(100)
+
+
+def pdf_digest(data) -> str:
+    """sha256 d'un PDF en bytes ou memoryview (sans copie)."""
+    return hashlib.sha256(data).hexdigest()
+
+
+@contextmanager
+def mapped_pdf(path):
+    """
+    PDF projeté en mémoire (mmap) et exposé en memoryview, sans lecture du fichier en entier.
+    Tout document ouvert sur la vue doit être fermé avant la sortie du bloc.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield memoryview(b"")
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                yield view
+            finally:
+                view.release()
+
+
+def iter_pages(data, dpi: int = None, ocr: bool = True):
+    """
+    Générateur des pages d'un PDF (bytes ou memoryview, ouvert sans copie), dans l'ordre.
+    Les pages scannées sont OCRisées par fenêtre : au plus PAGE_WINDOW pages en attente
+    et OCR_BATCH_SIZE images rendues à la fois. Seules les images sont bornées : le texte
+    et les mots des pages déjà rendues restent à la charge de l'appelant.
+    """
+    dpi = dpi or OCR_DPI
+    window = []
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        count("pdf.pages", doc.page_count)
         for page in doc:
-            full_text += page.get_text()
-    return full_text
+            entry = {"page": page.number, "text": page.get_text(), "ocr": False, "words": []}
+            if ocr and needs_ocr(page, entry["text"]):
+                entry["ocr"] = None
+            else:
+                entry["words"] = _page_words(page)
+            window.append(entry)
+            # les pages suivant une page scannée attendent son OCR pour sortir dans l'ordre
+            pending = [e for e in window if e["ocr"] is None]
+            if not pending or len(pending) >= OCR_BATCH_SIZE or len(window) >= PAGE_WINDOW:
+                if pending:
+                    _ocr_pages(doc, pending, dpi)
+                yield from window
+                window = []
+        pending = [e for e in window if e["ocr"] is None]
+        if pending:
+            _ocr_pages(doc, pending, dpi)
+        yield from window
+
+
+def extract_pages(data, dpi: int = None, ocr: bool = True, use_cache: bool = True) -> list:
+    """
+    Extraction page par page : couche texte quand elle existe,
+    OCR uniquement des pages scannées. Retourne [{page, text, ocr, words}].
+    `data` : bytes ou memoryview (UploadedFile.getbuffer(), mapped_pdf) lus sans copie.
+    Le résultat est mis en cache par sha256 du PDF, version d'extracteur et langues OCR.
+    Toutes les pages (texte et mots) sont gardées en liste : la mémoire croît avec le
+    nombre de pages. Pour le texte et la grille de prix seuls, extract_document() les
+    consomme au fil de l'eau.
+    """
+    dpi = dpi or OCR_DPI
+    key = DiskCache.make_key(pdf_digest(data), EXTRACTOR_VERSION, ",".join(OCR_LANGS), dpi, ocr)
+    if use_cache:
+        cached = _text_cache.get(key)
+        if cached is not None:
+            count("text_cache.hits")
+            return cached
+        count("text_cache.misses")
+
+    with span("pdf.extract", size_kb=len(data) // 1024):
+        pages = list(iter_pages(data, dpi=dpi, ocr=ocr))
+
+    if use_cache:
+        _text_cache.set(key, pages)
+    return pages
+
+
+def extract_document(data, dpi: int = None, ocr: bool = True, use_cache: bool = True) -> tuple:
+    """
+    (texte, grille de prix) d'un PDF en consommant iter_pages page par page : les mots
+    d'une page sont libérés dès ses lignes de prix extraites, seuls le texte et la grille
+    s'accumulent. Mis en cache comme extract_pages, sous une clé distincte.
+    """
+    dpi = dpi or OCR_DPI
+    key = DiskCache.make_key(pdf_digest(data), EXTRACTOR_VERSION, ",".join(OCR_LANGS), dpi, ocr, "document")
+    if use_cache:
+        cached = _text_cache.get(key)
+        if cached is not None:
+            count("text_cache.hits")
+            return cached["text"], pd.DataFrame(cached["prices"], columns=PRICE_COLUMNS)
+        count("text_cache.misses")
+
+    texts = []
+
+    def pages():
+        for page in iter_pages(data, dpi=dpi, ocr=ocr):
+            texts.append(page["text"])
+            yield page
+
+    with span("pdf.extract", size_kb=len(data) // 1024):
+        prices = extract_price_table(pages())
+    text = "".join(texts)
+
+    if use_cache:
+        _text_cache.set(key, {"text": text, "prices": prices.to_dict(orient="records")})
+    return text, prices
+
+
+def extract_text_from_bytes(data, dpi: int = None) -> str:
+    return "".join(p["text"] for p in extract_pages(data, dpi=dpi))
+
+
+def extract_text(uploaded_pdf):
+    return extract_text_from_bytes(uploaded_pdf.getbuffer())
@@ -0,0 +1,326 @@
+"""
+Grilles de prix reconstruites depuis la mise en page du PDF.
+
+Entrée : les mots positionnés d'une page (pdf_utils.extract_pages, clé "words" :
+mots fitz pour les pages texte, boîtes EasyOCR pour les scans). Les mots sont
+regroupés en lignes, les en-têtes de tableau (Produits / Prix / Emplacement...)
+donnent les colonnes, chaque montant devient une ligne typée :
+
+    page, product, price, currency, payment_mode, location, vat, label, kind, in_table
+
+Les montants hors tableau (« CHF 0.10 für schwarze Kaffees ») sont rattachés au
+texte de leur ligne.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+from utils.name_index import normalize_names
+from utils.tracing import traced
+
+CURRENCY_RE = r"(?:de|à|a|ä)?(?P<cur>CHF|S?Fr\.?|EUR|€)"
+# 0.80, 1,40, 6'850.00, 4‘967.00, 100.-, 11'260.-
+AMOUNT_RE = r"\d{1,3}(?:['’‘]\d{3})+(?:[.,]\d{1,3})?(?:\.?-)?|\d{1,6}(?:[.,]\d{1,3})?(?:\.?-)?"
+FREE_RE = r"gratuit[es]?|gratis|kostenlos|gratuit[oi]|offert[eo]?"
+
+# rôle des cellules d'en-tête (fr/de/it)
+HEADER_ROLES = {
+    "product": r"produits?|produkte?|prodott[oi]|articles?|artikel|articol[oi]|boissons\s*:?$",
+    "price": r"prix|preise?|prezz[oi]|tarifs?|tariff[ae]|abgabepreise?|verkaufspreise?|subvention",
+    "location": r"emplacement|d?e?t?a?i?l?standort|ubicazione|[ée]tage|stockwerk|piano",
+    "payment": r"paiement|zahlung\w*|pagamento",
+}
+
+PAYMENT_PATTERNS = {
+    "cash": r"\b(?:cash|esp[eè]ces|monnaie|pi[eè]ces|m[üu]nz\w*|bargeld|contant[ei]|monet[ae])\b",
+    "badge": r"\b(?:badges?|jetons?|chip|schl[üu]ssel|gettoni?)\b",
+    "card": r"\b(?:cartes?|karten?|cart[ae]|cards?|nayax|twint|cashless|bargeldlos)\b",
+}
+VAT_PATTERNS = {
+    "incl": r"\b(?:inkl|incl|compris|inclus[ae]?|ttc)\b",
+    "excl": r"\b(?:exkl|excl|hors\s+taxes?|ht|esclus[ae]|zzgl)\b|\+\s*iva\b",
+}
+FLOOR_RE = r"\b(?:\d+\s*(?:er|e|ème)?\s*[ée]tage|rez[- ]de[- ]chauss[ée]e|\d+\.?\s*(?:og|ug|stock)|eg|og|ug|piano\s+\w+)\b"
+KIND_PATTERNS = {
+    "insurance": r"assurance|versicherung|\bassic",
+    "fee": r"pro\s+monat|par\s+mois|al\s+mese|mensuel|monatlich|mensile|pauschal|forfait|/\s*ann[ée]e|pro\s+jahr|canone",
+}
+_LEADING_WORDS = r"^(?:f[üu]r|pour|per|de|du|des|à|a|ä|le|la|les|il|lo|die|der|das)\s+"
+
+HEADER_BAND = 14      # pt : lignes d'en-tête autour de la ligne de mots-clés
+CELL_GAP = 6          # pt : écart horizontal séparant deux cellules d'en-tête
+MAX_ROW_GAP = 120     # pt : au-delà, la ligne suivante ne fait plus partie du tableau
+LAST_ROW_SPAN = 40    # pt : hauteur maximale de la dernière ligne d'un tableau
+
+COLUMNS = ["page", "product", "price", "currency", "payment_mode", "location", "vat", "label", "kind", "in_table", "y"]
+
+
+def _words_frame(words: list) -> pd.DataFrame:
+    """Mots -> DataFrame (text, x0, y0, x1, y1). Les boîtes OCR multi-mots sont découpées au prorata des caractères."""
+    if not words:
+        return pd.DataFrame(columns=["text", "x0", "y0", "x1", "y1"])
+    df = pd.DataFrame({"text": [w["text"] for w in words]})
+    df[["x0", "y0", "x1", "y1"]] = np.array([w["bbox"] for w in words], dtype=float)
+    df["total"] = df["text"].str.len().clip(lower=1)
+    df["token"] = df["text"].str.split()
+    df = df.explode("token").dropna(subset=["token"])
+    # position du mot dans la boîte d'origine : somme des longueurs des mots précédents
+    length = df["token"].str.len() + 1
+    start = length.groupby(level=0).cumsum() - length
+    width = (df["x1"] - df["x0"]) / df["total"]
+    df["x0"], df["x1"] = df["x0"] + start * width, df["x0"] + (start + length - 1) * width
+    return df.assign(text=df["token"])[["text", "x0", "y0", "x1", "y1"]].reset_index(drop=True)
+
+
+def _assign_lines(df: pd.DataFrame) -> pd.DataFrame:
+    """Regroupe les mots en lignes : nouveau numéro quand le centre vertical saute de plus d'une demi-hauteur."""
+    df = df.assign(yc=(df["y0"] + df["y1"]) / 2).sort_values(["yc", "x0"], kind="stable")
+    tol = max(1.0, 0.5 * float((df["y1"] - df["y0"]).median()))
+    df["line"] = (df["yc"].diff().fillna(0) > tol).cumsum()
+    df["ly"] = df.groupby("line")["yc"].transform("mean")
+    return df.sort_values(["line", "x0"], kind="stable").reset_index(drop=True)
+
+
+def _parse_amount(text: pd.Series) -> pd.Series:
+    cleaned = text.str.replace(r"\.?-$", "", regex=True).str.replace(r"['’‘]", "", regex=True).str.replace(",", ".")
+    return pd.to_numeric(cleaned, errors="coerce")
+
+
+def _anchors(df: pd.DataFrame) -> pd.DataFrame:
+    """Montants de la page : devise + montant (ou montant + devise), montants coupés par l'OCR, mentions « gratuit »."""
+    tok = df["text"].str.strip(",;:()")
+    line = df["line"]
+    same_next = line.shift(-1) == line
+    same_next2 = line.shift(-2) == line
+    cur = tok.str.extract(f"^{CURRENCY_RE}$", flags=re.IGNORECASE)["cur"]
+    is_cur = cur.notna()
+    is_amt = tok.str.fullmatch(AMOUNT_RE)
+
+    before = is_cur & is_amt.shift(-1, fill_value=False) & same_next
+    # "CHF 0 80" : décimales détachées par l'OCR
+    split = (
+        before & same_next2
+        & tok.shift(-1, fill_value="").str.fullmatch(r"\d{1,3}")
+        & tok.shift(-2, fill_value="").str.fullmatch(r"\d{2}")
+        & (df["x0"].shift(-2) - df["x1"].shift(-1) < CELL_GAP)
+    )
+    consumed = before.shift(1, fill_value=False) | split.shift(2, fill_value=False)
+    after = is_amt & is_cur.shift(-1, fill_value=False) & same_next & ~consumed & ~is_cur.shift(1, fill_value=False)
+    free = tok.str.fullmatch(FREE_RE, case=False)
+
+    amount_pos = np.where(before, df.index + 1, df.index)
+    amount = _parse_amount(tok.reindex(amount_pos).reset_index(drop=True))
+    amount = amount.where(~split, amount + pd.to_numeric(tok.shift(-2), errors="coerce") / 100)
+    end_pos = np.where(split, df.index + 2, np.where(before | after, df.index + 1, df.index))
+
+    keep = before | after | free
+    anchors = pd.DataFrame({
+        "start": df.index, "end": end_pos,
+        "price": amount.where(~free, 0.0),
+        "currency": cur.where(before, cur.shift(-1)).str.upper().str.replace(r"^S?FR\.?$", "CHF", regex=True)
+                     .replace("€", "EUR"),
+        "line": line, "ly": df["ly"], "x0": df["x0"],
+    })[keep.to_numpy()]
+    anchors["x1"] = df["x1"].to_numpy()[anchors["end"].to_numpy()]
+    anchors["currency"] = anchors["currency"].fillna("CHF")
+    return anchors.dropna(subset=["price"]).reset_index(drop=True)
+
+
+def _header_bands(df: pd.DataFrame, anchors: pd.DataFrame) -> list:
+    """En-têtes de tableau : lignes avec au moins deux cellules à rôle, plus les lignes voisines sans montant."""
+    role_of_word = pd.Series(None, index=df.index, dtype=object)
+    for role, pattern in HEADER_ROLES.items():
+        role_of_word = role_of_word.fillna(
+            df["text"].str.strip(",;:()").str.fullmatch(pattern, case=False).map({True: role, False: None})
+        )
+    priced_lines = set(anchors["line"])
+    roles_per_line = role_of_word.groupby(df["line"]).nunique()
+    header_lines = [l for l, n in roles_per_line.items() if n >= 2 and l not in priced_lines]
+    if not header_lines:
+        return []
+
+    line_y = df.groupby("line")["ly"].first()
+    header_y = line_y[header_lines].to_numpy()
+    near = np.abs(line_y.to_numpy()[:, None] - header_y[None, :]).min(axis=1) <= HEADER_BAND
+    band_lines = line_y[near & ~line_y.index.isin(priced_lines)]
+    band_id = (band_lines.diff().fillna(0) > HEADER_BAND).cumsum()
+
+    bands = []
+    for _, lines in band_lines.groupby(band_id):
+        words = df[df["line"].isin(lines.index)].sort_values("x0")
+        # cellules : mots qui se chevauchent horizontalement (en-têtes sur plusieurs lignes)
+        reach = words["x1"].cummax().shift(fill_value=-np.inf)
+        cell = (words["x0"] > reach + CELL_GAP).cumsum()
+        cells = words.sort_values(["ly", "x0"]).groupby(cell.reindex(words.sort_values(["ly", "x0"]).index)).agg(
+            x0=("x0", "min"), x1=("x1", "max"), label=("text", " ".join)
+        ).sort_values("x0").reset_index(drop=True)
+        cells["role"] = None
+        for role, pattern in HEADER_ROLES.items():
+            hit = cells["label"].str.contains(rf"(?:^|\s)(?:{pattern})(?:$|[\s,:(])", case=False, regex=True)
+            cells["role"] = cells["role"].where(cells["role"].notna() | ~hit, role)
+        bands.append({"top": float(words["y0"].min()), "bottom": float(words["y1"].max()), "cells": cells})
+    return bands
+
+
+def _clean_text(words: pd.Series) -> str:
+    # puces et symboles isolés (ex. U+F0B7 des listes Word) ignorés
+    text = " ".join(w for w in words if re.search(r"\w", w)).strip(" ,;:/-–+")
+    return re.sub(_LEADING_WORDS, "", text, flags=re.IGNORECASE).strip() or None
+
+
+def _classify(rows: pd.DataFrame, row_text: pd.Series) -> pd.DataFrame:
+    text = row_text.fillna("")
+    rows["payment_mode"] = None
+    for mode, pattern in PAYMENT_PATTERNS.items():
+        rows["payment_mode"] = rows["payment_mode"].where(
+            rows["payment_mode"].notna() | ~text.str.contains(pattern, case=False, regex=True), mode)
+    rows["vat"] = None
+    for vat, pattern in VAT_PATTERNS.items():
+        rows["vat"] = rows["vat"].where(rows["vat"].notna() | ~text.str.contains(pattern, case=False, regex=True), vat)
+    rows["kind"] = "product"
+    for kind, pattern in KIND_PATTERNS.items():
+        rows["kind"] = rows["kind"].where(~text.str.contains(pattern, case=False, regex=True), kind)
+    floor = text.str.extract(f"({FLOOR_RE})", flags=re.IGNORECASE)[0]
+    rows["location"] = rows["location"].where(rows["location"].notna(), floor)
+    return rows
+
+
+def _table_rows(df: pd.DataFrame, anchors: pd.DataFrame, band: dict) -> pd.DataFrame:
+    """Lignes d'un tableau : bande verticale par ligne de montants, colonnes d'après l'en-tête."""
+    cells = band["cells"]
+    starts = cells["x0"].to_numpy() - 4
+    line_y = np.sort(anchors["ly"].unique())
+    tops = np.concatenate([[band["bottom"]], (line_y[:-1] + line_y[1:]) / 2])
+    last = line_y[-1] + min(LAST_ROW_SPAN, line_y[-1] - tops[-1])
+    bottoms = np.concatenate([(line_y[:-1] + line_y[1:]) / 2, [last]])
+
+    in_rows = df[(df["yc"] >= tops[0]) & (df["yc"] < bottoms[-1])]
+    word_row = np.searchsorted(bottoms, in_rows["yc"].to_numpy(), side="right")
+    word_col = np.searchsorted(starts, ((in_rows["x0"] + in_rows["x1"]) / 2).to_numpy(), side="right") - 1
+    anchor_words = np.concatenate([np.arange(s, e + 1) for s, e in zip(anchors["start"], anchors["end"])])
+    cols_frame = pd.DataFrame({"text": in_rows["text"].to_numpy(), "row": word_row, "col": word_col},
+                              index=in_rows.index)
+    cols_frame = cols_frame[~cols_frame.index.isin(anchor_words) & (cols_frame["col"] >= 0)]
+    cell_text = cols_frame.groupby(["row", "col"])["text"].agg(_clean_text)
+    row_text = cols_frame.groupby("row")["text"].agg(" ".join)
+
+    rows = anchors.copy()
+    rows["row"] = np.searchsorted(line_y, rows["ly"].to_numpy())
+    rows["col"] = np.searchsorted(starts, ((rows["x0"] + rows["x1"]) / 2).to_numpy(), side="right") - 1
+    roles = cells["role"].tolist()
+    product_col = roles.index("product") if "product" in roles else None
+    location_col = roles.index("location") if "location" in roles else None
+    payment_col = roles.index("payment") if "payment" in roles else None
+
+    def cell(row, col):
+        return cell_text.get((row, col)) if col is not None and col >= 0 else None
+
+    rows["product"] = [cell(r, product_col if product_col is not None else c - 1) for r, c in zip(rows["row"], rows["col"])]
+    rows["location"] = [cell(r, location_col) for r in rows["row"]]
+    rows["label"] = [cells["label"].iloc[c] if c >= 0 else None for c in rows["col"]]
+    payment_text = pd.Series([cell(r, payment_col) for r in rows["row"]], index=rows.index)
+    full_text = rows["row"].map(row_text).fillna("") + " " + payment_text.fillna("")
+    rows["in_table"] = True
+    return _classify(rows, full_text)
+
+
+def _line_rows(df: pd.DataFrame, anchors: pd.DataFrame) -> pd.DataFrame:
+    """Montants hors tableau : produit = texte de la ligne à gauche du montant, sinon à droite."""
+    rows = anchors.sort_values(["line", "x0"]).copy()
+    # texte borné par les montants voisins de la même ligne
+    rows["prev_x1"] = rows.groupby("line")["x1"].shift().fillna(-np.inf)
+    rows["next_x0"] = rows.groupby("line")["x0"].shift(-1).fillna(np.inf)
+    anchor_words = np.concatenate([np.arange(s, e + 1) for s, e in zip(anchors["start"], anchors["end"])])
+    plain = df[~df.index.isin(anchor_words)]
+    products, texts = [], []
+    for a in rows.itertuples():
+        words = plain[plain["line"] == a.line]
+        left = words[(words["x1"] <= a.x0) & (words["x0"] >= a.prev_x1)]["text"]
+        right = words[(words["x0"] >= a.x1) & (words["x1"] <= a.next_x0)]["text"]
+        products.append(_clean_text(left) or _clean_text(right))
+        texts.append(" ".join(words["text"]))
+    rows["product"], rows["location"], rows["label"], rows["in_table"] = products, None, None, False
+    return _classify(rows, pd.Series(texts, index=rows.index))
+
+
+def extract_price_rows(words: list, page: int = 0) -> pd.DataFrame:
+    """Lignes de prix typées d'une page à partir de ses mots positionnés."""
+    df = _words_frame(words)
+    if df.empty:
+        return pd.DataFrame(columns=COLUMNS)
+    df = _assign_lines(df)
+    anchors = _anchors(df)
+    if anchors.empty:
+        return pd.DataFrame(columns=COLUMNS)
+
+    bands = _header_bands(df, anchors)
+    # chaque montant appartient au dernier en-tête au-dessus de lui, tant que les lignes restent proches
+    bottoms = np.array([b["bottom"] for b in bands])
+    anchors["table"] = np.searchsorted(bottoms, anchors["ly"].to_numpy()) - 1 if bands else -1
+    line_y = anchors.groupby("line")["ly"].first()
+    line_table = anchors.groupby("line")["table"].first()
+    gap = line_y.diff().fillna(0)
+    prev_y = pd.Series([bands[t]["bottom"] if t >= 0 else np.nan for t in line_table], index=line_table.index)
+    first = line_table != line_table.shift()
+    gap = gap.where(~first, line_y - prev_y)
+    # fin du tableau : écart trop grand, absolu ou relatif à l'écart précédent
+    prev_gap = gap.groupby(line_table).shift()
+    broken = ((gap > MAX_ROW_GAP) | (gap > 3 * prev_gap) | gap.isna()).groupby(line_table).cummax()
+    anchors.loc[anchors["line"].map(broken).to_numpy(), "table"] = -1
+
+    parts = [_table_rows(df, group, bands[t]) for t, group in anchors[anchors["table"] >= 0].groupby("table")]
+    free = anchors[anchors["table"] < 0]
+    if not free.empty:
+        parts.append(_line_rows(df, free))
+    rows = pd.concat(parts, ignore_index=True).sort_values(["ly", "x0"], kind="stable")
+    return rows.assign(page=page, y=rows["ly"].round(1))[COLUMNS].reset_index(drop=True)
+
+
+@traced("prices.extract")
+def extract_price_table(pages: list) -> pd.DataFrame:
+    """Grille de prix d'un document entier : pages de pdf_utils.extract_pages, ou itérateur iter_pages."""
+    parts = [extract_price_rows(p.get("words") or [], page=p["page"]) for p in pages]
+    parts = [p for p in parts if not p.empty]
+    if not parts:
+        return pd.DataFrame(columns=COLUMNS)
+    return pd.concat(parts, ignore_index=True)
+
+
+def _format_price(price: pd.Series) -> pd.Series:
+    return price.map(lambda p: f"{p:.2f}" if round(p, 2) == p else f"{p:g}")
+
+
+@traced("prices.findings")
+def price_findings(grids: list) -> pd.DataFrame:
+    """
+    Constats sur les grilles de prix (format utils.diff_engine), un par produit, pour une
+    liste de (contract_id, grille). Vega ne porte pas de prix par produit : rien n'est
+    tranché localement, chaque produit reste "unresolved" pour le LLM avec ses prix
+    dédoublonnés (plusieurs prix : emplacement, mode de paiement, colonne).
+    Un contrat sans grille lisible donne une seule ligne vide.
+    """
+    columns = ["contract_id", "control", "check", "status", "contract_value", "vega_value"]
+    parts = [prices.assign(contract_id=contract_id) for contract_id, prices in grids if not prices.empty]
+    products = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=COLUMNS + ["contract_id"])
+    products = products[(products["kind"] == "product") & products["product"].notna()]
+    key = normalize_names(products["product"].astype(str))
+    # libellés sans mot (« de: », « a: ») : débris de mise en page, pas des produits
+    products = products.assign(key=key)[key.str.count(r"[^\W\d_]") >= 3]
+
+    unique = products.drop_duplicates(["contract_id", "key", "price"]).sort_values("price", kind="stable")
+    unique = unique.assign(text=_format_price(unique["price"].astype(float)))
+    grouped = unique.groupby(["contract_id", "key"], sort=False).agg(
+        product=("product", "first"), prices=("text", " / ".join), currency=("currency", "first"),
+    )
+    order = products.drop_duplicates(["contract_id", "key"]).set_index(["contract_id", "key"]).index
+    grouped = grouped.reindex(order).reset_index()
+    found = pd.DataFrame({
+        "contract_id": grouped["contract_id"], "control": "prices", "check": "price_grid", "status": "unresolved",
+        "contract_value": grouped["product"] + ": " + grouped["prices"] + " " + grouped["currency"].fillna(""),
+        "vega_value": "",
+    })
+
+    empty = [contract_id for contract_id, _ in grids if contract_id not in set(found["contract_id"])]
+    missing = pd.DataFrame([[c, "prices", "price_grid", "unresolved", "", ""] for c in empty], columns=columns)
+    return pd.concat([found, missing], ignore_index=True)[columns]
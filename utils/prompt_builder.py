@@ -0,0 +1,176 @@
+"""
+Construction de prompts sous budget de tokens.
+
+Le contrat est découpé en sections, indexées en BM25 ; pour chaque point de contrôle
+on ne garde que les sections les plus pertinentes (prix, durée, adresses, machines).
+Les données Vega sont sérialisées de façon compacte (sans champs vides).
+"""
+import json
+import math
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+from utils.name_index import normalize_name
+
+PROMPT_TOKEN_BUDGET = int(os.environ.get("VEGA_PROMPT_TOKEN_BUDGET", "12000"))
+# part du budget réservée aux données Vega, le reste va au texte du contrat
+DB_BUDGET_SHARE = 0.35
+
+CHUNK_CHARS = 800
+
+# requêtes multilingues (fr/de/it) par point de contrôle
+CHECK_QUERIES = {
+    "prices": "prix tarif chf cash badge carte monnaie gratuit payant preis tarif bargeld karte "
+              "kostenlos prezzo prezzi contanti carta gratuito etage stock piano boisson getränk bevanda",
+    "conditions": "durée mois renouvellement tacitement résiliation préavis début fin échéance "
+                  "dauer monate verlängert kündigung vertragsbeginn vertragsende "
+                  "durata mesi rinnovo disdetta scadenza inizio operating",
+    "client": "client adresse facturation siège kunde adresse rechnung sitz cliente indirizzo fatturazione sede",
+    "inventory": "distributeur automate machine modèle emplacement automat gerät modell standort "
+                 "distributore macchina modello ubicazione",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    # approximation sans tiktoken : ~4 caractères par token
+    return len(text) // 4 + 1
+
+
+def _terms(text: str) -> list:
+    return _TOKEN_RE.findall(normalize_name(text))
+
+
+def chunk_text(text: str, max_chars: int = CHUNK_CHARS) -> list:
+    """Découpe sur les paragraphes, regroupés jusqu'à max_chars caractères."""
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n|(?<=\.)\n", text) if p.strip()]
+    chunks, current = [], ""
+    for para in paragraphs:
+        while len(para) > max_chars:
+            cut = para.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(para[:cut])
+            para = para[cut:].strip()
+        if current and len(current) + len(para) + 1 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{para}" if current else para
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class BM25:
+    def __init__(self, docs: list, k1: float = 1.5, b: float = 0.75):
+        self.k1, self.b = k1, b
+        self.tfs = [Counter(_terms(d)) for d in docs]
+        self.lengths = np.array([sum(tf.values()) for tf in self.tfs], dtype=float)
+        self.avg_len = self.lengths.mean() if len(docs) else 0.0
+        df = Counter(term for tf in self.tfs for term in tf)
+        n = len(docs)
+        self.idf = {t: math.log(1 + (n - f + 0.5) / (f + 0.5)) for t, f in df.items()}
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.tfs))
+        norm = self.k1 * (1 - self.b + self.b * self.lengths / (self.avg_len or 1))
+        for term in set(_terms(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            tf = np.array([d.get(term, 0) for d in self.tfs], dtype=float)
+            scores += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+
+def _entity_terms(report_data: dict) -> dict:
+    """Termes propres au client ajoutés aux requêtes : noms, rues, modèles."""
+    def values(key, cols):
+        return " ".join(str(r.get(c) or "") for r in report_data.get(key, []) for c in cols)
+
+    info = report_data.get("client_info") or {}
+    return {
+        "client": " ".join(str(v or "") for v in info.values())
+                  + " " + values("clienti_match", ["CLI_NOME", "CLI_IND", "CLI_CIT"])
+                  + " " + values("accounts_match", ["CTB_DESC", "CTB_IND", "CTB_CIT"]),
+        "inventory": values("modelli_match", ["MOD_DESC"]) + " " + values("unopv_match", ["UPV_DES1", "UPV_DES2"]),
+    }
+
+
+def select_sections(contract_text: str, report_data: dict, budget_tokens: int, checks=None) -> str:
+    """Sections du contrat les plus pertinentes par contrôle (tous par défaut), dans l'ordre du document."""
+    if count_tokens(contract_text) <= budget_tokens:
+        return contract_text
+    chunks = chunk_text(contract_text)
+
+    bm25 = BM25(chunks)
+    extra = _entity_terms(report_data)
+    rankings = [
+        list(np.argsort(-bm25.scores(f"{query} {extra.get(check, '')}"), kind="stable"))
+        for check, query in CHECK_QUERIES.items()
+        if checks is None or check in checks
+    ]
+
+    # l'en-tête (parties au contrat) est toujours conservé, puis tour à tour par contrôle
+    selected, used = {0}, count_tokens(chunks[0])
+    for rank in range(len(chunks)):
+        for ranking in rankings:
+            i = ranking[rank]
+            if i in selected:
+                continue
+            cost = count_tokens(chunks[i])
+            if used + cost > budget_tokens:
+                continue
+            selected.add(i)
+            used += cost
+    return "\n[...]\n".join(chunks[i] for i in sorted(selected))
+
+
+def _compact_rows(rows: list) -> list:
+    return [{k: v for k, v in row.items() if v is not None and v == v and v != ""} for row in rows]
+
+
+def compact_report_data(report_data: dict, budget_tokens: int, default=None) -> str:
+    """JSON compact des données Vega ; les listes les plus longues sont tronquées au besoin."""
+    data = {
+        key: _compact_rows(value) if isinstance(value, list) else value
+        for key, value in report_data.items()
+    }
+
+    def dump(d):
+        return json.dumps(d, ensure_ascii=False, separators=(",", ":"), default=default)
+
+    text = dump(data)
+    while count_tokens(text) > budget_tokens:
+        key = max((k for k, v in data.items() if isinstance(v, list)), key=lambda k: len(data[k]), default=None)
+        if key is None or len(data[key]) <= 1:
+            break
+        kept = max(1, len(data[key]) * 2 // 3)
+        omitted = len(report_data[key]) - kept
+        data[key] = data[key][:kept]
+        data[f"{key}_omitted_rows"] = omitted
+        text = dump(data)
+    return text
+
+
+def build_context(report_data: dict, contract_text: str, budget_tokens: int = None, default=None,
+                  checks=None) -> tuple:
+    """Retourne (sections du contrat, JSON Vega) tenant ensemble dans le budget."""
+    budget_tokens = budget_tokens or PROMPT_TOKEN_BUDGET
+    db_json = compact_report_data(report_data, int(budget_tokens * DB_BUDGET_SHARE), default=default)
+    contract_budget = max(budget_tokens - count_tokens(db_json), budget_tokens // 4)
+    return select_sections(contract_text, report_data, contract_budget, checks=checks), db_json
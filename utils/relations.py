@@ -0,0 +1,210 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from utils.table_store import TABLES, load_table, table_version
+from utils.tracing import span, traced
+
+_EMPTY = np.array([], dtype=np.intp)
+
+_lock = threading.Lock()
+_index_cache: dict = {}
+
+COLUMNS_CLIENTI = [
+    "CLI_COD",           # code client
+    "CLI_NOME",          # nom client
+    "CLI_NOME2",         # nom complet
+    "CLI_IND",           # adresse
+    "CLI_CAP",           # code postal
+    "CLI_CIT",           # ville
+    "CLI_PROV",          # province
+    "CLI_TEL",           # téléphone
+    "CLI_EMAIL",         # email
+    "CLI_VEND",          # vendeur principal
+    "CLI_VEN2",          # deuxième vendeur
+    "CLI_STAT",          # pays
+    "CLI_DCON",          # date de création
+    "CLI_DRIT",          # date dernière modification
+    "CLI_DING",          # date d’activation
+    "CLI_STATOCONTRATTO",# état du contrat
+    "CLI_MODALITA_SPEDIZIONE", # mode livraison
+    "CLI_LATITWGSDEC",   # latitude
+    "CLI_LONGITWGSDEC"   # longitude
+]
+
+COLUMNS_ACCOUNTS = [
+    "CTB_COD",
+    "CTB_RAG2",
+    "CTB_CF",
+    "CTB_PIVA",
+    "CTB_IND",
+    "CTB_CAP",
+    "CTB_CIT",
+    "CTB_PROV",
+    "CTB_STAT",
+    "CTB_TEL",
+    "CTB_EMAIL",
+    "CTB_DESC",
+    "CTB_DVAR"
+]
+
+COLUMNS_CONTRACTS = [
+    "CNTR_CLIENTE",
+    "CNTR_NUMEROCONTRATTO",
+    "CNTR_PV",
+    "CNTR_TIPO",
+    "CNTR_DATASTIPULACONTRATTO",
+    "CNTR_DCON",
+    "CNTR_DURATACTR",
+    "CNTR_DURATATACITORINNOVO",
+    "CNTR_PERIODOPERDISDETTA",
+    "CNTR_STATOCONTRATTO",
+    "CNTR_WORK_CURRENCY",
+    "CNTR_MAIN_CURRENCY",
+    "CNTR_SEDELEGALE",
+    "CNTR_RIFCOMMAZIENDA",
+    "CNTR_IMPORTO_TOTALE_OMAGGI",
+    "CNTR_IMPORTO_TOTALE_OMAGGI_RIC"
+]
+
+COLUMNS_UNOPV = [
+    "UPV_COD",                  # Code point de vente
+    "UPV_DES1",                 # Description principale
+    "UPV_DES2",                 # Description secondaire
+    "UPV_CLI",                  # Code client associé
+    "UPV_PROV",                 # Province
+    "UPV_TEL",                  # Téléphone
+    "UPV_EMAIL",                # Email
+    "UPV_VEND",                 # Vendeur
+    "UPV_DVAR",                 # Date dernière variation
+    "UPV_MOD",                  # Modèle
+    "UPV_NOTE",                 # Notes
+    "UPV_STATOCONTRATTO",       # Statut du contrat
+    "UPV_DATASTIPULACONTRATTO", # Date de début du contrat
+    "UPV_DCON",                 # Date de fin du contrat
+    "UPV_DURATACTR"             # Durée du contrat
+]
+
+COLUMNS_MODELLI = [
+    "MOD_COD",                   # Code modèle
+    "MOD_DESC",                  # Description modèle
+    "MOD_PRODOTTO",              # Référence produit
+    "MOD_ID_PRODUTTORE",         # Fabricant
+    "MOD_TMEDRIP",               # Temps moyen d’aspiration
+    "MOD_SOGPERCMIN",            # Seuil minimum
+    "MOD_SOGPERCMAX",            # Seuil maximum
+    "MOD_PERCCARICOIDEALE",      # Pourcentage de charge idéal
+    "MOD_COSTOSTDDANUOVO",       # Coût standard neuf
+    "MOD_COSTOUNITARDVISITA",    # Coût unitaire visite
+    "MOD_QGIOACCESSORI",         # Quantité accessoires
+    "MOD_DEFOFM_FUNZIONAMENTO",  # Mode de fonctionnement par défaut
+    "MOD_DEFOFM_FAT",            # Type FAT
+    "MOD_DEFOFM_INCT",           # Canal d’installation
+    "MOD_WORK_CURRENCY",         # Devise
+    "MOD_MAIN_CURRENCY"          # Devise principale
+]
+
+
+def _key(value):
+    """Normalise une clé (int numpy, float 27106.0, texte '27106') en int si possible."""
+    try:
+        as_float = float(value)
+    except (TypeError, ValueError):
+        return value
+    if as_float != as_float:
+        return None
+    return int(as_float) if as_float.is_integer() else as_float
+
+
+def _build_index(series: pd.Series) -> dict:
+    """Index de hachage clé -> positions (iloc) des lignes correspondantes."""
+    numeric = pd.to_numeric(series, errors="coerce")
+    keys = numeric.where(numeric.notna(), series)
+    return {_key(k): positions for k, positions in keys.groupby(keys, sort=False).indices.items()}
+
+
+class RelationIndex:
+    """
+    Index précalculés sur le graphe CLIENT -> CTBCONT -> CONTRATTI -> UNOPV -> MODELLI.
+    Construit une fois par snapshot de tables ; chaque résolution coûte O(correspondances).
+    """
+
+    def __init__(self, tables: dict):
+        self.clienti = tables["clienti"]
+        self.ctbcont = tables["ctbcont"]
+        self.contratti = tables["contratti"]
+        self.unopv = tables["unopv"]
+        self.modelli = tables["modelli"]
+
+        self.by_cli_cod = _build_index(self.clienti["CLI_COD"])
+        self.by_ctb_cod = _build_index(self.ctbcont["CTB_COD"])
+        self.by_sedelegale = _build_index(self.contratti["CNTR_SEDELEGALE"])
+        self.by_upv_cli = _build_index(self.unopv["UPV_CLI"])
+        self.by_mod_cod = _build_index(self.modelli["MOD_COD"])
+
+    @staticmethod
+    def _lookup(index: dict, keys) -> np.ndarray:
+        parts = [index[k] for k in map(_key, keys) if k in index]
+        if not parts:
+            return _EMPTY
+        return np.unique(np.concatenate(parts))
+
+    def resolve_customer(self, cli_cod) -> dict:
+        """Retourne toutes les lignes liées à un client, table par table."""
+        clienti = self.clienti.iloc[self._lookup(self.by_cli_cod, [cli_cod])]
+        accounts = self.ctbcont.iloc[self._lookup(self.by_ctb_cod, [cli_cod])]
+        contracts = self.contratti.iloc[self._lookup(self.by_sedelegale, accounts["CTB_COD"])]
+        unopv = self.unopv.iloc[self._lookup(self.by_upv_cli, [cli_cod])]
+
+        mod_codes = pd.to_numeric(unopv["UPV_MOD"], errors="coerce").dropna().astype(int).unique()
+        modelli = self.modelli.iloc[self._lookup(self.by_mod_cod, mod_codes)]
+
+        return {
+            "cli_cod": cli_cod,
+            "clienti": clienti,
+            "accounts": accounts,
+            "contracts": contracts,
+            "unopv": unopv,
+            "mod_codes": mod_codes,
+            "modelli": modelli,
+        }
+
+
+def get_relation_index() -> RelationIndex:
+    """Index partagé par le process, reconstruit seulement quand un snapshot change."""
+    tables = {name: load_table(name) for name in TABLES}
+    version = tuple(table_version(name) for name in TABLES)
+    index = _index_cache.get(version)
+    if index is None:
+        with _lock:
+            index = _index_cache.get(version)
+            if index is None:
+                with span("relations.index_build"):
+                    index = RelationIndex(tables)
+                _index_cache.clear()
+                _index_cache[version] = index
+    return index
+
+
+@traced("relations.resolve")
+def resolve_customer(cli_cod) -> dict:
+    return get_relation_index().resolve_customer(cli_cod)
+
+
+def _records(df: pd.DataFrame, columns: list) -> list:
+    df = df[[c for c in columns if c in df.columns]]
+    # cellules vides -> None : les rapports partent en JSON (batch, prompt)
+    return df.astype(object).where(df.notna(), None).to_dict(orient="records")
+
+
+def build_report_data(info: dict, bundle: dict) -> dict:
+    """Assemble le dictionnaire envoyé à l'analyse à partir d'un bundle resolve_customer."""
+    return {
+        "client_info": info,
+        "clienti_match": _records(bundle["clienti"], COLUMNS_CLIENTI),
+        "accounts_match": _records(bundle["accounts"], COLUMNS_ACCOUNTS),
+        "contracts_match": _records(bundle["contracts"], COLUMNS_CONTRACTS),
+        "unopv_match": _records(bundle["unopv"], COLUMNS_UNOPV),
+        "modelli_match": _records(bundle["modelli"], COLUMNS_MODELLI),
+    }
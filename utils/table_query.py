@@ -0,0 +1,104 @@
+"""
+Requêtes paginées sur les snapshots Parquet des tables Vega (pyarrow.dataset).
+
+Le filtre et le tri ne lisent que les colonnes concernées ; seules les lignes de la
+page demandée sont ensuite lues avec les colonnes affichées.
+"""
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from utils.table_store import ensure_snapshot
+
+OPERATORS = ["==", "!=", "<", "<=", ">", ">=", "in", "contains"]
+
+# erreurs possibles sur une saisie de filtre (colonne inconnue, valeur du mauvais type)
+QUERY_ERRORS = (ValueError, KeyError, TypeError, pa.ArrowException)
+
+_ROW = "__row"
+
+
+def open_dataset(name: str) -> ds.Dataset:
+    return ds.dataset(ensure_snapshot(name), format="parquet")
+
+
+def table_schema(name: str) -> pa.Schema:
+    """Schéma lu dans les métadonnées Parquet, sans lire de données."""
+    return open_dataset(name).schema
+
+
+def _coerce(value, arrow_type: pa.DataType):
+    """Convertit une saisie texte vers le type de la colonne."""
+    if isinstance(value, str):
+        value = value.strip()
+    if pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type):
+        number = float(value)
+        return int(number) if pa.types.is_integer(arrow_type) and number.is_integer() else number
+    if pa.types.is_timestamp(arrow_type) or pa.types.is_date(arrow_type):
+        return pa.scalar(pd.Timestamp(value).to_pydatetime()).cast(arrow_type)
+    if pa.types.is_boolean(arrow_type):
+        return str(value).lower() in ("1", "true", "yes", "oui")
+    return str(value)
+
+
+def build_filter(filters, schema: pa.Schema):
+    """[(colonne, opérateur, valeur)] -> expression pyarrow (ET logique), ou None."""
+    expr = None
+    for column, op, value in filters or []:
+        field = ds.field(column)
+        arrow_type = schema.field(column).type
+        if op == "contains":
+            text = field if pa.types.is_string(arrow_type) else field.cast(pa.string())
+            cond = pc.match_substring(text, str(value), ignore_case=True)
+        elif op == "in":
+            values = [_coerce(v, arrow_type) for v in str(value).split(",") if v.strip()]
+            cond = field.isin(values)
+        else:
+            v = _coerce(value, arrow_type)
+            cond = {
+                "==": field == v, "!=": field != v, "<": field < v,
+                "<=": field <= v, ">": field > v, ">=": field >= v,
+            }[op]
+        expr = cond if expr is None else expr & cond
+    return expr
+
+
+def count_rows(name: str, filters=None) -> int:
+    """Nombre de lignes filtrées ; le filtre est évalué par le scanner Parquet."""
+    dataset = open_dataset(name)
+    return dataset.count_rows(filter=build_filter(filters, dataset.schema))
+
+
+def query_table(name: str, columns=None, filters=None, sort=None, descending: bool = False,
+                page: int = 0, page_size: int = 50) -> tuple:
+    """
+    Retourne (page de lignes en DataFrame, nombre total de lignes filtrées).
+    filters : [(colonne, opérateur, valeur)], opérateurs dans OPERATORS.
+    """
+    dataset = open_dataset(name)
+    columns = list(columns or dataset.schema.names)
+    start = max(0, page) * page_size
+    expr = build_filter(filters, dataset.schema)
+
+    if expr is None and sort is None:
+        total = dataset.count_rows()
+        rows = pa.array(range(start, min(start + page_size, total)), type=pa.int64())
+    else:
+        # passe étroite : colonnes du filtre et du tri, plus le numéro de ligne
+        needed = sorted({c for c, _, _ in filters or []} | ({sort} if sort else set()))
+        narrow = dataset.to_table(columns=needed)
+        narrow = narrow.append_column(_ROW, pa.array(range(narrow.num_rows), type=pa.int64()))
+        if expr is not None:
+            narrow = narrow.filter(expr)
+        total = narrow.num_rows
+        if sort:
+            # valeurs nulles en fin de tri (comportement par défaut d'Arrow)
+            order = pc.sort_indices(narrow, sort_keys=[(sort, "descending" if descending else "ascending")])
+            rows = narrow[_ROW].take(order[start:start + page_size])
+        else:
+            rows = narrow[_ROW][start:start + page_size]
+
+    page_df = dataset.take(rows, columns=columns).to_pandas()
+    page_df.index = range(start, start + len(page_df))
+    return page_df, total
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+
+from utils.tracing import count, span
+
+DATA_DIR = Path("documents/table")
+CACHE_ROOT = Path(os.environ.get("VEGA_CACHE_DIR", ".cache"))
+CACHE_DIR = CACHE_ROOT / "tables"
+
+TABLES = ["clienti", "contratti", "ctbcont", "modelli", "unopv"]
+
+_lock = threading.Lock()
+# name -> (signature du xlsx, sha256, DataFrame) partagé par tout le process
+_handles: dict = {}
+
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _signature(path: Path) -> tuple:
+    st = path.stat()
+    return (st.st_mtime_ns, st.st_size)
+
+
+def xlsx_path(name: str) -> Path:
+    return DATA_DIR / f"{name}.xlsx"
+
+
+def snapshot_path(name: str) -> Path:
+    return CACHE_DIR / f"{name}.parquet"
+
+
+def _manifest_path(name: str) -> Path:
+    return CACHE_DIR / f"{name}.json"
+
+
+def _read_manifest(name: str) -> dict:
+    try:
+        return json.loads(_manifest_path(name).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(name: str, manifest: dict) -> None:
+    tmp = _manifest_path(name).with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(manifest))
+    os.replace(tmp, _manifest_path(name))
+
+
+def _to_arrow_safe(df: pd.DataFrame) -> pd.DataFrame:
+    """Convertit en texte les colonnes objet aux types mélangés qu'Arrow refuse."""
+    df = df.copy()
+    for col in df.columns[df.dtypes == object]:
+        try:
+            pa.array(df[col])
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def _build_snapshot(name: str, sha: str, signature: tuple) -> pd.DataFrame:
+    """Parse le xlsx une seule fois et l'écrit en Parquet typé."""
+    count("table.xlsx_parses")
+    with span("table.xlsx_parse", table=name):
+        df = pd.read_excel(xlsx_path(name))
+    df = _to_arrow_safe(df)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = snapshot_path(name).with_suffix(f".{os.getpid()}.tmp")
+    df.to_parquet(tmp, index=False, row_group_size=50_000)
+    os.replace(tmp, snapshot_path(name))
+    _write_manifest(name, {"mtime_ns": signature[0], "size": signature[1], "sha256": sha})
+    # relu depuis le snapshot pour avoir les mêmes dtypes qu'aux chargements suivants
+    return pd.read_parquet(snapshot_path(name))
+
+
+def _refresh(name: str) -> tuple:
+    """Retourne (signature, sha256, DataFrame) à jour pour une table."""
+    path = xlsx_path(name)
+    signature = _signature(path)
+    manifest = _read_manifest(name)
+    snapshot = snapshot_path(name)
+
+    if snapshot.exists() and (manifest.get("mtime_ns"), manifest.get("size")) == signature:
+        return signature, manifest["sha256"], pd.read_parquet(snapshot)
+
+    # mtime modifié : on ne reparse que si le contenu a réellement changé
+    sha = _file_sha256(path)
+    if snapshot.exists() and manifest.get("sha256") == sha:
+        _write_manifest(name, {"mtime_ns": signature[0], "size": signature[1], "sha256": sha})
+        return signature, sha, pd.read_parquet(snapshot)
+
+    return signature, sha, _build_snapshot(name, sha, signature)
+
+
+def load_table(name: str) -> pd.DataFrame:
+    """
+    Retourne la table Vega `name` depuis le cache process, le snapshot Parquet,
+    ou en dernier recours depuis le xlsx. Le DataFrame est partagé : ne pas le modifier.
+    """
+    path = xlsx_path(name)
+    if not path.exists():
+        raise FileNotFoundError(path)
+
+    signature = _signature(path)
+    handle = _handles.get(name)
+    if handle is not None and handle[0] == signature:
+        return handle[2]
+
+    with _lock:
+        handle = _handles.get(name)
+        if handle is None or handle[0] != signature:
+            with span("table.load", table=name):
+                handle = _refresh(name)
+            _handles[name] = handle
+    return handle[2]
+
+
+def ensure_snapshot(name: str) -> Path:
+    """Chemin du snapshot Parquet à jour de `name`, sans charger la table s'il l'est déjà."""
+    path = xlsx_path(name)
+    if not path.exists():
+        raise FileNotFoundError(path)
+    manifest = _read_manifest(name)
+    if not snapshot_path(name).exists() or (manifest.get("mtime_ns"), manifest.get("size")) != _signature(path):
+        load_table(name)
+    return snapshot_path(name)
+
+
+def load_tables(names=TABLES) -> dict:
+    return {name: load_table(name) for name in names}
+
+
+def table_version(name: str) -> str:
+    """Empreinte sha256 du xlsx actuellement chargé pour `name`."""
+    load_table(name)
+    return _handles[name][1]
@@ -0,0 +1,180 @@
+"""
+Traces légères d'une exécution : durée des étapes (spans), pic mémoire, compteurs
+(pages OCR, tokens, hits de cache).
+
+    with start_trace("analyse") as trace:
+        with span("pdf.extract"):
+            ...
+        count("ocr.pages", 3)
+    trace.to_dict()
+
+Sans trace active, span() et count() ne font rien : les modules peuvent être
+instrumentés sans coût pour les appelants qui ne tracent pas. La trace courante
+suit les threads/tâches via contextvars ; use_trace() la transmet explicitement.
+"""
+import contextvars
+import functools
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_current = contextvars.ContextVar("vega_trace", default=None)
+
+
+def peak_rss_bytes():
+    """Pic de mémoire résidente du process (None si indisponible)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss est en octets sur macOS, en kilo-octets ailleurs
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Trace:
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.time()
+        self.spans = []
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+
+    def add_span(self, name: str, start: float, duration: float, **attrs) -> None:
+        entry = {"name": name, "start_s": round(start - self._t0, 4), "duration_s": round(duration, 4),
+                 "peak_rss_mb": _mb(peak_rss_bytes())}
+        entry.update(attrs)
+        with self._lock:
+            self.spans.append(entry)
+
+    def count(self, name: str, n=1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, other: dict, prefix: str = "") -> None:
+        """Ajoute les spans et compteurs d'une trace sérialisée (ex. venue d'un process de pool)."""
+        with self._lock:
+            self.spans.extend(dict(s, name=prefix + s["name"]) for s in other.get("spans", []))
+            for k, v in other.get("counters", {}).items():
+                self.counters[k] = self.counters.get(k, 0) + v
+
+    def breakdown(self) -> list:
+        """Temps total et nombre d'appels par nom de span, du plus coûteux au moins coûteux."""
+        totals = {}
+        for s in self.spans:
+            total, calls = totals.get(s["name"], (0.0, 0))
+            totals[s["name"]] = (total + s["duration_s"], calls + 1)
+        rows = [{"span": k, "total_s": round(t, 4), "calls": c} for k, (t, c) in totals.items()]
+        return sorted(rows, key=lambda r: -r["total_s"])
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "trace": self.name,
+                "started": self.started,
+                "duration_s": round(time.perf_counter() - self._t0, 4),
+                "peak_rss_mb": _mb(peak_rss_bytes()),
+                "spans": list(self.spans),
+                "counters": dict(self.counters),
+            }
+
+
+def _mb(value):
+    return round(value / (1024 * 1024), 1) if value is not None else None
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def start_trace(name: str):
+    trace = Trace(name)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def use_trace(trace):
+    """Rend `trace` courante (ex. dans un thread ou une boucle asyncio qui n'en hérite pas)."""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, time.perf_counter() - start, **attrs)
+
+
+def count(name: str, n=1) -> None:
+    trace = _current.get()
+    if trace is not None:
+        trace.count(name, n)
+
+
+def traced(name: str = None):
+    """Décorateur : un span par appel de la fonction."""
+    def decorator(func):
+        label = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _metric_name(name: str) -> str:
+    return "".join(c if c.isalnum() else "_" for c in name).strip("_").lower()
+
+
+def to_openmetrics(traces: list, prefix: str = "vega") -> str:
+    """Agrège des traces sérialisées au format texte OpenMetrics (sommes, nombres, maxima)."""
+    span_totals, counters, peak = {}, {}, 0.0
+    for t in traces:
+        for s in t.get("spans", []):
+            total, calls = span_totals.get(s["name"], (0.0, 0))
+            span_totals[s["name"]] = (total + s["duration_s"], calls + 1)
+        for k, v in t.get("counters", {}).items():
+            counters[k] = counters.get(k, 0) + v
+        peak = max(peak, t.get("peak_rss_mb") or 0.0)
+
+    lines = [
+        f"# TYPE {prefix}_span_seconds summary",
+        f"# UNIT {prefix}_span_seconds seconds",
+    ]
+    for name, (total, calls) in sorted(span_totals.items()):
+        lines.append(f'{prefix}_span_seconds_sum{{span="{name}"}} {total:.6f}')
+        lines.append(f'{prefix}_span_seconds_count{{span="{name}"}} {calls}')
+    for name, value in sorted(counters.items()):
+        metric = f"{prefix}_{_metric_name(name)}"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}_total {value}")
+    lines += [
+        f"# TYPE {prefix}_peak_rss_bytes gauge",
+        f"{prefix}_peak_rss_bytes {int(peak * 1024 * 1024)}",
+        f"# TYPE {prefix}_traces counter",
+        f"{prefix}_traces_total {len(traces)}",
+        "# EOF",
+    ]
+    return "\n".join(lines) + "\n"
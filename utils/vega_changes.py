@@ -0,0 +1,177 @@
+"""
+Détection des changements entre deux exports Vega.
+
+Chaque ligne est résumée par une empreinte (hash de toutes ses colonnes), indexée
+par la clé primaire de sa table. La référence (« baseline ») est l'état des tables
+lors de la dernière vérification complète ; detect_changes() compare l'export
+courant à cette référence et remonte les clés modifiées jusqu'aux clients (CLI_COD)
+à revérifier :
+
+    clienti.CLI_COD ─┐
+    ctbcont.CTB_COD ─┼─> client
+    contratti        ─┘   via CNTR_SEDELEGALE (= CTB_COD)
+    unopv            ───> via UPV_CLI
+    modelli          ───> via les unopv dont UPV_MOD = MOD_COD
+
+    python -m utils.vega_changes            # résumé JSON des changements
+    python -m utils.vega_changes --commit   # l'export courant devient la référence
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from utils.relations import _key
+from utils.table_store import CACHE_DIR, TABLES, load_table, table_version
+
+PRIMARY_KEYS = {
+    "clienti": "CLI_COD",
+    "ctbcont": "CTB_COD",
+    "contratti": "CNTR_NUMEROCONTRATTO",
+    "unopv": "UPV_COD",
+    "modelli": "MOD_COD",
+}
+
+# colonnes conservées dans la référence pour propager aussi les lignes supprimées
+LINK_COLUMNS = {
+    "contratti": ["CNTR_SEDELEGALE"],
+    "unopv": ["UPV_CLI", "UPV_MOD"],
+}
+
+BASELINE_DIR = CACHE_DIR / "baseline"
+
+
+def baseline_path(name: str):
+    return BASELINE_DIR / f"{name}.parquet"
+
+
+def _normalize_keys(series: pd.Series) -> pd.Series:
+    """Clés comparables d'un export à l'autre (27106, 27106.0 et '27106' -> '27106')."""
+    return series.map(_key).astype(str)
+
+
+def fingerprints(name: str, df: pd.DataFrame = None) -> pd.DataFrame:
+    """Une ligne par ligne de table : key, fp (uint64) et colonnes de liaison."""
+    df = load_table(name) if df is None else df
+    key = PRIMARY_KEYS[name]
+    fp = pd.util.hash_pandas_object(df, index=False)
+    out = pd.DataFrame({"key": _normalize_keys(df[key]), "fp": fp.to_numpy()})
+    for col in LINK_COLUMNS.get(name, []):
+        out[col] = df[col].map(_key).astype(str)
+    return out[df[key].notna().to_numpy()].reset_index(drop=True)
+
+
+def _per_key(fps: pd.DataFrame) -> pd.Series:
+    """Empreinte par clé ; les clés en double combinent les empreintes de leurs lignes (ordre indifférent)."""
+    dup = fps["key"].duplicated(keep=False)
+    single = fps.loc[~dup].set_index("key")["fp"]
+    if not dup.any():
+        return single
+    combined = fps.loc[dup].groupby("key")["fp"].agg(lambda v: hash(tuple(sorted(v))) & (2 ** 64 - 1))
+    return pd.concat([single, combined.astype(np.uint64)])
+
+
+def load_baseline(name: str):
+    path = baseline_path(name)
+    return pd.read_parquet(path) if path.exists() else None
+
+
+def diff_table(name: str, current: pd.DataFrame = None, baseline: pd.DataFrame = None) -> dict:
+    """Clés ajoutées, supprimées et modifiées de `name` depuis la référence."""
+    current = fingerprints(name) if current is None else current
+    baseline = load_baseline(name) if baseline is None else baseline
+    if baseline is None:
+        baseline = current.iloc[0:0]
+
+    new, old = _per_key(current), _per_key(baseline)
+    joined = pd.concat([old.rename("old"), new.rename("new")], axis=1)
+    added = joined.index[joined["old"].isna()]
+    removed = joined.index[joined["new"].isna()]
+    modified = joined.index[joined["old"].notna() & joined["new"].notna() & (joined["old"] != joined["new"])]
+
+    changed = added.union(removed).union(modified)
+    # lignes des deux côtés : une ligne supprimée ou déplacée touche aussi l'ancien client
+    rows = pd.concat([baseline[baseline["key"].isin(changed)], current[current["key"].isin(changed)]])
+    return {
+        "added": sorted(added),
+        "removed": sorted(removed),
+        "modified": sorted(modified),
+        "rows": rows,
+    }
+
+
+def _as_codes(values) -> set:
+    return {_key(v) for v in values if v not in ("None", "nan", "")}
+
+
+def affected_customers(changes: dict) -> set:
+    """Propage les clés modifiées de chaque table jusqu'aux CLI_COD à revérifier."""
+    customers = set()
+    for name in ("clienti", "ctbcont"):
+        if name in changes:
+            customers |= _as_codes(changes[name]["rows"]["key"])
+    if "contratti" in changes:
+        customers |= _as_codes(changes["contratti"]["rows"]["CNTR_SEDELEGALE"])
+    if "unopv" in changes:
+        customers |= _as_codes(changes["unopv"]["rows"]["UPV_CLI"])
+    if "modelli" in changes:
+        mod_codes = set(changes["modelli"]["rows"]["key"])
+        if mod_codes:
+            # distributeurs de ces modèles, dans l'export courant comme dans la référence
+            links = [fingerprints("unopv")]
+            baseline = load_baseline("unopv")
+            if baseline is not None:
+                links.append(baseline)
+            unopv = pd.concat(links)
+            customers |= _as_codes(unopv.loc[unopv["UPV_MOD"].isin(mod_codes), "UPV_CLI"])
+    customers.discard(None)
+    return customers
+
+
+def detect_changes(names=TABLES) -> dict:
+    """
+    Changements de chaque table depuis la référence, et clients concernés.
+    Sans référence (premier passage), toutes les lignes sont « ajoutées ».
+    """
+    changes = {name: diff_table(name) for name in names}
+    return {
+        "tables": {
+            name: {k: change[k] for k in ("added", "removed", "modified")} for name, change in changes.items()
+        },
+        "customers": sorted(affected_customers(changes), key=str),
+        "has_baseline": all(baseline_path(name).exists() for name in names),
+    }
+
+
+def commit_baseline(names=TABLES) -> None:
+    """Enregistre l'export courant comme référence (après une vérification réussie)."""
+    BASELINE_DIR.mkdir(parents=True, exist_ok=True)
+    for name in names:
+        tmp = baseline_path(name).with_suffix(f".{os.getpid()}.tmp")
+        fingerprints(name).assign(version=table_version(name)).to_parquet(tmp, index=False)
+        os.replace(tmp, baseline_path(name))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Changements des tables Vega depuis la dernière vérification.")
+    parser.add_argument("--commit", action="store_true", help="enregistre l'export courant comme référence")
+    parser.add_argument("--keys", action="store_true", help="liste aussi les clés modifiées par table")
+    args = parser.parse_args(argv)
+
+    if args.commit:
+        commit_baseline()
+        print("Référence mise à jour.", file=sys.stderr)
+        return
+
+    result = detect_changes()
+    if not args.keys:
+        result["tables"] = {name: {k: len(v) for k, v in t.items()} for name, t in result["tables"].items()}
+    result["customer_count"] = len(result["customers"])
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()